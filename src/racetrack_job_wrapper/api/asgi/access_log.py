@@ -1,14 +1,37 @@
+import os
 import time
+from typing import Dict, Optional, Tuple
 
 from fastapi import FastAPI, Request, Response
+from prometheus_client import Histogram
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from racetrack_job_wrapper.log.logs import get_logger
-from racetrack_job_wrapper.api.asgi.asgi_server import HIDDEN_ACCESS_LOGS
-from racetrack_job_wrapper.api.metrics import metric_request_duration, metric_requests_done, metric_requests_started
+from racetrack_job_wrapper.api.metrics import (
+    metric_request_duration,
+    metric_requests_done,
+    metric_requests_started,
+    metric_request_size,
+    metric_response_size,
+)
 from racetrack_job_wrapper.api.tracing import get_caller_header_name, get_tracing_header_name, RequestTracingLogger
+from racetrack_job_wrapper.utils.quantity import Quantity
 
 logger = get_logger(__name__)
 
+# Don't print these access logs if occurred
+HIDDEN_ACCESS_LOGS = {
+    'GET /live 200',
+    'GET /live/ 200',
+    'GET /ready 200',
+    'GET /ready/ 200',
+    'GET /health 200',
+    'GET /health/ 200',
+    'GET /metrics 200',
+    'GET /metrics/ 200',
+}
+
 # Don't print these access logs if occurred
 HIDDEN_REQUEST_LOGS = {
     'GET /live',
@@ -45,6 +68,7 @@ def enable_request_access_log(fastapi_app: FastAPI):
 def enable_response_access_log(fastapi_app: FastAPI):
     tracing_header = get_tracing_header_name()
     caller_header = get_caller_header_name()
+    fastapi_app.add_middleware(PayloadSizeMiddleware, log_threshold=_get_payload_size_log_threshold())
 
     @fastapi_app.middleware('http')
     async def access_log(request: Request, call_next) -> Response:
@@ -83,3 +107,93 @@ def enable_response_access_log(fastapi_app: FastAPI):
             request_logger.info(log_line)
 
         return response
+
+
+class PayloadSizeMiddleware:
+    """
+    ASGI middleware measuring the sizes of request and response bodies of every endpoint.
+    It counts the bytes passing through, so chunked requests and streamed responses are measured too.
+    Request size is observed only if the body has been read.
+    """
+
+    def __init__(self, app: ASGIApp, log_threshold: Optional[int] = None) -> None:
+        """
+        :param log_threshold: size of request or response body (in bytes) above which a warning is logged
+        """
+        self.app = app
+        self.log_threshold = log_threshold
+        self._endpoint_metrics: Dict[str, Tuple[Histogram, Histogram]] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_size: Optional[int] = None
+        response_size = 0
+        status_code: Optional[int] = None
+
+        async def receive_counting() -> Message:
+            nonlocal request_size
+            message = await receive()
+            if message['type'] == 'http.request':
+                request_size = (request_size or 0) + len(message.get('body', b''))
+            return message
+
+        async def send_counting(message: Message) -> None:
+            nonlocal response_size, status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            elif message['type'] == 'http.response.body':
+                response_size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counting, send_counting)
+        finally:
+            if status_code is not None:
+                self._observe(scope, request_size, response_size, status_code)
+
+    def _observe(self, scope: Scope, request_size: Optional[int], response_size: int, status_code: int):
+        request_size_metric, response_size_metric = self._get_endpoint_metrics(_get_route_path(scope))
+        if request_size is not None:
+            request_size_metric.observe(request_size)
+        response_size_metric.observe(response_size)
+
+        if self.log_threshold is None or max(request_size or 0, response_size) <= self.log_threshold:
+            return
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        uri = scope['path'] + (f'?{query_string}' if query_string else '')
+        log_line = f'{scope["method"]} {uri} {status_code}'
+        if log_line in HIDDEN_ACCESS_LOGS:
+            return
+        headers = Headers(scope=scope)
+        request_logger = RequestTracingLogger(logger, {
+            'tracing_id': headers.get(get_tracing_header_name()),
+            'caller_name': headers.get(get_caller_header_name()),
+        })
+        request_logger.warning(f'Large payload: {log_line}, '
+                               f'request size: {request_size} bytes, response size: {response_size} bytes')
+
+    def _get_endpoint_metrics(self, endpoint: str) -> Tuple[Histogram, Histogram]:
+        """Return the metrics bound to the endpoint's label, looking them up once per route"""
+        metrics = self._endpoint_metrics.get(endpoint)
+        if metrics is None:
+            metrics = (metric_request_size.labels(endpoint=endpoint), metric_response_size.labels(endpoint=endpoint))
+            self._endpoint_metrics[endpoint] = metrics
+        return metrics
+
+
+def _get_payload_size_log_threshold() -> Optional[int]:
+    """Size of request or response body (eg. 10Mi) above which a warning is logged"""
+    threshold = os.environ.get('PAYLOAD_SIZE_LOG_THRESHOLD')
+    if not threshold:
+        return None
+    return int(Quantity(threshold).plain_number)
+
+
+def _get_route_path(scope: Scope) -> str:
+    """Return path template of the matched route, keeping the number of label values bounded"""
+    route = scope.get('route')
+    path = getattr(route, 'path', None)
+    return path or 'unmatched'
@@ -1,9 +1,10 @@
 import contextlib
 import signal
+import socket
 import sys
 import threading
 import time
-from typing import Union, Callable, Optional
+from typing import List, Union, Callable, Optional
 import logging
 
 import uvicorn
@@ -11,6 +12,7 @@ from uvicorn.config import LOGGING_CONFIG
 from uvicorn.logging import DefaultFormatter, AccessFormatter
 from starlette.types import ASGIApp
 
+from racetrack_job_wrapper.api.asgi.access_log import HIDDEN_ACCESS_LOGS
 from racetrack_job_wrapper.log.exception import log_exception
 from racetrack_job_wrapper.log.logs import get_logger, ColoredFormatter
 from racetrack_job_wrapper.utils.env import is_env_flag_enabled
@@ -18,18 +20,6 @@ from racetrack_job_wrapper.api.debug import is_deployment_local
 
 logger = get_logger(__name__)
 
-# Don't print these access logs if occurred
-HIDDEN_ACCESS_LOGS = {
-    'GET /live 200',
-    'GET /live/ 200',
-    'GET /ready 200',
-    'GET /ready/ 200',
-    'GET /health 200',
-    'GET /health/ 200',
-    'GET /metrics 200',
-    'GET /metrics/ 200',
-}
-
 UVICORN_DEBUG_LOGS = False
 
 
@@ -38,8 +28,18 @@ def serve_asgi_app(
     http_port: int,
     http_addr: str = '0.0.0.0',
     access_log: bool = False,
-    on_shutdown: Optional[Callable[[], None]] = None
+    on_shutdown: Optional[Callable[[], None]] = None,
+    sockets: Optional[List[socket.socket]] = None,
+    heartbeat: Optional[Callable[[], None]] = None,
+    heartbeat_interval: float = 1,
+    graceful_shutdown_timeout: float = 3,
 ):
+    """
+    Run ASGI server until it's stopped by a signal
+    :param sockets: already bound sockets to accept connections on (e.g. shared by worker processes), instead of the port
+    :param heartbeat: function called periodically by the event loop, as long as it's not blocked
+    :param graceful_shutdown_timeout: time given to the requests in progress to finish once the server is stopped
+    """
     use_reloader = is_deployment_local() and isinstance(app, str)
     mode_info = ' in RELOAD mode' if use_reloader else ''
     logger.info(f'Running ASGI server on http://{http_addr}:{http_port}{mode_info}')
@@ -51,8 +51,14 @@ def serve_asgi_app(
         port=http_port,
         log_level="debug",
         reload=use_reloader,
-        timeout_graceful_shutdown=3,
+        timeout_graceful_shutdown=graceful_shutdown_timeout,
     )
+    if heartbeat is not None:
+        async def notify():
+            heartbeat()
+
+        config.callback_notify = notify
+        config.timeout_notify = heartbeat_interval
     server = ManagableServer(config)
 
     def shutdown_signal_handler(sig, frame):
@@ -67,7 +73,7 @@ def serve_asgi_app(
     signal.signal(signal.SIGTERM, shutdown_signal_handler)
     signal.signal(signal.SIGINT, shutdown_signal_handler)
 
-    server.run()
+    server.run(sockets=sockets)
 
 
 def serve_asgi_in_background(
@@ -75,6 +81,7 @@ def serve_asgi_in_background(
     http_port: int,
     http_addr: str = '0.0.0.0',
     access_log: bool = False,
+    sockets: Optional[List[socket.socket]] = None,
 ) -> contextlib.AbstractContextManager:
     logger.info(f'Running ASGI server in background on http://{http_addr}:{http_port}')
     _setup_uvicorn_logs(access_log)
@@ -85,7 +92,7 @@ def serve_asgi_in_background(
         log_level="debug",
         timeout_graceful_shutdown=3,
     )
-    return BackgroundServer(config=config).run_in_thread()
+    return BackgroundServer(config=config).run_in_thread(sockets)
 
 
 def _setup_uvicorn_logs(access_log: bool):
@@ -170,8 +177,8 @@ class BackgroundServer(uvicorn.Server):
         pass
 
     @contextlib.contextmanager
-    def run_in_thread(self):
-        thread = threading.Thread(target=self.run)
+    def run_in_thread(self, sockets: Optional[List[socket.socket]] = None):
+        thread = threading.Thread(target=self.run, args=(sockets,))
         thread.start()
         try:
             while not self.started:
@@ -0,0 +1,94 @@
+import functools
+import json
+import os
+from typing import List, Optional
+
+import anyio
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from racetrack_job_wrapper.api.metrics import metric_request_decompression_saved_bytes
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.utils.compression import DecompressedSizeExceeded, decompress
+
+logger = get_logger(__name__)
+
+# Bigger bodies are decompressed in a worker thread not to block the event loop
+THREAD_MINIMUM_SIZE = 128 * 1024
+
+
+class RequestDecompressionMiddleware:
+    """
+    ASGI middleware transparently decompressing request bodies sent with Content-Encoding header (gzip, deflate, zstd).
+    Inner app receives plain body, as if it was sent uncompressed.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: Optional[int] = None) -> None:
+        self.app = app
+        self.max_size = max_size or int(os.environ.get('MAX_DECOMPRESSED_REQUEST_SIZE', 1024 * 1024 * 1024))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = None
+        for name, value in scope['headers']:
+            if name == b'content-encoding':
+                encoding = value.decode().strip().lower()
+                break
+        if not encoding or encoding == 'identity':
+            await self.app(scope, receive, send)
+            return
+
+        compressed_chunks: List[bytes] = []
+        while True:
+            message: Message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            compressed_chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        compressed_body = b''.join(compressed_chunks)
+
+        try:
+            if len(compressed_body) >= THREAD_MINIMUM_SIZE:
+                body = await anyio.to_thread.run_sync(
+                    functools.partial(decompress, compressed_body, encoding, max_size=self.max_size)
+                )
+            else:
+                body = decompress(compressed_body, encoding, max_size=self.max_size)
+        except DecompressedSizeExceeded as e:
+            await _send_error(send, 413, str(e))
+            return
+        except ValueError as e:
+            await _send_error(send, 415, str(e))
+            return
+        except Exception as e:
+            await _send_error(send, 400, f'failed to decompress request body: {e}')
+            return
+        metric_request_decompression_saved_bytes.labels(encoding=encoding).inc(max(0, len(body) - len(compressed_body)))
+
+        headers = [(name, value) for name, value in scope['headers']
+                   if name not in {b'content-encoding', b'content-length'}]
+        headers.append((b'content-length', str(len(body)).encode()))
+        scope = {**scope, 'headers': headers}
+        body_sent = False
+
+        async def receive_decompressed() -> Message:
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        await self.app(scope, receive_decompressed, send)
+
+
+async def _send_error(send: Send, status_code: int, error: str):
+    content = json.dumps({'error': error, 'type': 'RequestDecompressionError'}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(content)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': content})
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from racetrack_job_wrapper.api.metrics import metric_event_loop_lag
+from racetrack_job_wrapper.api.tracing import RequestTracingLogger, get_tracing_header_name
+from racetrack_job_wrapper.log.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+class EventLoopMonitor:
+    """
+    Watchdog measuring how late the event loop runs scheduled callbacks.
+    A heartbeat task ticks on the loop every interval and a separate thread checks if the ticks keep coming.
+    When the loop is blocked for longer than the threshold, the stack of the loop thread is logged,
+    along with the Tracing ID of the request being served.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float = 0.1, threshold: float = 0.5):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self._loop_thread_id: Optional[int] = None
+        self._last_heartbeat = time.monotonic()
+        self._reported_heartbeat: Optional[float] = None
+        self._stopped = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start monitoring. Has to be called from the loop thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_heartbeat = time.monotonic()
+        self._task = self.loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name='event-loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._task.cancel)
+
+    async def _heartbeat(self):
+        while True:
+            scheduled_at = time.monotonic()
+            self._last_heartbeat = scheduled_at
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - scheduled_at - self.interval
+            metric_event_loop_lag.observe(max(lag, 0))
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            if self.loop.is_closed():
+                return
+            heartbeat = self._last_heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for > self.threshold and heartbeat != self._reported_heartbeat and self.loop.is_running():
+                self._reported_heartbeat = heartbeat  # report every stall once
+                self._report_blocked_loop(blocked_for)
+
+    def _report_blocked_loop(self, blocked_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = ''.join(traceback.format_stack(frame))
+        request_logger = RequestTracingLogger(logger, {'tracing_id': _find_tracing_id(frame)})
+        request_logger.warning(f'Event loop has been blocked for {blocked_for:.3f}s, '
+                               f'it should not run synchronous code. Stack of the loop thread:\n{stack}')
+
+
+def _find_tracing_id(frame: Optional[FrameType]) -> Optional[str]:
+    """Look for an ASGI scope of the request in the callers' frames and read its Tracing ID header"""
+    tracing_header = get_tracing_header_name().lower().encode()
+    while frame is not None:
+        scope = frame.f_locals.get('scope')
+        if isinstance(scope, dict) and scope.get('type') == 'http':
+            for name, value in scope.get('headers', []):
+                if name == tracing_header:
+                    return value.decode()
+        frame = frame.f_back
+    return None
+
+
+class EventLoopMonitorMiddleware:
+    """ASGI middleware starting the event loop monitor on the loop serving the requests"""
+
+    def __init__(self, app: ASGIApp, interval: float = 0.1, threshold: Optional[float] = None) -> None:
+        self.app = app
+        self.interval = interval
+        if threshold is None:
+            threshold = float(os.environ.get('EVENT_LOOP_LAG_THRESHOLD', 0.5))
+        self.threshold = threshold
+        self.monitor: Optional[EventLoopMonitor] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http':
+            loop = asyncio.get_running_loop()
+            if self.monitor is None or self.monitor.loop is not loop:
+                if self.monitor is not None:
+                    self.monitor.stop()
+                self.monitor = EventLoopMonitor(loop, interval=self.interval, threshold=self.threshold)
+                self.monitor.start()
+        await self.app(scope, receive, send)
@@ -1,10 +1,114 @@
-from a2wsgi import WSGIMiddleware
+import gzip
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import anyio
 from fastapi import FastAPI
-from prometheus_client import Counter, Histogram
-from prometheus_client.exposition import make_wsgi_app
-from prometheus_client.registry import REGISTRY
+from prometheus_client import Counter, Histogram, multiprocess
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.registry import REGISTRY, Collector, CollectorRegistry
+from starlette.types import Receive, Scope, Send
 
 from racetrack_job_wrapper.api.asgi.proxy import TrailingSlashForwarder
+from racetrack_job_wrapper.api.runtime_metrics import RuntimeMetricsCollector, install_gc_callback
+from racetrack_job_wrapper.log.logs import get_logger
+
+logger = get_logger(__name__)
+
+_multiprocess_registry: Optional[CollectorRegistry] = None
+_runtime_metrics_collector: Optional[RuntimeMetricsCollector] = None
+_live_gauge_file_regex = re.compile(r'^gauge_live[a-z]*_(?P<pid>\d+)\.db$')
+
+
+def get_multiprocess_dir() -> Optional[str]:
+    """Return directory shared by processes for keeping metric values, if multiprocess mode is enabled"""
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or None
+
+
+def is_multiprocess_mode() -> bool:
+    return get_multiprocess_dir() is not None
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """
+    Return registry exposed at /metrics endpoint.
+    In multiprocess mode, it aggregates metrics of all processes, otherwise it's the default in-process registry.
+    """
+    global _multiprocess_registry
+    if not is_multiprocess_mode():
+        return REGISTRY
+    if _multiprocess_registry is None:
+        _multiprocess_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(_multiprocess_registry)
+    return _multiprocess_registry
+
+
+def register_collector(collector: Collector):
+    """Register custom collector to be exposed at /metrics endpoint"""
+    get_metrics_registry().register(collector)
+
+
+def unregister_collector(collector: Collector):
+    get_metrics_registry().unregister(collector)
+
+
+def reset_multiprocess_dir():
+    """Remove metric files left by the processes of a previous run. Should be called by the main process at startup"""
+    multiproc_dir = get_multiprocess_dir()
+    if multiproc_dir is None:
+        return
+    current_pid_suffix = f'_{os.getpid()}.db'
+    for db_file in Path(multiproc_dir).glob('*.db'):
+        if not db_file.name.endswith(current_pid_suffix):  # current process has its metrics created already
+            db_file.unlink()
+    logger.debug(f'Multiprocess metrics directory cleaned up: {multiproc_dir}')
+
+
+def mark_process_dead(pid: int):
+    """Remove live gauges of a process that has exited, so they are no longer aggregated"""
+    if is_multiprocess_mode():
+        multiprocess.mark_process_dead(pid)
+
+
+def cleanup_dead_processes():
+    """Remove live gauges of all processes that are no longer running"""
+    multiproc_dir = get_multiprocess_dir()
+    if multiproc_dir is None:
+        return
+    dead_pids = set()
+    for filename in os.listdir(multiproc_dir):
+        match = _live_gauge_file_regex.match(filename)
+        if match and not _is_process_alive(int(match.group('pid'))):
+            dead_pids.add(int(match.group('pid')))
+    for pid in dead_pids:
+        multiprocess.mark_process_dead(pid, multiproc_dir)
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _ensure_multiprocess_dir():
+    multiproc_dir = get_multiprocess_dir()
+    if multiproc_dir is not None:
+        Path(multiproc_dir).mkdir(parents=True, exist_ok=True)
+
+
+# Metric files are created along with metrics, so the directory has to exist beforehand
+_ensure_multiprocess_dir()
+
 
 metric_internal_server_errors = Counter(
     'commons_internal_server_errors',
@@ -24,10 +128,110 @@ metric_requests_done = Counter(
     'commons_requests_done',
     'Total number of finished API requests (processed and done)',
 )
+metric_request_decompression_saved_bytes = Counter(
+    'commons_request_decompression_saved_bytes',
+    'Number of bytes saved by receiving compressed request bodies',
+    labelnames=['encoding'],
+)
 
+_payload_size_buckets = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000, 1_000_000_000, float("inf"))
+metric_request_size = Histogram(
+    'commons_request_size_bytes',
+    'Size of API request bodies in bytes, counted as they are received',
+    buckets=_payload_size_buckets,
+    labelnames=['endpoint'],
+)
+metric_response_size = Histogram(
+    'commons_response_size_bytes',
+    'Size of API response bodies in bytes (before compression), counted as they are sent',
+    buckets=_payload_size_buckets,
+    labelnames=['endpoint'],
+)
 
-def setup_metrics_endpoint(api: FastAPI):
+metric_event_loop_lag = Histogram(
+    'commons_event_loop_lag',
+    'Delay in seconds of running the callbacks scheduled on the event loop',
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, float("inf")),
+)
 
-    metrics_app = make_wsgi_app(REGISTRY)
-    api.mount('/metrics', WSGIMiddleware(metrics_app))
+
+def setup_metrics_endpoint(api: FastAPI):
+    global _runtime_metrics_collector
+    if _runtime_metrics_collector is None:
+        _runtime_metrics_collector = RuntimeMetricsCollector()
+        register_collector(_runtime_metrics_collector)
+        install_gc_callback()
+    cache_ttl = float(os.environ.get('METRICS_CACHE_TTL', 1))
+    api.mount('/metrics', MetricsEndpoint(get_metrics_registry(), cache_ttl=cache_ttl,
+                                          runtime_collector=_runtime_metrics_collector))
     TrailingSlashForwarder.mount_path('/metrics')
+
+
+@dataclass
+class _RenderedMetrics:
+    output: bytes
+    content_type: str
+    rendered_at: float
+
+
+class MetricsEndpoint:
+    """
+    ASGI app exposing metrics in Prometheus text format or OpenMetrics format (depending on Accept header),
+    compressed with gzip if the client accepts it.
+    Rendered output is reused for a short time, so that many scrapers don't multiply the cost of rendering.
+    """
+
+    def __init__(
+        self,
+        registry: CollectorRegistry,
+        cache_ttl: float = 1,
+        runtime_collector: Optional[RuntimeMetricsCollector] = None,
+    ):
+        self.registry = registry
+        self.cache_ttl = cache_ttl
+        self.runtime_collector = runtime_collector
+        self._cache: Dict[Tuple[str, bool], _RenderedMetrics] = {}
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return
+        headers = {name.decode().lower(): value.decode() for name, value in scope['headers']}
+        accept = headers.get('accept', '')
+        use_gzip = 'gzip' in headers.get('accept-encoding', '').lower()
+        names: List[str] = parse_qs(scope.get('query_string', b'').decode()).get('name[]', [])
+
+        if self.runtime_collector is not None:
+            self.runtime_collector.update_threadpool_usage()
+        rendered = await anyio.to_thread.run_sync(self._render, accept, use_gzip, names)
+
+        response_headers = [
+            (b'content-type', rendered.content_type.encode()),
+            (b'content-length', str(len(rendered.output)).encode()),
+        ]
+        if use_gzip:
+            response_headers.append((b'content-encoding', b'gzip'))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': rendered.output})
+
+    def _render(self, accept: str, use_gzip: bool, names: List[str]) -> _RenderedMetrics:
+        encoder, content_type = choose_encoder(accept)
+        if names:  # filtered output is not cached
+            return self._render_output(encoder, content_type, use_gzip, self.registry.restricted_registry(names))
+
+        cache_key = (content_type, use_gzip)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None and time.monotonic() - cached.rendered_at < self.cache_ttl:
+                return cached
+            rendered = self._render_output(encoder, content_type, use_gzip, self.registry)
+            self._cache[cache_key] = rendered
+            return rendered
+
+    @staticmethod
+    def _render_output(encoder, content_type: str, use_gzip: bool, registry) -> _RenderedMetrics:
+        cleanup_dead_processes()
+        output = encoder(registry)
+        if use_gzip:
+            output = gzip.compress(output, compresslevel=6)
+        return _RenderedMetrics(output=output, content_type=content_type, rendered_at=time.monotonic())
@@ -0,0 +1,162 @@
+import bisect
+import gc
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import anyio.to_thread
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily, Metric
+from prometheus_client.registry import Collector
+from prometheus_client.utils import floatToGoString
+
+_gc_pause_buckets = (.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, float("inf"))
+
+_cgroup_v2_dir = Path('/sys/fs/cgroup')
+_cgroup_v1_memory_dir = Path('/sys/fs/cgroup/memory')
+# cgroup v1 reports "no limit" as a huge number close to the max int64
+_cgroup_v1_unlimited = 2 ** 62
+
+
+class RuntimeMetricsCollector(Collector):
+    """
+    Collector of the resources used by the current process: memory, garbage collections, threads and file descriptors.
+    In multiprocess mode, it reports the process serving the /metrics request.
+    """
+
+    def __init__(self):
+        self._threadpool_borrowed: Optional[int] = None
+        self._threadpool_total: Optional[float] = None
+
+    def update_threadpool_usage(self):
+        """Read usage of the anyio worker threads. Has to be called from the event loop"""
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        self._threadpool_borrowed = limiter.borrowed_tokens
+        self._threadpool_total = limiter.total_tokens
+
+    def collect(self) -> Iterable[Metric]:
+        rss, uss = read_process_memory()
+        if rss is not None:
+            yield GaugeMetricFamily('commons_memory_rss_bytes', 'Resident set size of the process', value=rss)
+        if uss is not None:
+            yield GaugeMetricFamily('commons_memory_uss_bytes',
+                                    'Unique set size of the process - memory freed if it exits', value=uss)
+
+        usage, limit = _read_cgroup_memory()
+        if usage is not None:
+            yield GaugeMetricFamily('commons_cgroup_memory_usage_bytes', 'Memory used by the container', value=usage)
+        if limit is not None:
+            yield GaugeMetricFamily('commons_cgroup_memory_limit_bytes', 'Memory limit of the container', value=limit)
+
+        collections = CounterMetricFamily('commons_gc_collections', 'Number of garbage collections',
+                                          labels=['generation'])
+        collected = CounterMetricFamily('commons_gc_collected_objects', 'Number of objects collected by garbage collector',
+                                        labels=['generation'])
+        for generation, stats in enumerate(gc.get_stats()):
+            collections.add_metric([str(generation)], stats['collections'])
+            collected.add_metric([str(generation)], stats['collected'])
+        yield collections
+        yield collected
+        yield GaugeMetricFamily('commons_gc_frozen_objects',
+                                'Number of objects in the permanent generation, ignored by garbage collector',
+                                value=gc.get_freeze_count())
+        yield _collect_gc_pauses()
+
+        yield GaugeMetricFamily('commons_threads', 'Number of threads of the process', value=threading.active_count())
+        open_fds = _count_open_fds()
+        if open_fds is not None:
+            yield GaugeMetricFamily('commons_open_fds', 'Number of open file descriptors', value=open_fds)
+
+        if self._threadpool_total is not None:
+            yield GaugeMetricFamily('commons_threadpool_busy_threads',
+                                    'Number of worker threads running synchronous endpoints',
+                                    value=self._threadpool_borrowed)
+            yield GaugeMetricFamily('commons_threadpool_max_threads',
+                                    'Maximum number of worker threads running synchronous endpoints',
+                                    value=self._threadpool_total)
+
+
+_gc_start_times: Dict[int, float] = {}
+# Pauses are aggregated in plain lists and exported at collect time, because the GC callback may run
+# while prometheus_client holds its lock (e.g. allocating a new metric child), which would deadlock on observing.
+# Callbacks never run concurrently, as only one collection can be in progress at a time.
+_gc_pause_counts: List[List[int]] = [[0] * len(_gc_pause_buckets) for _ in range(3)]
+_gc_pause_sums: List[float] = [0.0] * 3
+
+
+def _gc_callback(phase: str, info: Dict):
+    generation = info['generation']
+    if phase == 'start':
+        _gc_start_times[generation] = time.perf_counter()
+    elif phase == 'stop':
+        start_time = _gc_start_times.pop(generation, None)
+        if start_time is not None:
+            duration = time.perf_counter() - start_time
+            _gc_pause_counts[generation][bisect.bisect_left(_gc_pause_buckets, duration)] += 1
+            _gc_pause_sums[generation] += duration
+
+
+def _collect_gc_pauses() -> HistogramMetricFamily:
+    histogram = HistogramMetricFamily('commons_gc_pause_duration', 'Duration of garbage collector pauses in seconds',
+                                      labels=['generation'])
+    for generation, counts in enumerate(_gc_pause_counts):
+        cumulative_buckets = []
+        total = 0
+        for bound, count in zip(_gc_pause_buckets, list(counts)):
+            total += count
+            cumulative_buckets.append((floatToGoString(bound), total))
+        histogram.add_metric([str(generation)], cumulative_buckets, _gc_pause_sums[generation])
+    return histogram
+
+
+def install_gc_callback():
+    """Measure garbage collector pauses"""
+    if _gc_callback not in gc.callbacks:
+        gc.callbacks.append(_gc_callback)
+
+
+def read_process_memory() -> Tuple[Optional[int], Optional[int]]:
+    """Read RSS and USS (private memory) of the current process from /proc/self/smaps_rollup"""
+    try:
+        content = Path('/proc/self/smaps_rollup').read_text()
+    except OSError:
+        return None, None
+    fields: Dict[str, int] = {}
+    for line in content.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == 'kB':
+            fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    rss = fields.get('Rss')
+    uss = None
+    if 'Private_Clean' in fields and 'Private_Dirty' in fields:
+        uss = fields['Private_Clean'] + fields['Private_Dirty']
+    return rss, uss
+
+
+def _read_cgroup_memory() -> Tuple[Optional[int], Optional[int]]:
+    """Read memory usage and limit of the container, supporting both cgroup v2 and v1"""
+    if (_cgroup_v2_dir / 'memory.current').is_file():
+        usage = _read_int_file(_cgroup_v2_dir / 'memory.current')
+        limit = _read_int_file(_cgroup_v2_dir / 'memory.max')  # "max" means no limit
+        return usage, limit
+    usage = _read_int_file(_cgroup_v1_memory_dir / 'memory.usage_in_bytes')
+    limit = _read_int_file(_cgroup_v1_memory_dir / 'memory.limit_in_bytes')
+    if limit is not None and limit >= _cgroup_v1_unlimited:
+        limit = None
+    return usage, limit
+
+
+def _read_int_file(path: Path) -> Optional[int]:
+    try:
+        content = path.read_text().strip()
+    except OSError:
+        return None
+    return int(content) if content.isdigit() else None
+
+
+def _count_open_fds() -> Optional[int]:
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
@@ -1,15 +1,26 @@
+import json
 import os
 from typing import Dict, Any, Optional, Union
 
 import httpx
 from fastapi import Request
 
+from racetrack_job_wrapper.call_cache import job_call_cache, make_cache_key
 from racetrack_job_wrapper.log.logs import get_logger
 from racetrack_job_wrapper.entrypoint import JobEntrypoint
+from racetrack_job_wrapper.metrics import metric_job_call_compression_saved_bytes
 from racetrack_job_wrapper.recordkeeper import set_rk_headers
+from racetrack_job_wrapper.utils.compression import compress, is_zstd_available, SUPPORTED_ENCODINGS
 
 logger = get_logger(__name__)
 
+# Transports replacing network connection with Pub, eg. in-process ones set by LocalPub.activate
+call_transport: Optional[httpx.BaseTransport] = None
+async_call_transport: Optional[httpx.AsyncBaseTransport] = None
+
+_zstd_fallback_warned = False
+_invalid_compression_warned = False
+
 
 def call_job(
     entrypoint: JobEntrypoint,
@@ -19,6 +30,7 @@ def call_job(
     version: str = 'latest',
     method: str = 'POST',
     timeout: Optional[float] = 10,
+    cache_ttl: Optional[float] = None,
 ) -> Any:
     """
     Call another job's endpoint.
@@ -29,15 +41,22 @@ def call_job(
     :param version: version of the job to call. Use exact version or alias, like "latest"
     :param method: HTTP method: GET, POST, PUT, DELETE, etc.
     :param timeout: seconds of network inactivity that raises a timeout exception. None disables all timeouts
+    :param cache_ttl: seconds for which the response can be reused by identical calls. None disables caching
     :return: result object returned by the called job
     """
     src_job = os.environ.get('JOB_NAME')
     try:
-        with httpx.Client(timeout=timeout) as client:
-            request: httpx.Request = _prepare_request(client, entrypoint, job_name, path, payload, version, method)
-            response = client.send(request)
-        response.raise_for_status()
-        return response.json()
+        def _send() -> httpx.Response:
+            with httpx.Client(timeout=timeout, transport=call_transport) as client:
+                request: httpx.Request = _prepare_request(client, entrypoint, job_name, path, payload, version, method)
+                response = client.send(request)
+            response.raise_for_status()
+            return response
+
+        if cache_ttl:
+            cache_key = make_cache_key(job_name, version, path, method, payload)
+            return json.loads(job_call_cache.get_or_fetch(job_name, cache_key, cache_ttl, _send, timeout=timeout))
+        return _send().json()
 
     except httpx.HTTPStatusError as e:
         raise RuntimeError(f'failed to call job "{job_name} {version}" by {src_job}: {e}: {e.response.text}') from e
@@ -53,6 +72,7 @@ async def call_job_coroutine(
     version: str = 'latest',
     method: str = 'POST',
     timeout: Optional[float] = 10,
+    cache_ttl: Optional[float] = None,
 ) -> Any:
     """
     Call another job's endpoint in async coroutine context.
@@ -63,15 +83,23 @@ async def call_job_coroutine(
     :param version: version of the job to call. Use exact version or alias, like "latest"
     :param method: HTTP method: GET, POST, PUT, DELETE, etc.
     :param timeout: seconds of network inactivity that raises a timeout exception. None disables all timeouts
+    :param cache_ttl: seconds for which the response can be reused by identical calls. None disables caching
     :return: result object returned by the called job
     """
     src_job = os.environ.get('JOB_NAME')
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            request: httpx.Request = _prepare_request(client, entrypoint, job_name, path, payload, version, method)
-            response = await client.send(request)
-        response.raise_for_status()
-        return response.json()
+        async def _send() -> httpx.Response:
+            async with httpx.AsyncClient(timeout=timeout, transport=async_call_transport) as client:
+                request: httpx.Request = _prepare_request(client, entrypoint, job_name, path, payload, version, method)
+                response = await client.send(request)
+            response.raise_for_status()
+            return response
+
+        if cache_ttl:
+            cache_key = make_cache_key(job_name, version, path, method, payload)
+            return json.loads(await job_call_cache.get_or_fetch_async(
+                job_name, cache_key, cache_ttl, _send, timeout=timeout))
+        return (await _send()).json()
 
     except httpx.HTTPStatusError as e:
         raise RuntimeError(f'failed to call job "{job_name} {version}" by {src_job}: {e}: {e.response.text}') from e
@@ -115,23 +143,25 @@ def async_job_call(
             outgoing_headers[caller_header] = request.headers.get(caller_header) or ''
         set_rk_headers(outgoing_headers, entrypoint)
 
-        url = f'{internal_pub_url}/async/new/job/{job_name}/{version}{path}'
-        response = httpx.request(method.upper(), url, json=payload, headers=outgoing_headers)
-        response.raise_for_status()
-        task_id: str = response.json()['task_id']
-
-        # Poll the result
-        while True:
-            try:
-                response = httpx.get(f'{internal_pub_url}/async/task/{task_id}/poll', timeout=httpx.Timeout(5, read=60))
-            except httpx.ReadTimeout:
-                continue
-            if response.status_code == 200:
-                break
-            elif response.status_code in {202, 408, 504}:
-                continue
-            else:
-                raise RuntimeError(f'Response error: {response}')
+        with httpx.Client(transport=call_transport) as client:
+            url = f'{internal_pub_url}/async/new/job/{job_name}/{version}{path}'
+            content = _encode_payload(payload, outgoing_headers)
+            response = client.request(method.upper(), url, content=content, headers=outgoing_headers)
+            response.raise_for_status()
+            task_id: str = response.json()['task_id']
+
+            # Poll the result
+            while True:
+                try:
+                    response = client.get(f'{internal_pub_url}/async/task/{task_id}/poll', timeout=httpx.Timeout(5, read=60))
+                except httpx.ReadTimeout:
+                    continue
+                if response.status_code == 200:
+                    break
+                elif response.status_code in {202, 408, 504}:
+                    continue
+                else:
+                    raise RuntimeError(f'Response error: {response}')
 
         return response.json()
 
@@ -168,5 +198,46 @@ def _prepare_request(
         outgoing_headers[caller_header] = request.headers.get(caller_header) or ''
     set_rk_headers(outgoing_headers, entrypoint)
 
-    request: httpx.Request = http_client.build_request(method.upper(), url, json=payload, headers=outgoing_headers)
+    content = _encode_payload(payload, outgoing_headers)
+    request: httpx.Request = http_client.build_request(method.upper(), url, content=content, headers=outgoing_headers)
     return request
+
+
+def _encode_payload(payload: Optional[Dict], outgoing_headers: Dict[str, str]) -> Optional[bytes]:
+    """Encode payload to JSON, compressing it if it exceeds the size threshold configured for outgoing calls"""
+    if payload is None:
+        return None
+    content = json.dumps(payload, separators=(',', ':')).encode()
+    outgoing_headers['Content-Type'] = 'application/json'
+
+    encoding = _get_call_compression()
+    threshold = int(os.environ.get('JOB_CALL_COMPRESSION_THRESHOLD', 32 * 1024))
+    if encoding is None or len(content) < threshold:
+        return content
+    compressed = compress(content, encoding)
+    if len(compressed) >= len(content):
+        return content
+    metric_job_call_compression_saved_bytes.labels(encoding=encoding).inc(len(content) - len(compressed))
+    outgoing_headers['Content-Encoding'] = encoding
+    return compressed
+
+
+def _get_call_compression() -> Optional[str]:
+    encoding = os.environ.get('JOB_CALL_COMPRESSION', 'none').lower()
+    if encoding in {'', 'none', 'identity'}:
+        return None
+    if encoding not in SUPPORTED_ENCODINGS:
+        # a typo in the setting shouldn't break the calls to other jobs
+        global _invalid_compression_warned
+        if not _invalid_compression_warned:
+            logger.warning(f'unsupported JOB_CALL_COMPRESSION: {encoding}, use one of {sorted(SUPPORTED_ENCODINGS)}. '
+                           f'Sending payloads uncompressed')
+            _invalid_compression_warned = True
+        return None
+    if encoding == 'zstd' and not is_zstd_available():
+        global _zstd_fallback_warned
+        if not _zstd_fallback_warned:
+            logger.warning('zstd compression is not available, install "zstandard" package. Falling back to gzip')
+            _zstd_fallback_warned = True
+        return 'gzip'
+    return encoding
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.metrics import (
+    metric_job_call_cache_hits,
+    metric_job_call_cache_misses,
+    metric_job_call_cache_coalesced,
+)
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class _CacheEntry:
+    content: bytes
+    expires_at: float
+
+
+class _InFlightCall:
+    """Outcome of a call that is being made to the network, awaited by the coalesced callers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.content: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+
+class CallCache:
+    """
+    In-memory LRU cache of responses returned by other jobs, bounded by number of entries and total size.
+    Concurrent calls for the same key are coalesced, so only one of them goes to the network.
+    A coalesced caller waits for that call no longer than its own timeout, then it makes the call by itself.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._total_bytes: int = 0
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, _InFlightCall] = {}
+        self._in_flight_async: Dict[str, asyncio.Future] = {}
+
+    def get_or_fetch(
+        self,
+        job_name: str,
+        key: str,
+        ttl: float,
+        fetch: Callable[[], httpx.Response],
+        timeout: Optional[float] = None,
+    ) -> bytes:
+        """
+        Return cached response content or fetch it, unless the identical call is already in progress.
+        :param job_name: name of the called job, used for labelling metrics
+        :param key: cache key identifying the call, see make_cache_key
+        :param ttl: maximum time in seconds the response can be reused
+        :param fetch: function making the actual call, returning successful response
+        :param timeout: seconds to wait for the identical call in progress. None waits until it's done
+        """
+        with self._lock:
+            content = self._get_valid(key)
+            if content is not None:
+                metric_job_call_cache_hits.labels(job_name=job_name).inc()
+                return content
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = _InFlightCall()
+                self._in_flight[key] = in_flight
+
+        if not leader:
+            if in_flight.done.wait(timeout):
+                metric_job_call_cache_coalesced.labels(job_name=job_name).inc()
+                if in_flight.error is not None:
+                    # leader's exception is shared, so raise a new one instead of modifying its traceback
+                    raise RuntimeError(f'coalesced call failed: {in_flight.error}') from in_flight.error
+                return in_flight.content
+            logger.warning(f'identical call to {job_name} has not finished in {timeout}s, calling it directly')
+            metric_job_call_cache_misses.labels(job_name=job_name).inc()
+            response = fetch()
+            self._store(key, response, ttl)
+            return response.content
+
+        metric_job_call_cache_misses.labels(job_name=job_name).inc()
+        try:
+            response = fetch()
+            self._store(key, response, ttl)
+            in_flight.content = response.content
+            return response.content
+        except BaseException as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.done.set()
+
+    async def get_or_fetch_async(
+        self,
+        job_name: str,
+        key: str,
+        ttl: float,
+        fetch: Callable[[], Awaitable[httpx.Response]],
+        timeout: Optional[float] = None,
+    ) -> bytes:
+        """Coroutine counterpart of get_or_fetch"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            content = self._get_valid(key)
+            if content is not None:
+                metric_job_call_cache_hits.labels(job_name=job_name).inc()
+                return content
+            future = self._in_flight_async.get(key)
+            leader = future is None or future.get_loop() is not loop
+            if leader:
+                future = loop.create_future()
+                self._in_flight_async[key] = future
+
+        if not leader:
+            try:
+                content = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f'identical call to {job_name} has not finished in {timeout}s, calling it directly')
+                metric_job_call_cache_misses.labels(job_name=job_name).inc()
+                response = await fetch()
+                self._store(key, response, ttl)
+                return response.content
+            except Exception as e:
+                metric_job_call_cache_coalesced.labels(job_name=job_name).inc()
+                raise RuntimeError(f'coalesced call failed: {e}') from e
+            metric_job_call_cache_coalesced.labels(job_name=job_name).inc()
+            return content
+
+        metric_job_call_cache_misses.labels(job_name=job_name).inc()
+        try:
+            response = await fetch()
+            self._store(key, response, ttl)
+            future.set_result(response.content)
+            return response.content
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark as retrieved in case no one else was waiting for it
+            raise
+        finally:
+            with self._lock:
+                if self._in_flight_async.get(key) is future:
+                    del self._in_flight_async[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _get_valid(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.content
+
+    def _store(self, key: str, response: httpx.Response, ttl: float):
+        ttl = cache_ttl_from_headers(response.headers, ttl)
+        content = response.content
+        if ttl <= 0 or len(content) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _CacheEntry(content=content, expires_at=time.monotonic() + ttl)
+            self._total_bytes += len(content)
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= len(entry.content)
+
+
+def make_cache_key(job_name: str, version: str, path: str, method: str, payload: Optional[Dict[str, Any]]) -> str:
+    """Build cache key out of the called endpoint and the hash of the payload"""
+    payload_json = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    payload_hash = hashlib.sha256(payload_json.encode()).hexdigest()
+    return f'{method.upper()} {job_name}/{version}{path} {payload_hash}'
+
+
+def cache_ttl_from_headers(headers: httpx.Headers, ttl: float) -> float:
+    """Limit caller's TTL according to the Cache-Control header sent by the callee"""
+    cache_control = headers.get('cache-control')
+    if not cache_control:
+        return ttl
+    directives: Dict[str, str] = {}
+    for directive in cache_control.split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    max_age = directives.get('max-age')
+    if max_age is not None and max_age.isdigit():
+        return min(ttl, int(max_age))
+    return ttl
+
+
+job_call_cache = CallCache(
+    max_entries=int(os.environ.get('JOB_CALL_CACHE_MAX_ENTRIES', 1024)),
+    max_bytes=int(os.environ.get('JOB_CALL_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+)
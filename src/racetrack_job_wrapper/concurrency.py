@@ -23,3 +23,33 @@ class AtomicInteger:
     def value(self, v):
         with self._lock:
             self._value = int(v)
+
+
+class LockFreeReadGauge:
+    """
+    Integer gauge that can be read without taking a lock.
+    Writes are serialized by a lock and publish the new value with a single assignment,
+    so readers always see a complete value, the latest one or the one just before it.
+    """
+
+    def __init__(self, value=0):
+        self._value = int(value)
+        self._lock = threading.Lock()
+
+    def inc(self, d=1) -> int:
+        with self._lock:
+            self._value += int(d)
+            return self._value
+
+    def dec(self, d=1) -> int:
+        return self.inc(-d)
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    @value.setter
+    def value(self, v):
+        with self._lock:
+            self._value = int(v)
+
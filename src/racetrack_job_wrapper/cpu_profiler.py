@@ -0,0 +1,327 @@
+import collections
+import html
+import math
+import os
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Counter, Deque, Dict, List, Optional, Set, Tuple
+
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.metrics import metric_continuous_profiler_cpu_seconds
+from racetrack_job_wrapper.utils.env import is_env_flag_enabled
+
+logger = get_logger(__name__)
+
+Stack = Tuple[str, ...]
+
+# Leaf frames of the threads waiting for work, not using CPU
+_IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+}
+
+
+class CpuProfiler:
+    """
+    Statistical profiler sampling the stacks of all the threads (including worker threads running the endpoints)
+    at a fixed interval. Threads waiting for work are skipped, so the samples show where the CPU time is spent.
+    """
+    sampler: Optional['StackSampler'] = None
+    last_stacks: Counter[Stack] = collections.Counter()
+    SPEEDSCOPE_FILENAME = 'cpu-profile.speedscope.json'
+    COLLAPSED_FILENAME = 'cpu-profile.collapsed.txt'
+    FLAMEGRAPH_FILENAME = 'cpu-flamegraph.svg'
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return is_env_flag_enabled('CPU_PROFILER', 'false')
+
+    @classmethod
+    def get_interval(cls) -> float:
+        return float(os.environ.get('CPU_PROFILER_INTERVAL', 0.01))
+
+    @classmethod
+    def start(cls):
+        if cls.sampler is not None:
+            return
+        cls.sampler = StackSampler(cls.get_interval())
+        cls.sampler.start()
+        logger.info('CPU profiler started')
+
+    @classmethod
+    def stop(cls):
+        if cls.sampler is None:
+            return
+        cls.sampler.stop()
+        cls.last_stacks = cls.sampler.get_stacks()
+        cls.sampler = None
+        logger.info(f'CPU profiler stopped, {sum(cls.last_stacks.values())} samples collected')
+
+    @classmethod
+    def get_stacks(cls) -> Counter[Stack]:
+        """Return samples of the ongoing session or the last finished one"""
+        if cls.sampler is not None:
+            return cls.sampler.get_stacks()
+        return cls.last_stacks
+
+    @classmethod
+    def get_collapsed_output(cls) -> str:
+        """Return samples in collapsed stack format, supported by flamegraph.pl, speedscope and others"""
+        stacks = cls.get_stacks()
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in sorted(stacks.items()))
+
+    @classmethod
+    def get_speedscope_output(cls) -> Dict:
+        """Return samples in speedscope format (https://www.speedscope.app), having a separate profile for each thread"""
+        return to_speedscope_format(cls.get_stacks())
+
+    @classmethod
+    def get_flamegraph_svg(cls) -> str:
+        return render_flamegraph_svg(cls.get_stacks())
+
+
+class ContinuousProfiler:
+    """
+    Always-on sampling profiler running at a low rate and keeping the last minutes of samples in memory,
+    so the flame graph of an incident can be pulled after it happened.
+    """
+    sampler: Optional['RollingStackSampler'] = None
+    SLOT_DURATION = 10
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return is_env_flag_enabled('CONTINUOUS_PROFILER', 'false')
+
+    @classmethod
+    def start(cls):
+        if cls.sampler is not None:
+            return
+        frequency = float(os.environ.get('CONTINUOUS_PROFILER_FREQUENCY', 19))
+        retention = float(os.environ.get('CONTINUOUS_PROFILER_RETENTION', 900))
+        slots = max(1, math.ceil(retention / cls.SLOT_DURATION))
+        cls.sampler = RollingStackSampler(1 / frequency, slot_duration=cls.SLOT_DURATION, slots=slots)
+        cls.sampler.start()
+        logger.info(f'Continuous profiler started, sampling at {frequency} Hz and keeping last {retention}s')
+
+    @classmethod
+    def stop(cls):
+        if cls.sampler is None:
+            return
+        cls.sampler.stop()
+        cls.sampler = None
+
+    @classmethod
+    def get_stacks(cls, since: Optional[float] = None, until: Optional[float] = None) -> Counter[Stack]:
+        if cls.sampler is None:
+            return collections.Counter()
+        return cls.sampler.get_stacks(since, until)
+
+
+def to_speedscope_format(stacks: Counter[Stack], name: str = 'CPU profile') -> Dict:
+    """Convert samples to speedscope format. The first item of every stack is a thread name"""
+    frames: List[Dict] = []
+    frame_indices: Dict[str, int] = {}
+    thread_samples: Dict[str, Tuple[List[List[int]], List[int]]] = {}
+    for stack, count in sorted(stacks.items()):
+        thread_name, frame_names = stack[0], stack[1:]
+        indices = []
+        for frame_name in frame_names:
+            if frame_name not in frame_indices:
+                frame_indices[frame_name] = len(frames)
+                frames.append({'name': frame_name})
+            indices.append(frame_indices[frame_name])
+        samples, weights = thread_samples.setdefault(thread_name, ([], []))
+        samples.append(indices)
+        weights.append(count)
+
+    profiles = [{
+        'type': 'sampled',
+        'name': thread_name,
+        'unit': 'none',
+        'startValue': 0,
+        'endValue': sum(weights),
+        'samples': samples,
+        'weights': weights,
+    } for thread_name, (samples, weights) in thread_samples.items()]
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'racetrack_job_wrapper',
+        'shared': {'frames': frames},
+        'profiles': profiles,
+    }
+
+
+class StackSampler:
+    """
+    Thread sampling the stacks of other threads at a fixed interval
+    :param thread_ids: sample only these threads, all of them if not given
+    :param include_idle: whether to sample the threads waiting for work
+    """
+
+    def __init__(self, interval: float, thread_ids: Optional[Set[int]] = None, include_idle: bool = False):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.include_idle = include_idle
+        self._stacks: Counter[Stack] = collections.Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._code_labels: Dict[CodeType, str] = {}
+        self._thread = threading.Thread(target=self._run, name='cpu-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def get_stacks(self) -> Counter[Stack]:
+        with self._lock:
+            return self._stacks.copy()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            self._record(self._sample(own_id))
+
+    def _sample(self, own_id: int) -> List[Stack]:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        samples = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                continue
+            if not self.include_idle and _is_idle(frame):
+                continue
+            thread_name = thread_names.get(thread_id, str(thread_id))
+            samples.append((thread_name,) + self._frame_stack(frame))
+        return samples
+
+    def _record(self, samples: List[Stack]):
+        with self._lock:
+            self._stacks.update(samples)
+
+    def _frame_stack(self, frame: Optional[FrameType]) -> Stack:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._code_labels.get(code)
+            if label is None:
+                label = self._code_labels[code] = f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})'
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+
+class RollingStackSampler(StackSampler):
+    """
+    Stack sampler keeping the samples aggregated in time slots of a fixed-size ring buffer.
+    When the buffer is full, the oldest slot is dropped, so the memory usage is bounded.
+    CPU time spent on sampling is counted in continuous_profiler_cpu_seconds metric.
+    """
+
+    def __init__(self, interval: float, slot_duration: float, slots: int):
+        super().__init__(interval)
+        self.slot_duration = slot_duration
+        self._slots: Deque[Tuple[float, Counter[Stack]]] = collections.deque(maxlen=slots)
+        self._last_cpu_time = 0.0
+
+    def get_stacks(self, since: Optional[float] = None, until: Optional[float] = None) -> Counter[Stack]:
+        """Return samples of the slots overlapping the time window, given as UNIX timestamps"""
+        stacks: Counter[Stack] = collections.Counter()
+        with self._lock:
+            for slot_start, slot_stacks in self._slots:
+                if since is not None and slot_start + self.slot_duration <= since:
+                    continue
+                if until is not None and slot_start > until:
+                    continue
+                stacks.update(slot_stacks)
+        return stacks
+
+    def _record(self, samples: List[Stack]):
+        now = time.time()
+        with self._lock:
+            if not self._slots or now >= self._slots[-1][0] + self.slot_duration:
+                self._slots.append((now - now % self.slot_duration, collections.Counter()))
+            self._slots[-1][1].update(samples)
+        cpu_time = time.thread_time()
+        metric_continuous_profiler_cpu_seconds.inc(cpu_time - self._last_cpu_time)
+        self._last_cpu_time = cpu_time
+
+
+def _is_idle(frame: FrameType) -> bool:
+    code = frame.f_code
+    return (Path(code.co_filename).name, code.co_name) in _IDLE_FRAMES
+
+
+class _FlameNode:
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+        self.children: Dict[str, '_FlameNode'] = {}
+
+
+def render_flamegraph_svg(stacks: Counter[Stack], width: int = 1200, row_height: int = 16) -> str:
+    """Render samples as a flame graph in SVG format, with the root frames at the bottom"""
+    root = _FlameNode('all')
+    max_depth = 0
+    for stack, count in stacks.items():
+        root.value += count
+        node = root
+        for frame_name in stack:
+            node = node.children.setdefault(frame_name, _FlameNode(frame_name))
+            node.value += count
+        max_depth = max(max_depth, len(stack))
+
+    height = (max_depth + 1) * row_height
+    elements: List[str] = []
+
+    def render(node: _FlameNode, x: float, depth: int):
+        node_width = node.value / root.value * width if root.value else width
+        if node_width < 0.5:
+            return
+        y = height - (depth + 1) * row_height
+        percent = node.value / root.value * 100 if root.value else 100
+        title = html.escape(f'{node.name} ({node.value} samples, {percent:.2f}%)')
+        label = html.escape(_fit_text(node.name, node_width))
+        elements.append(
+            f'<g><title>{title}</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{node_width:.1f}" height="{row_height - 1}" fill="{_frame_color(node.name)}"/>'
+            f'<text x="{x + 3:.1f}" y="{y + row_height - 4}">{label}</text></g>'
+        )
+        child_x = x
+        for child in node.children.values():
+            render(child, child_x, depth + 1)
+            child_x += child.value / root.value * width
+
+    render(root, 0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">\n'
+        + '\n'.join(elements)
+        + '\n</svg>\n'
+    )
+
+
+def _fit_text(text: str, box_width: float, char_width: float = 7) -> str:
+    max_chars = int((box_width - 6) / char_width)
+    if max_chars < 3:
+        return ''
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 2] + '..'
+
+
+def _frame_color(name: str) -> str:
+    hash_value = zlib.crc32(name.encode())
+    red = 205 + hash_value % 50
+    green = (hash_value >> 8) % 200
+    blue = (hash_value >> 16) % 55
+    return f'rgb({red},{green},{blue})'
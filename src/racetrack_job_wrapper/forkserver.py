@@ -0,0 +1,515 @@
+import enum
+import mmap
+import os
+import random
+import signal
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from prometheus_client.metrics_core import CounterMetricFamily, Metric
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from racetrack_job_wrapper.api.asgi.asgi_reloader import ASGIReloader
+from racetrack_job_wrapper.api.asgi.asgi_server import serve_asgi_app, serve_asgi_in_background
+from racetrack_job_wrapper.api.metrics import mark_process_dead, register_collector, reset_multiprocess_dir
+from racetrack_job_wrapper.api.runtime_metrics import read_process_memory
+from racetrack_job_wrapper.entrypoint import JobEntrypoint
+from racetrack_job_wrapper.gc_tuning import tune_garbage_collector
+from racetrack_job_wrapper.health import HealthState
+from racetrack_job_wrapper.loader import instantiate_class_entrypoint
+from racetrack_job_wrapper.log.context_error import ContextError
+from racetrack_job_wrapper.log.exception import log_exception, short_exception_details
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.utils.quantity import Quantity
+from racetrack_job_wrapper.validate import validate_entrypoint
+from racetrack_job_wrapper.warmup import warm_up_job
+from racetrack_job_wrapper.wrapper import read_job_manifest_dict
+from racetrack_job_wrapper.wrapper_api import create_api_app, create_health_app
+
+logger = get_logger(__name__)
+
+# Worker dying sooner than that after its start is restarted with a delay, to avoid a crash loop
+MIN_WORKER_UPTIME = 1.0
+RESTART_DELAY = 1.0
+# Interval of updating the worker's slot by its event loop
+HEARTBEAT_INTERVAL = 1.0
+# Default time given to a recycled worker to finish its requests in progress, covering long inference calls
+DEFAULT_DRAIN_TIMEOUT = 600.0
+
+
+class WorkerState(enum.IntEnum):
+    EMPTY = 0
+    STARTING = 1
+    READY = 2
+    DRAINING = 3
+    DEAD = 4
+
+
+class RecycleReason(enum.IntEnum):
+    NONE = 0
+    MAX_REQUESTS = 1
+    MEMORY_GROWTH = 2
+
+
+@dataclass
+class WorkerInfo:
+    slot: int
+    pid: int
+    state: WorkerState
+    started_at: float
+    heartbeat_at: float
+    recycle_reason: RecycleReason = RecycleReason.NONE
+
+
+class WorkerRegistry:
+    """
+    States of the worker processes, kept in memory shared by the template process and the workers forked from it.
+    Every slot is written by the worker occupying it,
+    and by the template process before forking the worker and once the worker exits.
+    Number of recycled workers is kept after the slots, written only by the template process,
+    so it outlives the recycled workers and can be reported by any of them.
+    """
+    _slot_struct = struct.Struct('qBBdd')  # pid, state, recycle reason, start timestamp, heartbeat timestamp
+    _heartbeat_struct = struct.Struct('d')
+    _heartbeat_offset = _slot_struct.size - _heartbeat_struct.size
+    _counter_struct = struct.Struct('q')
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._counters_offset = self._slot_struct.size * slots
+        self._memory = mmap.mmap(-1, self._counters_offset + self._counter_struct.size * len(RecycleReason))
+
+    def get(self, slot: int) -> WorkerInfo:
+        pid, state, recycle_reason, started_at, heartbeat_at = \
+            self._slot_struct.unpack_from(self._memory, slot * self._slot_struct.size)
+        return WorkerInfo(slot=slot, pid=pid, state=WorkerState(state), started_at=started_at,
+                          heartbeat_at=heartbeat_at, recycle_reason=RecycleReason(recycle_reason))
+
+    def set(self, slot: int, pid: int, state: WorkerState, started_at: float):
+        self._slot_struct.pack_into(self._memory, slot * self._slot_struct.size,
+                                    pid, state, RecycleReason.NONE, started_at, started_at)
+
+    def set_state(self, slot: int, state: WorkerState, recycle_reason: Optional[RecycleReason] = None):
+        info = self.get(slot)
+        if recycle_reason is None:
+            recycle_reason = info.recycle_reason
+        self._slot_struct.pack_into(self._memory, slot * self._slot_struct.size,
+                                    info.pid, state, recycle_reason, info.started_at, time.time())
+
+    def count_recycle(self, reason: RecycleReason):
+        count, = self._counter_struct.unpack_from(self._memory, self._counter_offset(reason))
+        self._counter_struct.pack_into(self._memory, self._counter_offset(reason), count + 1)
+
+    def get_recycle_counts(self) -> Dict[RecycleReason, int]:
+        return {reason: self._counter_struct.unpack_from(self._memory, self._counter_offset(reason))[0]
+                for reason in RecycleReason if reason != RecycleReason.NONE}
+
+    def _counter_offset(self, reason: RecycleReason) -> int:
+        return self._counters_offset + self._counter_struct.size * reason
+
+    def heartbeat(self, slot: int):
+        """Record that the worker is still responsive"""
+        self._heartbeat_struct.pack_into(self._memory, slot * self._slot_struct.size + self._heartbeat_offset,
+                                         time.time())
+
+    def describe(self) -> List[Dict]:
+        """Return JSON-serializable states of the workers"""
+        now = time.time()
+        workers = []
+        for slot in range(self.slots):
+            info = self.get(slot)
+            if info.state == WorkerState.EMPTY:
+                continue
+            workers.append({
+                'slot': slot,
+                'pid': info.pid,
+                'state': info.state.name.lower(),
+                'uptime': round(now - info.started_at, 3),
+            })
+        return workers
+
+
+class WorkerSupervisor:
+    """
+    Supervisor running in the template process, which has the entrypoint loaded.
+    It forks the workers, so they share the memory of the loaded entrypoint through copy-on-write,
+    and keeps the number of active workers by forking the replacements of the workers that exit or drain.
+    """
+
+    def __init__(
+        self,
+        worker_count: int,
+        registry: WorkerRegistry,
+        run_worker: Callable[[int], None],
+        shutdown_timeout: float = 10,
+        startup_timeout: float = 120,
+        heartbeat_timeout: float = 30,
+        drain_timeout: float = DEFAULT_DRAIN_TIMEOUT,
+    ):
+        """
+        :param worker_count: number of workers serving the requests, excluding the draining ones
+        :param registry: shared states of the workers, having room for the draining workers along with the active ones
+        :param run_worker: function serving the requests in a forked worker, given its slot number
+        :param shutdown_timeout: time given to the workers to finish their requests after being asked to stop
+        :param startup_timeout: time given to a worker to become ready before it's killed and replaced
+        :param heartbeat_timeout: time after which a worker not updating its slot is considered hung and replaced
+        :param drain_timeout: time given to a recycled worker to finish its requests in progress
+        """
+        self.worker_count = worker_count
+        self.registry = registry
+        self.run_worker = run_worker
+        self.shutdown_timeout = shutdown_timeout
+        self.startup_timeout = startup_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.drain_timeout = drain_timeout
+        self._worker_slots: Dict[int, int] = {}  # pid -> slot
+        self._killed_pids: Set[int] = set()
+        self._restart_not_before = 0.0  # monotonic time
+        self._stopped = threading.Event()
+
+    def run(self):
+        """Start the workers and keep replacing the dead and draining ones until a termination signal is received"""
+        signal.signal(signal.SIGTERM, self._handle_stop_signal)
+        signal.signal(signal.SIGINT, self._handle_stop_signal)
+
+        while True:
+            self._reap_workers()
+            self._kill_unresponsive_workers()
+            self._spawn_missing_workers()
+            if self._stopped.wait(0.1):
+                break
+
+        self._stop_workers()
+
+    def _handle_stop_signal(self, sig, frame):
+        logger.info(f'received signal {sig}, stopping workers...')
+        self._stopped.set()
+
+    def _kill_unresponsive_workers(self):
+        """Kill the workers stuck on startup or not updating their slots, so they get replaced"""
+        now = time.time()
+        for pid, slot in self._worker_slots.items():
+            if pid in self._killed_pids:
+                continue
+            info = self.registry.get(slot)
+            if info.state == WorkerState.STARTING and now - info.started_at > self.startup_timeout:
+                logger.error(f'Worker {slot} (PID {pid}) has not become ready in {self.startup_timeout}s, killing it')
+            elif info.state == WorkerState.READY and now - info.heartbeat_at > self.heartbeat_timeout:
+                logger.error(f'Worker {slot} (PID {pid}) has not responded for {now - info.heartbeat_at:.1f}s, '
+                             f'killing it')
+            # event loop of a draining worker stops sending heartbeats, it's given time to finish its requests instead
+            elif info.state == WorkerState.DRAINING \
+                    and now - info.heartbeat_at > self.drain_timeout + self.heartbeat_timeout:
+                logger.error(f'Worker {slot} (PID {pid}) has not finished draining in {self.drain_timeout}s, '
+                             f'killing it')
+            else:
+                continue
+            self._killed_pids.add(pid)
+            _send_signal(pid, signal.SIGKILL)
+
+    def _spawn_missing_workers(self):
+        active_slots = [slot for slot in self._worker_slots.values()
+                        if self.registry.get(slot).state in {WorkerState.STARTING, WorkerState.READY}]
+        missing = self.worker_count - len(active_slots)
+        if missing <= 0 or time.monotonic() < self._restart_not_before:
+            return
+        occupied_slots = set(self._worker_slots.values())
+        free_slots = [slot for slot in range(self.registry.slots) if slot not in occupied_slots]
+        for slot in free_slots[:missing]:
+            self._spawn_worker(slot)
+
+    def _spawn_worker(self, slot: int):
+        started_at = time.time()
+        # mark the slot before forking, so the worker is counted as active right away
+        self.registry.set(slot, 0, WorkerState.STARTING, started_at)
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self.registry.set(slot, os.getpid(), WorkerState.STARTING, started_at)
+                self.run_worker(slot)
+            except BaseException as e:
+                log_exception(ContextError('Worker error', e))
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self._worker_slots[pid] = slot
+        logger.info(f'Worker {slot} forked with PID {pid}')
+
+    def _reap_workers(self):
+        while self._worker_slots:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self._worker_slots.pop(pid, None)
+            killed = pid in self._killed_pids
+            self._killed_pids.discard(pid)
+            if slot is None:
+                continue
+            mark_process_dead(pid)
+            info = self.registry.get(slot)
+            self.registry.set_state(slot, WorkerState.DEAD)
+            if self._stopped.is_set():
+                continue
+            if info.state == WorkerState.DRAINING and info.recycle_reason != RecycleReason.NONE:
+                self.registry.count_recycle(info.recycle_reason)
+            if info.state == WorkerState.DRAINING and not killed:
+                logger.info(f'Worker {slot} (PID {pid}) has been recycled')
+                continue
+            logger.warning(f'Worker {slot} (PID {pid}) exited with code {os.waitstatus_to_exitcode(status)}, '
+                           f'starting a new one')
+            if time.time() - info.started_at < MIN_WORKER_UPTIME:
+                self._restart_not_before = time.monotonic() + RESTART_DELAY
+
+    def _stop_workers(self):
+        for pid in self._worker_slots:
+            _send_signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self._worker_slots and time.monotonic() < deadline:
+            self._reap_workers()
+            time.sleep(0.05)
+        for pid in self._worker_slots:
+            logger.warning(f'Worker with PID {pid} did not stop in time, killing it')
+            _send_signal(pid, signal.SIGKILL)
+        while self._worker_slots:
+            pid, _ = os.waitpid(-1, 0)
+            self._worker_slots.pop(pid, None)
+
+
+class WorkerRecyclesCollector(Collector):
+    """Collector reporting the number of workers recycled so far, as counted by the template process"""
+
+    def __init__(self, registry: WorkerRegistry):
+        self.registry = registry
+
+    def collect(self) -> Iterable[Metric]:
+        recycles = CounterMetricFamily('worker_recycles', 'Number of worker processes recycled due to reaching '
+                                       'the limit of requests or memory growth', labels=['reason'])
+        for reason, count in self.registry.get_recycle_counts().items():
+            recycles.add_metric([reason.name.lower()], count)
+        yield recycles
+
+
+class WorkerRecycleMiddleware:
+    """
+    ASGI middleware recycling the worker process once it has served the maximum number of requests
+    or its memory has grown by more than the limit since it became ready.
+    Limits are checked after every request and by calling check_limits periodically, so idle workers are recycled too.
+    The worker stops accepting new connections, finishes the requests in progress (up to the drain timeout) and exits,
+    while the template process forks its replacement.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        recycle: Callable[[RecycleReason], None],
+        max_requests: Optional[int] = None,
+        max_rss_growth: Optional[int] = None,
+        rss_check_interval: float = 1.0,
+    ) -> None:
+        """
+        :param recycle: function draining the worker, given the reason of recycling
+        :param max_requests: number of requests served by the worker before it's recycled
+        :param max_rss_growth: growth of the resident memory (in bytes) that makes the worker recycled
+        """
+        self.app = app
+        self.recycle = recycle
+        self.max_requests = max_requests
+        self.max_rss_growth = max_rss_growth
+        self.rss_check_interval = rss_check_interval
+        self.requests_served = 0
+        self.recycling = False
+        self._baseline_rss = read_process_memory()[0] if max_rss_growth else None
+        self._last_rss_check = time.monotonic()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or _is_probe_path(scope['path']):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.requests_served += 1
+            self.check_limits()
+
+    def reset_limits(self):
+        """Start counting the requests and the memory growth from now on, once the worker is ready"""
+        self.requests_served = 0
+        if self.max_rss_growth:
+            self._baseline_rss = read_process_memory()[0]
+
+    def check_limits(self):
+        """Recycle the worker if it has reached any of the limits. Has to be called from the event loop"""
+        if self.recycling:
+            return
+        reason = self._get_recycle_reason()
+        if reason is not None:
+            self.recycling = True
+            self.recycle(reason)
+
+    def _get_recycle_reason(self) -> Optional[RecycleReason]:
+        if self.max_requests and self.requests_served >= self.max_requests:
+            return RecycleReason.MAX_REQUESTS
+        if self._baseline_rss is not None and time.monotonic() - self._last_rss_check >= self.rss_check_interval:
+            self._last_rss_check = time.monotonic()
+            rss = read_process_memory()[0]
+            if rss is not None and rss - self._baseline_rss > self.max_rss_growth:
+                return RecycleReason.MEMORY_GROWTH
+        return None
+
+
+def _is_probe_path(path: str) -> bool:
+    return path.rstrip('/').rsplit('/', 1)[-1] in {'live', 'ready', 'health', 'metrics'}
+
+
+def _send_signal(pid: int, sig: int):
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def run_forkserver(
+    http_port: int,
+    entrypoint_path: str,
+    entrypoint_classname: Optional[str],
+    manifest_path: Optional[str],
+    worker_processes: int,
+):
+    """
+    Load the entrypoint once in a template process and serve it by the worker processes forked from it.
+    Until the entrypoint is loaded, the template process responds to liveness and readiness probes.
+    Then, every worker responds to them while it builds its API and warms up, before serving the job.
+    """
+    reset_multiprocess_dir()
+    listen_socket = _bind_socket('0.0.0.0', http_port)
+    health_state = HealthState()
+    registry = WorkerRegistry(worker_processes * 2)  # draining workers keep their slots until they exit
+
+    with serve_asgi_in_background(create_health_app(health_state), http_port, sockets=[listen_socket.dup()]):
+        try:
+            manifest_dict = read_job_manifest_dict(manifest_path=manifest_path)
+            jobtype_extra: Dict[str, Any] = manifest_dict.get('jobtype_extra') or {}
+            entrypoint = instantiate_class_entrypoint(entrypoint_path, entrypoint_classname)
+            validate_entrypoint(entrypoint)
+            # frozen objects are not touched by garbage collector, so their memory pages stay shared with the workers
+            tune_garbage_collector({'gc_freeze': True, **jobtype_extra})
+        except BaseException as e:
+            health_state.set_error(short_exception_details(e))
+            log_exception(ContextError('Initialization error', e))
+            _wait_for_stop_signal()
+            return
+        logger.info(f'Entrypoint loaded, forking {worker_processes} workers')
+
+    def run_worker(slot: int):
+        _serve_worker(slot, entrypoint, manifest_dict, listen_socket, registry, http_port)
+
+    WorkerSupervisor(
+        worker_processes, registry, run_worker,
+        startup_timeout=float(os.environ.get('WORKER_STARTUP_TIMEOUT', 120)),
+        heartbeat_timeout=float(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', 30)),
+        drain_timeout=_get_drain_timeout(),
+    ).run()
+
+
+def _serve_worker(
+    slot: int,
+    entrypoint: JobEntrypoint,
+    manifest_dict: Dict[str, Any],
+    listen_socket: socket.socket,
+    registry: WorkerRegistry,
+    http_port: int,
+):
+    health_state = HealthState()
+    health_state.workers_info = registry.describe
+    register_collector(WorkerRecyclesCollector(registry))
+    app_reloader = ASGIReloader()
+    app_reloader.mount(create_health_app(health_state))
+    init_errors: List[BaseException] = []
+
+    def recycle(reason: RecycleReason):
+        logger.info(f'Recycling worker {slot} (PID {os.getpid()}) due to {reason.name.lower()}')
+        # the template process counts the recycled worker once it exits
+        registry.set_state(slot, WorkerState.DRAINING, recycle_reason=reason)
+        # stop accepting connections and give the requests in progress WORKER_DRAIN_TIMEOUT to finish
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    max_requests = _get_max_requests()
+    max_rss_growth = os.environ.get('WORKER_MAX_RSS_GROWTH')
+    app: ASGIApp = app_reloader
+    recycle_middleware: Optional[WorkerRecycleMiddleware] = None
+    if max_requests or max_rss_growth:
+        app = recycle_middleware = WorkerRecycleMiddleware(
+            app_reloader, recycle, max_requests=max_requests,
+            max_rss_growth=int(Quantity(max_rss_growth).plain_number) if max_rss_growth else None,
+        )
+
+    def late_init():
+        try:
+            with health_state.startup_phase('attach_entrypoint'):
+                fastapi_app = create_api_app(entrypoint, health_state, manifest_dict)
+            with health_state.startup_phase('warmup'):
+                warm_up_job(entrypoint, fastapi_app, manifest_dict.get('jobtype_extra') or {})
+        except BaseException as e:
+            # stop the worker, so the template process replaces it
+            health_state.set_error(short_exception_details(e))
+            init_errors.append(e)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        app_reloader.mount(fastapi_app)
+        if recycle_middleware is not None:
+            recycle_middleware.reset_limits()
+        health_state.set_ready()
+        registry.set_state(slot, WorkerState.READY)
+
+    def heartbeat():
+        registry.heartbeat(slot)
+        if recycle_middleware is not None and health_state.ready:
+            recycle_middleware.check_limits()
+
+    threading.Thread(target=late_init, name='worker-init', daemon=True).start()
+    serve_asgi_app(app, http_port=http_port, sockets=[listen_socket],
+                   heartbeat=heartbeat, heartbeat_interval=HEARTBEAT_INTERVAL,
+                   graceful_shutdown_timeout=_get_drain_timeout())
+    if init_errors:
+        raise ContextError('Worker initialization error', init_errors[0])
+
+
+def _get_max_requests() -> Optional[int]:
+    """Return the number of requests served by a worker before it's recycled, with a random jitter added"""
+    max_requests = int(os.environ.get('WORKER_MAX_REQUESTS') or 0)
+    if not max_requests:
+        return None
+    jitter = int(os.environ.get('WORKER_MAX_REQUESTS_JITTER') or 0)
+    return max_requests + random.randint(0, jitter)
+
+
+def _get_drain_timeout() -> float:
+    return float(os.environ.get('WORKER_DRAIN_TIMEOUT') or DEFAULT_DRAIN_TIMEOUT)
+
+
+def _bind_socket(http_addr: str, http_port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((http_addr, http_port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _wait_for_stop_signal():
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda sig, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda sig, frame: stopped.set())
+    stopped.wait()
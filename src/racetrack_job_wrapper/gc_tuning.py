@@ -0,0 +1,41 @@
+import gc
+import time
+from typing import Any, Dict, List, Optional
+
+from racetrack_job_wrapper.log.logs import get_logger
+
+logger = get_logger(__name__)
+
+
+def tune_garbage_collector(jobtype_extra: Dict[str, Any]):
+    """
+    Post-init step tuning the garbage collector according to jobtype_extra fields:
+    - gc_freeze: do a full collection and move all objects created so far to the permanent generation,
+      so they're no longer scanned by full collections and their memory stays shared with the forked processes,
+    - gc_thresholds: collection thresholds of the generations, e.g. [50000, 20, 20].
+    """
+    if _is_flag_set(jobtype_extra.get('gc_freeze')):
+        start_time = time.perf_counter()
+        gc.collect()
+        gc.freeze()
+        logger.info(f'Garbage collector froze {gc.get_freeze_count()} objects '
+                    f'in {time.perf_counter() - start_time:.3f}s')
+
+    thresholds = _parse_thresholds(jobtype_extra.get('gc_thresholds'))
+    if thresholds is not None:
+        gc.set_threshold(*thresholds)
+        logger.info(f'Garbage collector thresholds set to {gc.get_threshold()}')
+
+
+def _is_flag_set(value: Any) -> bool:
+    return str(value).lower() in {'true', 't', 'yes', 'y', '1'}
+
+
+def _parse_thresholds(value: Any) -> Optional[List[int]]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    thresholds = [int(str(item).strip()) for item in value]
+    assert 1 <= len(thresholds) <= 3, f'Expected 1 to 3 numbers in gc_thresholds, but got: {value}'
+    return thresholds
@@ -1,5 +1,7 @@
 import os
-from typing import Tuple, Dict, Optional
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Tuple, Dict, Optional
 
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
@@ -12,6 +14,9 @@ class HealthState:
         self._live = live
         self._ready = ready
         self._error: Optional[str] = None
+        self._startup_timings: Dict[str, float] = {}
+        # Reports the states of all worker processes serving the app, if there are many of them
+        self.workers_info: Optional[Callable[[], List[Dict]]] = None
 
     @property
     def ready(self) -> bool:
@@ -25,6 +30,19 @@ class HealthState:
     def error(self) -> Optional[str]:
         return self._error
 
+    @property
+    def startup_timings(self) -> Dict[str, float]:
+        return dict(self._startup_timings)
+
+    @contextmanager
+    def startup_phase(self, phase: str) -> Iterator[None]:
+        """Measure the duration of a startup phase, reported in the health response"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._startup_timings[phase] = round(time.perf_counter() - start_time, 6)
+
     def set_ready(self):
         self._ready = True
 
@@ -73,7 +91,11 @@ class HealthState:
             'deployed_by_racetrack_version': os.environ.get('DEPLOYED_BY_RACETRACK_VERSION'),
             'deployment_timestamp': os.environ.get('JOB_DEPLOYMENT_TIMESTAMP'),
             'job_type_version': os.environ.get('JOB_TYPE_VERSION'),
+            'startup_timings': self.startup_timings,
         }
+        if self.workers_info is not None:
+            result['worker_pid'] = os.getpid()
+            result['workers'] = self.workers_info()
         return result, 200 if self.live and self.ready else 500
 
 
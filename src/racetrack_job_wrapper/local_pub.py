@@ -0,0 +1,312 @@
+import asyncio
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from racetrack_job_wrapper import call
+from racetrack_job_wrapper.api.asgi.asgi_server import serve_asgi_app
+from racetrack_job_wrapper.entrypoint import JobEntrypoint
+from racetrack_job_wrapper.health import HealthState
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.utils.semver import SemanticVersion, SemanticVersionPattern
+from racetrack_job_wrapper.wrapper_api import create_api_app
+
+logger = get_logger(__name__)
+
+LOCAL_PUB_URL = 'http://local-pub/pub'
+ASYNC_POLL_TIMEOUT = 30
+# Results of async calls that nobody polls are dropped after this time (in seconds) or when there are too many of them
+ASYNC_TASK_TTL = 600
+MAX_ASYNC_TASKS = 1000
+
+_job_path_regex = re.compile(r'^/pub/job/(?P<job_name>[^/]+)/(?P<version>[^/]+)(?P<path>/.*)?$')
+_async_new_path_regex = re.compile(r'^/pub/async/new/job/(?P<job_name>[^/]+)/(?P<version>[^/]+)(?P<path>/.*)?$')
+_async_poll_path_regex = re.compile(r'^/pub/async/task/(?P<task_id>[^/]+)/poll$')
+
+
+@dataclass
+class _JobTarget:
+    job_name: str
+    version: str
+    app: Optional[ASGIApp] = None
+    url: Optional[str] = None
+
+
+@dataclass
+class _BufferedResponse:
+    status_code: int
+    headers: List[Tuple[bytes, bytes]]
+    content: bytes
+
+
+@dataclass
+class _AsyncTask:
+    future: asyncio.Future
+    created_at: float  # monotonic time
+
+
+class LocalPub:
+    """
+    Lightweight stand-in for Racetrack's Pub, routing job calls to the jobs run on a local machine.
+    Jobs can be loaded in-process (called without sockets) or be served at local ports.
+    It's an ASGI app, so it can be served with an HTTP server or called in-process with `activate`.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, _JobTarget]] = {}
+        self._tasks: 'OrderedDict[str, _AsyncTask]' = OrderedDict()
+
+    def add_job_app(self, job_name: str, version: str, app: ASGIApp):
+        """Route calls to an ASGI app of a job, created with create_api_app"""
+        self._jobs.setdefault(job_name, {})[version] = _JobTarget(job_name, version, app=app)
+
+    def add_job_entrypoint(
+        self,
+        job_name: str,
+        version: str,
+        entrypoint: JobEntrypoint,
+        manifest_dict: Optional[Dict[str, Any]] = None,
+    ):
+        """Wrap job entrypoint in an API app and route calls to it in-process"""
+        manifest_dict = manifest_dict or {'name': job_name, 'version': version}
+        app = create_api_app(entrypoint, HealthState(live=True, ready=True), manifest_dict)
+        self.add_job_app(job_name, version, app)
+
+    def add_job_url(self, job_name: str, version: str, url: str):
+        """Route calls to a job served at given base URL, eg. http://127.0.0.1:7001"""
+        self._jobs.setdefault(job_name, {})[version] = _JobTarget(job_name, version, url=url.rstrip('/'))
+
+    @contextlib.contextmanager
+    def activate(self) -> Iterator['LocalPub']:
+        """
+        Make call_job, call_job_coroutine and async_job_call functions send requests to this Pub
+        through in-process transports, skipping the network entirely.
+        """
+        env_overrides = {
+            'PUB_URL': LOCAL_PUB_URL,
+            'JOB_NAME': os.environ.get('JOB_NAME') or 'local',
+            'AUTH_TOKEN': os.environ.get('AUTH_TOKEN') or '',
+        }
+        previous_env = {name: os.environ.get(name) for name in env_overrides}
+        previous_transports = call.call_transport, call.async_call_transport
+        sync_transport = SyncASGITransport(self)
+        os.environ.update(env_overrides)
+        call.call_transport = _SharedTransport(sync_transport)
+        call.async_call_transport = httpx.ASGITransport(app=self, raise_app_exceptions=False)
+        try:
+            yield self
+        finally:
+            call.call_transport, call.async_call_transport = previous_transports
+            for name, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            sync_transport.close()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'lifespan':
+            await _handle_lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        path: str = scope['path']
+        if match := _job_path_regex.match(path):
+            target = self._resolve_job(match.group('job_name'), match.group('version'))
+            if target is None:
+                await _send_json(send, 404, {'error': f'job not found: {match.group("job_name")} {match.group("version")}'})
+                return
+            job_path = match.group('path') or '/'
+            if target.app is not None:
+                await target.app(_job_scope(scope, target, job_path), receive, send)
+            else:
+                body = await _read_body(receive)
+                response = await _call_job_target(target, scope, job_path, body)
+                await _send_buffered(send, response)
+
+        elif match := _async_new_path_regex.match(path):
+            target = self._resolve_job(match.group('job_name'), match.group('version'))
+            if target is None:
+                await _send_json(send, 404, {'error': f'job not found: {match.group("job_name")} {match.group("version")}'})
+                return
+            body = await _read_body(receive)
+            self._prune_tasks()
+            task_id = uuid.uuid4().hex
+            future = asyncio.ensure_future(_call_job_target(target, scope, match.group('path') or '/', body))
+            self._tasks[task_id] = _AsyncTask(future, time.monotonic())
+            await _send_json(send, 201, {'task_id': task_id})
+
+        elif match := _async_poll_path_regex.match(path):
+            task_id = match.group('task_id')
+            task = self._tasks.get(task_id)
+            if task is None:
+                await _send_json(send, 404, {'error': f'task not found: {task_id}'})
+                return
+            try:
+                response = await asyncio.wait_for(asyncio.shield(task.future), timeout=ASYNC_POLL_TIMEOUT)
+            except asyncio.TimeoutError:
+                await _send_json(send, 202, {'task_id': task_id, 'status': 'ongoing'})
+                return
+            self._tasks.pop(task_id, None)
+            await _send_buffered(send, response)
+
+        else:
+            await _send_json(send, 404, {'error': f'unknown Pub endpoint: {path}'})
+
+    def _prune_tasks(self):
+        """Drop the oldest tasks that nobody has polled for too long or exceed the limit, cancelling unfinished ones"""
+        expired_before = time.monotonic() - ASYNC_TASK_TTL
+        while self._tasks:
+            task_id, task = next(iter(self._tasks.items()))
+            if len(self._tasks) < MAX_ASYNC_TASKS and task.created_at >= expired_before:
+                break
+            del self._tasks[task_id]
+            task.future.cancel()
+            logger.warning(f'Async task {task_id} dropped, as it has not been polled')
+
+    def _resolve_job(self, job_name: str, version: str) -> Optional[_JobTarget]:
+        versions = self._jobs.get(job_name)
+        if not versions:
+            return None
+        if version in versions:
+            return versions[version]
+        semver_targets = [target for target in versions.values() if _is_semver(target.version)]
+        if version == 'latest':
+            return SemanticVersion.find_latest_stable(semver_targets, key=lambda t: t.version)
+        if SemanticVersionPattern.is_x_pattern(version):
+            pattern = SemanticVersionPattern.from_x_pattern(version)
+            return SemanticVersion.find_latest_wildcard(pattern, semver_targets, key=lambda t: t.version)
+        return None
+
+
+class SyncASGITransport(httpx.BaseTransport):
+    """
+    Synchronous httpx transport calling ASGI app in-process.
+    The app is run on the event loop of a background thread, shared by all the requests.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self._async_transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='asgi-transport-loop', daemon=True)
+        self._thread.start()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('synchronous call made from the event loop would block it forever, '
+                               'use call_job_coroutine instead')
+        future = asyncio.run_coroutine_threadsafe(self._handle_async(request), self._loop)
+        return future.result()
+
+    async def _handle_async(self, request: httpx.Request) -> httpx.Response:
+        async_request = httpx.Request(
+            request.method, request.url, headers=request.headers, content=request.read(),
+            extensions=request.extensions,
+        )
+        response = await self._async_transport.handle_async_request(async_request)
+        content = await response.aread()
+        return httpx.Response(response.status_code, headers=response.headers, content=content,
+                              extensions=response.extensions)
+
+    def close(self):
+        """Stop the event loop and its thread"""
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class _SharedTransport(httpx.BaseTransport):
+    """Transport shared by many short-lived clients, which is not closed along with them"""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return self._transport.handle_request(request)
+
+    def close(self):
+        pass  # closed by the owner of the wrapped transport
+
+
+def serve_local_pub(pub: LocalPub, http_port: int = 7005, http_addr: str = '127.0.0.1'):
+    """
+    Serve Local Pub at a given port, so that the jobs served at other ports can call each other through it.
+    Set PUB_URL=http://127.0.0.1:7005/pub for these jobs.
+    """
+    serve_asgi_app(pub, http_port=http_port, http_addr=http_addr)
+
+
+def _job_scope(scope: Scope, target: _JobTarget, job_path: str) -> Scope:
+    path = f'/pub/job/{target.job_name}/{target.version}{job_path}'
+    return {**scope, 'path': path, 'raw_path': path.encode(), 'root_path': ''}
+
+
+async def _call_job_target(target: _JobTarget, scope: Scope, job_path: str, body: bytes) -> _BufferedResponse:
+    if target.app is not None:
+        transport: httpx.AsyncBaseTransport = httpx.ASGITransport(app=target.app, raise_app_exceptions=False)
+        base_url = 'http://job'
+    else:
+        transport = httpx.AsyncHTTPTransport()
+        base_url = target.url
+    url = f'{base_url}/pub/job/{target.job_name}/{target.version}{job_path}'
+    query_string: bytes = scope.get('query_string', b'')
+    if query_string:
+        url += '?' + query_string.decode()
+    headers = [(name, value) for name, value in scope['headers'] if name.lower() not in {b'host', b'content-length'}]
+    async with httpx.AsyncClient(transport=transport, timeout=None) as client:
+        response = await client.request(scope['method'], url, headers=headers, content=body)
+    response_headers = [
+        (name.encode(), value.encode()) for name, value in response.headers.multi_items()
+        if name.lower() not in {'content-length', 'content-encoding', 'transfer-encoding'}
+    ]
+    return _BufferedResponse(response.status_code, response_headers, response.content)
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        message: Message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+async def _send_buffered(send: Send, response: _BufferedResponse):
+    headers = response.headers + [(b'content-length', str(len(response.content)).encode())]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.content})
+
+
+async def _send_json(send: Send, status_code: int, obj: Any):
+    content = json.dumps(obj).encode()
+    await _send_buffered(send, _BufferedResponse(status_code, [(b'content-type', b'application/json')], content))
+
+
+async def _handle_lifespan(receive: Receive, send: Send):
+    while True:
+        message: Message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _is_semver(version: str) -> bool:
+    return SemanticVersion.version_pattern.fullmatch(version) is not None
@@ -1,9 +1,13 @@
-from typing import Dict, List
+import concurrent.futures
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
 
 from prometheus_client import Counter, Histogram, Gauge
-from prometheus_client.core import REGISTRY
 from prometheus_client.metrics_core import GaugeMetricFamily
 
+from racetrack_job_wrapper.api.metrics import register_collector, unregister_collector
 from racetrack_job_wrapper.entrypoint import JobEntrypoint
 from racetrack_job_wrapper.log.logs import get_logger
 
@@ -37,36 +41,231 @@ metric_endpoint_requests_started = Counter(
 metric_last_call_timestamp = Gauge(
     'last_call_timestamp',
     'Timestamp (in seconds) of the last request calling Job',
+    multiprocess_mode='max',
 )
+metric_request_queue_wait_duration = Histogram(
+    'request_queue_wait_duration',
+    'Time spent by a request waiting for a free concurrency slot',
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, float("inf")),
+    labelnames=['endpoint'],
+)
+metric_request_execution_duration = Histogram(
+    'request_execution_duration',
+    'Time spent inside the entrypoint method handling a request',
+    buckets=(.001, .0025, .005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5,
+             10.0, 25.0, 50.0, 75.0, 100.0, 250.0, 500.0, 750.0, 1000.0, float("inf")),
+    labelnames=['endpoint'],
+)
+metric_response_serialization_duration = Histogram(
+    'response_serialization_duration',
+    'Time spent converting the result of entrypoint method to JSON-serializable object',
+    buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, float("inf")),
+    labelnames=['endpoint'],
+)
+metric_endpoint_cpu_time = Histogram(
+    'endpoint_cpu_time',
+    'CPU time in seconds used by the thread handling a request',
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, float("inf")),
+    labelnames=['endpoint'],
+)
+metric_endpoint_allocated_bytes = Histogram(
+    'endpoint_allocated_bytes',
+    'Peak memory in bytes allocated while handling a request, measured on a sample of requests',
+    buckets=(1024, 16 * 1024, 128 * 1024, 1024 ** 2, 8 * 1024 ** 2, 64 * 1024 ** 2, 512 * 1024 ** 2,
+             4 * 1024 ** 3, float("inf")),
+    labelnames=['endpoint'],
+)
+metric_requests_in_flight = Gauge(
+    'requests_in_flight',
+    'Number of requests being processed by the entrypoint at the moment',
+    labelnames=['endpoint'],
+    multiprocess_mode='livesum',
+)
+metric_requests_queued = Gauge(
+    'requests_queued',
+    'Number of requests waiting for a free concurrency slot at the moment',
+    labelnames=['endpoint'],
+    multiprocess_mode='livesum',
+)
+metric_concurrency_limit = Gauge(
+    'concurrency_limit',
+    'Maximum number of requests processed concurrently (0 means unlimited), shared by all endpoints',
+    multiprocess_mode='max',
+)
+metric_warmup_duration = Gauge(
+    'warmup_duration',
+    'Time in seconds spent on warming up the job before it became ready',
+    multiprocess_mode='max',
+)
+metric_continuous_profiler_cpu_seconds = Counter(
+    'continuous_profiler_cpu_seconds',
+    'CPU time spent by the continuous profiler on sampling the stacks',
+)
+metric_job_call_cache_hits = Counter(
+    'job_call_cache_hits',
+    'Number of calls to other jobs served from the client-side cache',
+    labelnames=['job_name'],
+)
+metric_job_call_cache_misses = Counter(
+    'job_call_cache_misses',
+    'Number of cacheable calls to other jobs that had to be sent to the network',
+    labelnames=['job_name'],
+)
+metric_job_call_cache_coalesced = Counter(
+    'job_call_cache_coalesced',
+    'Number of calls to other jobs that waited for the identical call already in progress',
+    labelnames=['job_name'],
+)
+metric_job_call_compression_saved_bytes = Counter(
+    'job_call_compression_saved_bytes',
+    'Number of bytes saved by compressing request bodies sent to other jobs',
+    labelnames=['encoding'],
+)
+metric_job_metrics_collection_duration = Histogram(
+    'job_metrics_collection_duration',
+    'Duration of collecting custom metrics from the entrypoint\'s metrics method',
+    buckets=(.001, .005, .01, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf")),
+)
+metric_job_metrics_collection_failures = Counter(
+    'job_metrics_collection_failures',
+    'Number of failed or timed out collections of custom metrics from the entrypoint',
+)
+
+
+class EndpointMetrics:
+    """
+    Metrics of a single endpoint with labels bound upfront, when the endpoint is registered,
+    so that handling a request doesn't need to look up the labelled children.
+    """
+
+    def __init__(self, endpoint_path: str):
+        self.endpoint_path = endpoint_path
+        self.requests_started = metric_endpoint_requests_started.labels(endpoint=endpoint_path)
+        self.internal_errors = metric_request_internal_errors.labels(endpoint=endpoint_path)
+        self.request_duration = metric_request_duration.labels(endpoint=endpoint_path)
+        self.queue_wait_duration = metric_request_queue_wait_duration.labels(endpoint=endpoint_path)
+        self.execution_duration = metric_request_execution_duration.labels(endpoint=endpoint_path)
+        self.serialization_duration = metric_response_serialization_duration.labels(endpoint=endpoint_path)
+        self.in_flight = metric_requests_in_flight.labels(endpoint=endpoint_path)
+        self.queued = metric_requests_queued.labels(endpoint=endpoint_path)
+        self.cpu_time = metric_endpoint_cpu_time.labels(endpoint=endpoint_path)
+        self.allocated_bytes = metric_endpoint_allocated_bytes.labels(endpoint=endpoint_path)
+
+
+_job_metrics_collector: Optional['JobMetricsCollector'] = None
 
 
 def setup_entrypoint_metrics(entrypoint: JobEntrypoint):
+    global _job_metrics_collector
     if not hasattr(entrypoint, 'metrics'):
         return
+    if _job_metrics_collector is not None:  # metrics of the entrypoint created previously would collide
+        unregister_collector(_job_metrics_collector)
+        _job_metrics_collector.stop()
     metrics_function = getattr(entrypoint, 'metrics')
-    REGISTRY.register(JobMetricsCollector(metrics_function))
+    _job_metrics_collector = JobMetricsCollector(
+        metrics_function,
+        refresh_interval=float(os.environ.get('METRICS_REFRESH_INTERVAL', 10)),
+        timeout=float(os.environ.get('METRICS_COLLECT_TIMEOUT', 5)),
+    )
+    register_collector(_job_metrics_collector)
+    _job_metrics_collector.start()
 
 
 class JobMetricsCollector:
-    def __init__(self, metrics_function):
+    """
+    Collector of the custom metrics returned by entrypoint's metrics method.
+    The method is called on a background schedule, once the collector is started,
+    and scrapes are served from the latest snapshot at once, so a slow metrics method doesn't slow down /metrics endpoint.
+    """
+
+    def __init__(self, metrics_function: Callable[[], List[Dict]], refresh_interval: float = 10, timeout: float = 5):
         self._metrics_function = metrics_function
+        self._refresh_interval = refresh_interval
+        self._timeout = timeout
+        self._families: List[GaugeMetricFamily] = []
+        self._started_at: Optional[float] = None
+        self._snapshot_time: Optional[float] = None
+        self._stopped = threading.Event()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pending: Optional[concurrent.futures.Future] = None
+
+    def start(self):
+        """Start collecting the metrics in the background"""
+        self._started_at = time.monotonic()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-metrics')
+        threading.Thread(target=self._refresh_loop, name='job-metrics-refresher', daemon=True).start()
+
+    def describe(self):
+        return []  # don't call metrics method on registration, metric names are not known upfront
 
     def collect(self):
-        metrics: List[Dict] = self._metrics_function()
-        for metric in metrics:
-            name = metric.get('name')
-            description = metric.get('description', '')
-            labels = metric.get('labels', {})
-            if not name:
-                logger.error('"name" field is undefined for one of the metrics')
-                continue
-            if 'value' not in metric:
-                logger.error(f'"value" field is undefined for {name} metric')
-                continue
-            value = metric['value']
-            if value is None:
-                continue
-
-            prometheus_metric = GaugeMetricFamily(name, description)
-            prometheus_metric.add_sample(name, labels, value)
-            yield prometheus_metric
+        yield from self._families
+        snapshot_time = self._snapshot_time or self._started_at
+        if snapshot_time is not None:
+            yield GaugeMetricFamily(
+                'job_metrics_snapshot_age_seconds',
+                'Time elapsed since custom metrics were collected from the entrypoint '
+                '(or since the collection started, if it has not succeeded yet)',
+                value=time.monotonic() - snapshot_time,
+            )
+
+    def stop(self):
+        self._stopped.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def refresh(self):
+        """Call metrics method and replace the snapshot, waiting no longer than the timeout"""
+        assert self._executor is not None, 'collector is not started'
+        if self._pending is not None and not self._pending.done():
+            logger.warning('custom metrics collection is still hanging, skipping the refresh')
+            return
+        start_time = time.perf_counter()
+        self._pending = self._executor.submit(self._metrics_function)
+        try:
+            metrics: List[Dict] = self._pending.result(timeout=self._timeout)
+        except concurrent.futures.TimeoutError:
+            metric_job_metrics_collection_failures.inc()
+            logger.warning(f'collecting custom metrics took more than {self._timeout}s, serving the stale snapshot')
+            return
+        except Exception as e:
+            metric_job_metrics_collection_failures.inc()
+            logger.error(f'collecting custom metrics failed: {e}')
+            return
+        finally:
+            metric_job_metrics_collection_duration.observe(time.perf_counter() - start_time)
+        self._families = _build_metric_families(metrics)
+        self._snapshot_time = time.monotonic()
+
+    def _refresh_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except RuntimeError:  # executor shut down
+                return
+            self._stopped.wait(self._refresh_interval)
+
+
+def _build_metric_families(metrics: List[Dict]) -> List[GaugeMetricFamily]:
+    """Group the samples of the same name into one metric family"""
+    families: Dict[str, GaugeMetricFamily] = {}
+    for metric in metrics:
+        name = metric.get('name')
+        description = metric.get('description', '')
+        labels = metric.get('labels', {})
+        if not name:
+            logger.error('"name" field is undefined for one of the metrics')
+            continue
+        if 'value' not in metric:
+            logger.error(f'"value" field is undefined for {name} metric')
+            continue
+        value = metric['value']
+        if value is None:
+            continue
+
+        family = families.get(name)
+        if family is None:
+            family = families[name] = GaugeMetricFamily(name, description)
+        family.add_sample(name, labels, value)
+    return list(families.values())
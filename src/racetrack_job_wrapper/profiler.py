@@ -1,21 +1,63 @@
-from typing import Optional
+import collections
+import os
+import re
+import shlex
+import sys
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from pathlib import Path
 
-import memray
-
 from racetrack_job_wrapper.log.logs import get_logger
 from racetrack_job_wrapper.utils.shell import shell, shell_output
 from racetrack_job_wrapper.utils.env import is_env_flag_enabled
+from racetrack_job_wrapper.utils.quantity import Quantity
+
+if TYPE_CHECKING:
+    import memray
 
 logger = get_logger(__name__)
 
+_snapshot_name_regex = re.compile(r'^memray-snapshot-\d{8}-\d{6}(-\d+)?\.bin$')
+
+
+@dataclass
+class ReportGeneration:
+    """Status of generating a report from the memray output in background"""
+    output_path: Path
+    state: str = 'idle'  # idle, running, done, failed
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    source_key: Optional[Tuple[int, int]] = None  # size and mtime of the memray output it's generated from
+
+    def to_dict(self) -> Dict:
+        now = time.time()
+        return {
+            'state': self.state,
+            'error': self.error,
+            'elapsed_seconds': ((self.finished_at or now) - self.started_at) if self.started_at else None,
+        }
+
 
 class MemoryProfiler:
-    tracker: Optional[memray.Tracker] = None
+    tracker: Optional['memray.Tracker'] = None
     REPORT_FILENAME = 'memray-report.bin'
     REPORT_FILE_PATH = Path('/tmp/racetrack-memray-report.bin')
     FLAMEGRAPH_FILENAME = 'memray-flamegraph.html'
     FLAMEGRAPH_FILE_PATH = Path('/tmp/racetrack-memray-flamegraph.html')
+    STATS_FILE_PATH = Path('/tmp/racetrack-memray-stats.txt')
+    generations: Dict[str, ReportGeneration] = {
+        'flamegraph': ReportGeneration(FLAMEGRAPH_FILE_PATH),
+        'stats': ReportGeneration(STATS_FILE_PATH),
+    }
+    generation_lock = threading.Lock()
+    SNAPSHOTS_DIR = Path('/tmp/racetrack-memray-snapshots')
+    tracker_lock = threading.RLock()
+    rotation_stop: Optional[threading.Event] = None
 
     @classmethod
     def is_enabled(cls) -> bool:
@@ -25,48 +67,365 @@ class MemoryProfiler:
     def is_leaks_enabled(cls) -> bool:
         return is_env_flag_enabled('MEMRAY_LEAKS', 'false')
 
+    @classmethod
+    def get_snapshot_interval(cls) -> Optional[float]:
+        """Length of the time window (in seconds) recorded in a single snapshot, if rotation is enabled"""
+        interval = os.environ.get('MEMRAY_SNAPSHOT_INTERVAL')
+        return float(interval) if interval else None
+
+    @classmethod
+    def get_snapshots_max_size(cls) -> int:
+        """Disk budget for all the snapshots, in bytes"""
+        return int(Quantity(os.environ.get('MEMRAY_SNAPSHOTS_MAX_SIZE', '1Gi')).plain_number)
+
     @classmethod
     def start(cls):
         if not cls.is_enabled():
             return
-        if cls.tracker is not None:
-            return
-        if cls.REPORT_FILE_PATH.is_file():
-            logger.warning(f'Deleting previous memory report at {cls.REPORT_FILE_PATH}')
-            cls.REPORT_FILE_PATH.unlink()
-        cls.tracker = memray.Tracker(cls.REPORT_FILE_PATH, trace_python_allocators=True)
-        cls.tracker.__enter__()
+        with cls.tracker_lock:
+            if cls.tracker is not None:
+                return
+            if cls.REPORT_FILE_PATH.is_file():
+                logger.warning(f'Deleting previous memory report at {cls.REPORT_FILE_PATH}')
+                cls.REPORT_FILE_PATH.unlink()
+            cls._start_tracker()
+            snapshot_interval = cls.get_snapshot_interval()
+            if snapshot_interval:
+                cls.rotation_stop = threading.Event()
+                threading.Thread(target=cls._rotate_snapshots, args=(cls.rotation_stop, snapshot_interval),
+                                 daemon=True, name='memray-snapshots').start()
         logger.info('Memory profiler started')
 
     @classmethod
     def stop(cls):
-        if cls.tracker is None:
-            return
+        with cls.tracker_lock:
+            if cls.tracker is None:
+                return
+            if cls.rotation_stop is not None:
+                cls.rotation_stop.set()
+                cls.rotation_stop = None
+            cls._stop_tracker()
+        logger.info(f'Memory profiler stopped, report saved to {cls.REPORT_FILE_PATH}')
+
+    @classmethod
+    def _start_tracker(cls):
+        import memray
+
+        cls.tracker = memray.Tracker(cls.REPORT_FILE_PATH, trace_python_allocators=True)
+        cls.tracker.__enter__()
+
+    @classmethod
+    def _stop_tracker(cls):
         cls.tracker.__exit__(None, None, None)
         cls.tracker = None
-        logger.info(f'Memory profiler stopped, report saved to {cls.REPORT_FILE_PATH}')
 
     @classmethod
-    def get_report_bytes(cls) -> bytes:
-        if not cls.REPORT_FILE_PATH.is_file():
-            raise ValueError(f'Memory report not found at {cls.REPORT_FILE_PATH}')
-        return cls.REPORT_FILE_PATH.read_bytes()
+    def _rotate_snapshots(cls, stop_event: threading.Event, interval: float):
+        """Close the report every interval, keep it as a snapshot and start recording the next time window"""
+        while not stop_event.wait(interval):
+            with cls.tracker_lock:
+                if stop_event.is_set() or cls.tracker is None:
+                    return
+                cls._stop_tracker()
+                cls.SNAPSHOTS_DIR.mkdir(parents=True, exist_ok=True)
+                snapshot_path = cls.SNAPSHOTS_DIR / f'memray-snapshot-{datetime.now().strftime("%Y%m%d-%H%M%S")}.bin'
+                if snapshot_path.exists():
+                    snapshot_path = snapshot_path.with_name(f'{snapshot_path.stem}-{time.monotonic_ns()}.bin')
+                cls.REPORT_FILE_PATH.replace(snapshot_path)
+                try:
+                    cls._start_tracker()
+                except RuntimeError as e:  # another tracker has started in the meantime
+                    cls.tracker = None
+                    logger.error(f'Memory profiler could not be restarted, snapshots are no longer taken: {e}')
+                    return
+            logger.info(f'Memory snapshot saved to {snapshot_path}')
+            cls._enforce_snapshots_budget()
 
     @classmethod
-    def get_flamegraph_html(cls) -> bytes:
-        if not cls.REPORT_FILE_PATH.is_file():
-            raise ValueError(f'Memory report not found at {cls.REPORT_FILE_PATH}')
-        if cls.FLAMEGRAPH_FILE_PATH.is_file():
-            cls.FLAMEGRAPH_FILE_PATH.unlink()
-        if cls.is_leaks_enabled():
-            logger.debug('Generating flamegraph report with memory leaks')
-        leaks_flag = '--leaks' if cls.is_leaks_enabled() else ''
-        shell(f'python -m memray flamegraph {leaks_flag} -o {cls.FLAMEGRAPH_FILE_PATH} {cls.REPORT_FILE_PATH}')
-        return cls.FLAMEGRAPH_FILE_PATH.read_bytes()
+    def _enforce_snapshots_budget(cls):
+        """Delete the oldest snapshots exceeding the disk budget, always keeping the latest one"""
+        snapshots = sorted(cls.SNAPSHOTS_DIR.glob('memray-snapshot-*.bin'), key=lambda path: path.stat().st_mtime)
+        total_size = sum(path.stat().st_size for path in snapshots)
+        max_size = cls.get_snapshots_max_size()
+        for path in snapshots[:-1]:
+            if total_size <= max_size:
+                break
+            total_size -= path.stat().st_size
+            path.unlink()
+            logger.debug(f'Memory snapshot {path.name} deleted due to the disk budget')
 
     @classmethod
-    def get_stats_output(cls) -> str:
+    def list_snapshots(cls) -> List[Dict]:
+        if not cls.SNAPSHOTS_DIR.is_dir():
+            return []
+        snapshots = sorted(cls.SNAPSHOTS_DIR.glob('memray-snapshot-*.bin'), key=lambda path: path.stat().st_mtime)
+        return [{
+            'name': path.name,
+            'size': path.stat().st_size,
+            'saved_at': datetime.fromtimestamp(path.stat().st_mtime).isoformat(),
+        } for path in snapshots]
+
+    @classmethod
+    def get_snapshot_path(cls, name: str) -> Path:
+        if not _snapshot_name_regex.match(name):
+            raise ValueError(f'invalid snapshot name: {name}')
+        path = cls.SNAPSHOTS_DIR / name
+        if not path.is_file():
+            raise ValueError(f'snapshot not found: {name}')
+        return path
+
+    @classmethod
+    def diff_snapshots(cls, before: str, after: str, top: int = 20) -> List[Dict]:
+        """
+        Compare memory retained at the end of two snapshots' time windows, grouped by allocation site.
+        Every snapshot has its own tracker, so an allocation may be freed in a later window than it was made.
+        The kept snapshots are replayed in order, matching the frees with the allocations of the previous windows,
+        as if they were recorded by a single tracker. Allocations made before the oldest kept snapshot are not counted.
+        Return the sites that grew the most.
+        """
+        snapshot_names = [snapshot['name'] for snapshot in cls.list_snapshots()]
+        before_index = snapshot_names.index(cls.get_snapshot_path(before).name)
+        after_index = snapshot_names.index(cls.get_snapshot_path(after).name)
+        if before_index >= after_index:
+            raise ValueError(f'snapshot {before} should be taken before {after}')
+
+        live_allocations: Dict[int, Tuple[str, int]] = {}
+        before_sites: Dict[str, int] = {}
+        for index, name in enumerate(snapshot_names[:after_index + 1]):
+            _replay_allocations(cls.SNAPSHOTS_DIR / name, live_allocations)
+            if index == before_index:
+                before_sites = _retained_bytes_by_site(live_allocations)
+        after_sites = _retained_bytes_by_site(live_allocations)
+
+        diffs = [{
+            'location': site,
+            'before_bytes': before_sites.get(site, 0),
+            'after_bytes': after_sites.get(site, 0),
+            'growth_bytes': after_sites.get(site, 0) - before_sites.get(site, 0),
+        } for site in set(before_sites) | set(after_sites)]
+        diffs.sort(key=lambda diff: diff['growth_bytes'], reverse=True)
+        return diffs[:top]
+
+    @classmethod
+    def get_report_path(cls) -> Path:
         if not cls.REPORT_FILE_PATH.is_file():
             raise ValueError(f'Memory report not found at {cls.REPORT_FILE_PATH}')
-        output = shell_output(f'python -m memray stats {cls.REPORT_FILE_PATH}')
-        return output
+        return cls.REPORT_FILE_PATH
+
+    @classmethod
+    def request_output(cls, kind: str) -> Optional[Path]:
+        """
+        Return the path of the report generated from the current memray output ("flamegraph" or "stats").
+        If it's not generated yet, start generating it in background and return None.
+        """
+        report_path = cls.get_report_path()
+        stat = report_path.stat()
+        source_key = (stat.st_size, stat.st_mtime_ns)
+        with cls.generation_lock:
+            generation = cls.generations[kind]
+            if generation.state == 'done' and generation.source_key == source_key and generation.output_path.is_file():
+                return generation.output_path
+            if generation.state != 'running':
+                generation.state = 'running'
+                generation.error = None
+                generation.started_at = time.time()
+                generation.finished_at = None
+                generation.source_key = source_key
+                threading.Thread(target=cls._generate_output, args=(kind, generation), daemon=True,
+                                 name=f'memray-{kind}').start()
+        return None
+
+    @classmethod
+    def get_generation_status(cls) -> Dict[str, Dict]:
+        with cls.generation_lock:
+            return {kind: generation.to_dict() for kind, generation in cls.generations.items()}
+
+    @classmethod
+    def _generate_output(cls, kind: str, generation: ReportGeneration):
+        temp_path = generation.output_path.with_suffix('.tmp')
+        memray_cmd = f'{shlex.quote(sys.executable)} -m memray'
+        report_path = shlex.quote(str(cls.REPORT_FILE_PATH))
+        try:
+            temp_path.unlink(missing_ok=True)
+            if kind == 'flamegraph':
+                if cls.is_leaks_enabled():
+                    logger.debug('Generating flamegraph report with memory leaks')
+                leaks_flag = '--leaks' if cls.is_leaks_enabled() else ''
+                shell(f'{memray_cmd} flamegraph {leaks_flag} -f -o {shlex.quote(str(temp_path))} {report_path}',
+                      print_stdout=False)
+            else:
+                shell_output(f'{memray_cmd} stats {report_path}', output_filename=str(temp_path))
+            temp_path.replace(generation.output_path)  # readers never see a partially written file
+            state, error = 'done', None
+            logger.info(f'Memory {kind} report generated at {generation.output_path}')
+        except BaseException as e:
+            state, error = 'failed', str(e)
+            logger.error(f'Generating memory {kind} report failed: {e}')
+        with cls.generation_lock:
+            generation.state = state
+            generation.error = error
+            generation.finished_at = time.time()
+
+
+def _replay_allocations(snapshot_path: Path, live_allocations: Dict[int, Tuple[str, int]]):
+    """
+    Apply the allocations and frees recorded in the snapshot to the live allocations (address -> site and size).
+    Frees of the memory allocated before the tracking started are ignored.
+    """
+    import memray
+
+    deallocators = {memray.AllocatorType.FREE, memray.AllocatorType.PYMALLOC_FREE, memray.AllocatorType.MUNMAP}
+    reader = memray.FileReader(snapshot_path)
+    try:
+        for record in reader.get_allocation_records():
+            if record.allocator in deallocators:
+                live_allocations.pop(record.address, None)
+                continue
+            stack = record.stack_trace(max_stacks=1)
+            if stack:
+                function, filename, lineno = stack[0]
+                site = f'{function}:{filename}:{lineno}'
+            else:
+                site = '<unknown>'
+            live_allocations[record.address] = (site, record.size)
+    finally:
+        reader.close()
+
+
+def _retained_bytes_by_site(live_allocations: Dict[int, Tuple[str, int]]) -> Dict[str, int]:
+    sites: Dict[str, int] = collections.defaultdict(int)
+    for site, size in live_allocations.values():
+        sites[site] += size
+    return dict(sites)
+
+
+class AllocationTracker:
+    """
+    Lightweight allocation tracking based on tracemalloc, which can be turned on and off at runtime.
+    Memory used by tracemalloc grows with the number of live allocations,
+    so the tracker is stopped automatically once its overhead exceeds the budget.
+    """
+    MAX_FRAMES = 32
+    MAX_SNAPSHOTS = 10
+    OVERHEAD_CHECK_INTERVAL = 1.0
+    snapshots: 'collections.OrderedDict[str, tracemalloc.Snapshot]' = collections.OrderedDict()
+    lock = threading.Lock()
+    # Held by whoever starts or stops tracemalloc, shared with the resource accounting tracing single calls
+    tracing_lock = threading.Lock()
+    _watchdog_stopped: Optional[threading.Event] = None
+    _snapshot_filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ]
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return is_env_flag_enabled('TRACEMALLOC_PROFILER', 'false')
+
+    @classmethod
+    def get_max_overhead(cls) -> int:
+        """Return the memory (in bytes) that tracemalloc can use before the tracker is stopped"""
+        return int(Quantity(os.environ.get('TRACEMALLOC_MAX_OVERHEAD', '256Mi')).plain_number)
+
+    @classmethod
+    def start(cls, frames: Optional[int] = None):
+        """Start tracing allocations, keeping given number of frames of the allocating stack"""
+        frames = frames or int(os.environ.get('TRACEMALLOC_FRAMES', 1))
+        frames = max(1, min(frames, cls.MAX_FRAMES))
+        with cls.tracing_lock:
+            if tracemalloc.is_tracing():
+                return
+            tracemalloc.start(frames)
+        cls._watchdog_stopped = threading.Event()
+        threading.Thread(target=cls._watch_overhead, args=(cls._watchdog_stopped, cls.get_max_overhead()),
+                         name='tracemalloc-watchdog', daemon=True).start()
+        logger.info(f'Allocation tracker started with {frames} frames')
+
+    @classmethod
+    def stop(cls):
+        if cls._watchdog_stopped is not None:
+            cls._watchdog_stopped.set()
+            cls._watchdog_stopped = None
+        with cls.tracing_lock:
+            if not tracemalloc.is_tracing():
+                return
+            tracemalloc.stop()
+        logger.info('Allocation tracker stopped')
+
+    @classmethod
+    def _watch_overhead(cls, stopped: threading.Event, max_overhead: int):
+        while not stopped.wait(cls.OVERHEAD_CHECK_INTERVAL):
+            overhead = tracemalloc.get_tracemalloc_memory()
+            if overhead > max_overhead:
+                logger.warning(f'Allocation tracker uses {overhead} bytes, exceeding the budget of {max_overhead} bytes, '
+                               f'stopping it')
+                cls.stop()
+                return
+
+    @classmethod
+    def get_status(cls) -> Dict:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'tracing': tracemalloc.is_tracing(),
+            'frames': tracemalloc.get_traceback_limit(),
+            'traced_memory_bytes': current,
+            'traced_memory_peak_bytes': peak,
+            'overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+            'max_overhead_bytes': cls.get_max_overhead(),
+            'snapshots': list(cls.snapshots.keys()),
+        }
+
+    @classmethod
+    def get_top_allocations(cls, limit: int = 20, group_by: str = 'lineno') -> List[Dict]:
+        """Return the allocation sites holding the most memory at the moment, grouped by lineno, filename or traceback"""
+        stats = cls._take_snapshot().statistics(group_by)
+        return [_statistic_to_dict(stat) for stat in stats[:limit]]
+
+    @classmethod
+    def take_snapshot(cls) -> str:
+        """Save the current allocations for later comparison and return the snapshot ID"""
+        snapshot = cls._take_snapshot()
+        snapshot_id = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        with cls.lock:
+            cls.snapshots[snapshot_id] = snapshot
+            while len(cls.snapshots) > cls.MAX_SNAPSHOTS:
+                cls.snapshots.popitem(last=False)
+        return snapshot_id
+
+    @classmethod
+    def compare_snapshots(cls, before: str, after: Optional[str] = None, limit: int = 20,
+                          group_by: str = 'lineno') -> List[Dict]:
+        """Compare a snapshot with a later one (or with the current allocations) and return the sites that grew most"""
+        with cls.lock:
+            if before not in cls.snapshots:
+                raise ValueError(f'snapshot not found: {before}')
+            if after is not None and after not in cls.snapshots:
+                raise ValueError(f'snapshot not found: {after}')
+            before_snapshot = cls.snapshots[before]
+            after_snapshot = cls.snapshots[after] if after is not None else None
+        if after_snapshot is None:
+            after_snapshot = cls._take_snapshot()
+        stats = after_snapshot.compare_to(before_snapshot, group_by)
+        return [_statistic_to_dict(stat) for stat in stats[:limit]]
+
+    @classmethod
+    def _take_snapshot(cls) -> 'tracemalloc.Snapshot':
+        if not tracemalloc.is_tracing():
+            raise ValueError('Allocation tracker is not started')
+        return tracemalloc.take_snapshot().filter_traces(cls._snapshot_filters)
+
+
+def _statistic_to_dict(stat) -> Dict:
+    result = {
+        'location': str(stat.traceback[-1]) if stat.traceback else '<unknown>',  # the most recent frame
+        'size_bytes': stat.size,
+        'count': stat.count,
+    }
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        result['size_diff_bytes'] = stat.size_diff
+        result['count_diff'] = stat.count_diff
+    if len(stat.traceback) > 1:
+        result['traceback'] = [str(frame) for frame in stat.traceback]
+    return result
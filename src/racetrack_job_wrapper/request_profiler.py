@@ -0,0 +1,165 @@
+import collections
+import hmac
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Deque, Optional
+
+from fastapi import Request
+
+from racetrack_job_wrapper.cpu_profiler import StackSampler, to_speedscope_format
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.utils.env import is_env_flag_enabled
+
+logger = get_logger(__name__)
+
+PROFILE_REQUEST_HEADER = 'X-Racetrack-Profile'
+PROFILE_TOKEN_HEADER = 'X-Racetrack-Profile-Token'
+PROFILE_ID_HEADER = 'X-Racetrack-Profile-Id'
+
+_profile_id_regex = re.compile(r'^[0-9a-f]{32}$')
+
+
+class RequestProfiler:
+    """
+    Profiler of the single calls to the job's endpoints, requested with X-Racetrack-Profile header ("cpu" or "memory").
+    The profile is saved under an ID returned in X-Racetrack-Profile-Id response header.
+    Both profiling and downloading the profiles require the token, so nothing is allowed if it's not configured.
+    """
+
+    def __init__(
+        self,
+        profiles_dir: Path,
+        max_profiles: int = 20,
+        rate_limit: int = 6,
+        token: Optional[str] = None,
+        sampling_interval: float = 0.005,
+    ):
+        """
+        :param profiles_dir: directory to keep the profiles in
+        :param max_profiles: number of the latest profiles kept on disk
+        :param rate_limit: maximum number of profiled calls per minute
+        :param token: secret expected in X-Racetrack-Profile-Token header
+        """
+        self.profiles_dir = profiles_dir
+        self.max_profiles = max_profiles
+        self.rate_limit = rate_limit
+        self.token = token
+        self.sampling_interval = sampling_interval
+        self._recent_profiles: Deque[float] = collections.deque()
+        self._lock = threading.Lock()
+        self._memory_lock = threading.Lock()  # memray can't run more than one tracker at a time
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return is_env_flag_enabled('REQUEST_PROFILER', 'false')
+
+    @classmethod
+    def from_env(cls) -> 'RequestProfiler':
+        if not os.environ.get('REQUEST_PROFILER_TOKEN'):
+            logger.warning('REQUEST_PROFILER_TOKEN is not set, all profiling requests will be rejected')
+        return cls(
+            profiles_dir=Path(os.environ.get('REQUEST_PROFILER_DIR', '/tmp/racetrack-request-profiles')),
+            max_profiles=int(os.environ.get('REQUEST_PROFILER_MAX_PROFILES', 20)),
+            rate_limit=int(os.environ.get('REQUEST_PROFILER_RATE_LIMIT', 6)),
+            token=os.environ.get('REQUEST_PROFILER_TOKEN') or None,
+        )
+
+    def wrap_call(self, endpoint_caller: Callable[[], Any], request: Optional[Request],
+                  request_extra: Optional[dict]) -> Callable[[], Any]:
+        """Return the caller profiling the call if it was requested and allowed, or the original caller otherwise"""
+        if request is None or request_extra is None:
+            return endpoint_caller
+        profile_type = request.headers.get(PROFILE_REQUEST_HEADER)
+        if not profile_type:
+            return endpoint_caller
+        profile_type = profile_type.strip().lower()
+        if profile_type not in {'cpu', 'memory'}:
+            logger.warning(f'unknown profile type requested in {PROFILE_REQUEST_HEADER} header: {profile_type}')
+            return endpoint_caller
+        if not self.is_authorized(request):
+            logger.warning(f'profiling request rejected due to invalid {PROFILE_TOKEN_HEADER} header')
+            return endpoint_caller
+        if not self._acquire_rate_limit():
+            logger.warning(f'profiling request rejected due to the rate limit of {self.rate_limit} per minute')
+            return endpoint_caller
+
+        profile_id = uuid.uuid4().hex
+        request_extra[PROFILE_ID_HEADER] = profile_id
+        if profile_type == 'cpu':
+            return lambda: self._profile_cpu(endpoint_caller, profile_id)
+        return lambda: self._profile_memory(endpoint_caller, profile_id, request_extra)
+
+    def is_authorized(self, request: Request) -> bool:
+        """Check if the request carries the valid token. No request is authorized if the token is not configured"""
+        if not self.token:
+            return False
+        # compare bytes, as comparing strings fails with non-ASCII characters (headers are decoded as latin-1)
+        header_value = request.headers.get(PROFILE_TOKEN_HEADER, '').encode('latin-1')
+        return hmac.compare_digest(header_value, self.token.encode())
+
+    def get_profile_path(self, profile_id: str) -> Path:
+        if not _profile_id_regex.match(profile_id):
+            raise ValueError(f'invalid profile ID: {profile_id}')
+        for path in self.profiles_dir.glob(f'{profile_id}.*'):
+            return path
+        raise ValueError(f'profile not found: {profile_id}')
+
+    def _profile_cpu(self, endpoint_caller: Callable[[], Any], profile_id: str) -> Any:
+        sampler = StackSampler(self.sampling_interval, thread_ids={threading.get_ident()}, include_idle=True)
+        sampler.start()
+        try:
+            return endpoint_caller()
+        finally:
+            sampler.stop()
+            profile = to_speedscope_format(sampler.get_stacks(), name=f'Request profile {profile_id}')
+            self._prepare_dir()
+            (self.profiles_dir / f'{profile_id}.speedscope.json').write_text(json.dumps(profile))
+            logger.info(f'CPU profile of the request saved with ID {profile_id}')
+
+    def _profile_memory(self, endpoint_caller: Callable[[], Any], profile_id: str, request_extra: dict) -> Any:
+        import memray
+
+        if not self._memory_lock.acquire(blocking=False):
+            logger.warning('memory profile of another request is in progress, skipping profiling')
+            del request_extra[PROFILE_ID_HEADER]
+            return endpoint_caller()
+        try:
+            self._prepare_dir()
+            report_path = self.profiles_dir / f'{profile_id}.memray.bin'
+            try:
+                tracker = memray.Tracker(report_path, trace_python_allocators=True)
+                tracker.__enter__()
+            except RuntimeError as e:  # another tracker is active, e.g. MemoryProfiler
+                logger.warning(f'memory profiler is unavailable, skipping profiling: {e}')
+                del request_extra[PROFILE_ID_HEADER]
+                return endpoint_caller()
+            try:
+                return endpoint_caller()
+            finally:
+                tracker.__exit__(None, None, None)
+                logger.info(f'memory profile of the request saved with ID {profile_id}')
+        finally:
+            self._memory_lock.release()
+
+    def _acquire_rate_limit(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._recent_profiles and now - self._recent_profiles[0] > 60:
+                self._recent_profiles.popleft()
+            if len(self._recent_profiles) >= self.rate_limit:
+                return False
+            self._recent_profiles.append(now)
+            return True
+
+    def _prepare_dir(self):
+        """Create the directory and remove the oldest profiles exceeding the limit"""
+        with self._lock:
+            self.profiles_dir.mkdir(parents=True, exist_ok=True)
+            profiles = sorted(self.profiles_dir.iterdir(), key=lambda path: path.stat().st_mtime)
+            for path in profiles[:max(0, len(profiles) - self.max_profiles + 1)]:
+                path.unlink(missing_ok=True)
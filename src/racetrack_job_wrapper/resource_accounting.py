@@ -0,0 +1,68 @@
+import os
+import random
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.metrics import EndpointMetrics
+from racetrack_job_wrapper.profiler import AllocationTracker
+from racetrack_job_wrapper.utils.env import is_env_flag_enabled
+
+logger = get_logger(__name__)
+
+
+class ResourceAccounting:
+    """
+    Accounting of the resources used by the calls to the job's endpoints.
+    CPU time of the thread running the call is measured on every call.
+    Allocated memory is measured on a sampled fraction of the calls, one call at a time,
+    by tracing allocations with tracemalloc only for the duration of the call.
+    It's the peak of the memory traced during the call, so it includes allocations of other threads running meanwhile.
+    While the allocation tracker is started, calls are not measured, so that its traces are left intact.
+    """
+
+    def __init__(self, allocation_sample_rate: float = 0.1):
+        """
+        :param allocation_sample_rate: fraction of the calls (0-1) having their memory allocations measured
+        """
+        self.allocation_sample_rate = allocation_sample_rate
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return is_env_flag_enabled('ENDPOINT_RESOURCE_ACCOUNTING', 'false')
+
+    @classmethod
+    def from_env(cls) -> 'ResourceAccounting':
+        return cls(allocation_sample_rate=float(os.environ.get('ENDPOINT_ALLOCATION_SAMPLE_RATE', 0.1)))
+
+    def wrap_call(self, endpoint_caller: Callable[[], Any], endpoint_metrics: EndpointMetrics) -> Callable[[], Any]:
+        """Return the caller recording the resources used by the call in the endpoint's metrics"""
+        def accounted_call() -> Any:
+            if self.allocation_sample_rate > 0 and random.random() < self.allocation_sample_rate \
+                    and AllocationTracker.tracing_lock.acquire(blocking=False):
+                try:
+                    if not tracemalloc.is_tracing():  # allocation tracker is not started
+                        return self._measure_allocations(endpoint_caller, endpoint_metrics)
+                finally:
+                    AllocationTracker.tracing_lock.release()
+            return self._measure_cpu_time(endpoint_caller, endpoint_metrics)
+
+        return accounted_call
+
+    @staticmethod
+    def _measure_cpu_time(endpoint_caller: Callable[[], Any], endpoint_metrics: EndpointMetrics) -> Any:
+        start_cpu_time = time.thread_time()
+        try:
+            return endpoint_caller()
+        finally:
+            endpoint_metrics.cpu_time.observe(time.thread_time() - start_cpu_time)
+
+    def _measure_allocations(self, endpoint_caller: Callable[[], Any], endpoint_metrics: EndpointMetrics) -> Any:
+        tracemalloc.start(1)
+        try:
+            return self._measure_cpu_time(endpoint_caller, endpoint_metrics)
+        finally:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            endpoint_metrics.allocated_bytes.observe(peak_memory)
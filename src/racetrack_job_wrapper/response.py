@@ -1,14 +1,13 @@
+import sys
 from typing import Any
 
 from racetrack_job_wrapper.utils.datamodel import to_serializable
 
 
 def to_json_serializable(obj: Any) -> Any:
-    try:
-        import numpy as np
-        if isinstance(obj, np.ndarray):
-            return to_serializable(obj.tolist())
-    except ModuleNotFoundError:
-        pass
+    # numpy arrays can only come from a job that has already imported numpy, so don't pay for importing it here
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(obj, np.ndarray):
+        return to_serializable(obj.tolist())
 
     return to_serializable(obj)
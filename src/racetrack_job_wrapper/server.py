@@ -1,15 +1,23 @@
+import concurrent.futures
+import os
 import threading
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from racetrack_job_wrapper.log.context_error import ContextError
 from racetrack_job_wrapper.log.exception import short_exception_details, log_exception
 from racetrack_job_wrapper.log.logs import get_logger
 from racetrack_job_wrapper.api.asgi.asgi_reloader import ASGIReloader
 from racetrack_job_wrapper.api.asgi.asgi_server import serve_asgi_app
+from racetrack_job_wrapper.api.metrics import reset_multiprocess_dir
+from racetrack_job_wrapper.forkserver import run_forkserver
+from racetrack_job_wrapper.gc_tuning import tune_garbage_collector
 from racetrack_job_wrapper.profiler import MemoryProfiler
-from racetrack_job_wrapper.wrapper_api import create_health_app
+from racetrack_job_wrapper.loader import instantiate_class_entrypoint
+from racetrack_job_wrapper.validate import validate_entrypoint
+from racetrack_job_wrapper.warmup import warm_up_job
+from racetrack_job_wrapper.wrapper_api import ApiScaffold, attach_entrypoint, create_api_scaffold, create_health_app
 from racetrack_job_wrapper.health import HealthState
-from racetrack_job_wrapper.wrapper import create_entrypoint_app, read_job_manifest_dict
+from racetrack_job_wrapper.wrapper import read_job_manifest_dict
 
 logger = get_logger(__name__)
 
@@ -24,7 +32,14 @@ def run_configured_entrypoint(
     Load entrypoint class and run it embedded in a HTTP server with given configuration.
     First, start simple health monitoring server at once.
     Next, do the late init in background and serve proper entrypoint endpoints eventually.
+    If WORKER_PROCESSES is set, the entrypoint is served by that many processes forked from the template process.
     """
+    worker_processes = os.environ.get('WORKER_PROCESSES')
+    if worker_processes:
+        run_forkserver(http_port, entrypoint_path, entrypoint_classname, manifest_path, int(worker_processes))
+        return
+
+    reset_multiprocess_dir()
     MemoryProfiler.start()
 
     health_state = HealthState()
@@ -52,11 +67,26 @@ def _late_init(
     app_reloader: ASGIReloader,
 ):
     try:
-        manifest_dict = read_job_manifest_dict(manifest_path=manifest_path)
-        fastapi_app = create_entrypoint_app(
-            entrypoint_path, class_name=entrypoint_classname, health_state=health_state, manifest_dict=manifest_dict,
-        )
-        app_reloader.mount(fastapi_app)
+        with health_state.startup_phase('total'):
+            with health_state.startup_phase('read_manifest'):
+                manifest_dict = read_job_manifest_dict(manifest_path=manifest_path)
+            jobtype_extra = manifest_dict.get('jobtype_extra') or {}
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='app-scaffold') as executor:
+                scaffold_future = executor.submit(_create_api_scaffold, health_state, manifest_dict)
+                with health_state.startup_phase('instantiate_entrypoint'):
+                    entrypoint = instantiate_class_entrypoint(entrypoint_path, entrypoint_classname)
+                with health_state.startup_phase('validate_entrypoint'):
+                    validate_entrypoint(entrypoint)
+                scaffold = scaffold_future.result()
+
+            with health_state.startup_phase('attach_entrypoint'):
+                fastapi_app = attach_entrypoint(scaffold, entrypoint)
+            app_reloader.mount(fastapi_app)
+            with health_state.startup_phase('warmup'):
+                warm_up_job(entrypoint, fastapi_app, jobtype_extra)
+            with health_state.startup_phase('gc_tuning'):
+                tune_garbage_collector(jobtype_extra)
 
     except BaseException as e:
         error_details = short_exception_details(e)
@@ -65,3 +95,9 @@ def _late_init(
     else:
         health_state.set_ready()
         logger.info('Server is ready')
+
+
+def _create_api_scaffold(health_state: HealthState, manifest_dict: Dict[str, Any]) -> ApiScaffold:
+    """Build the part of the app independent of the entrypoint, concurrently with loading the entrypoint"""
+    with health_state.startup_phase('create_api_scaffold'):
+        return create_api_scaffold(health_state, manifest_dict)
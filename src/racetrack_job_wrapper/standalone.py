@@ -1,12 +1,18 @@
+import concurrent.futures
 import threading
-from typing import Type
+from typing import Any, Dict, Type
 
 from racetrack_job_wrapper.log.logs import configure_logs, get_logger
 from racetrack_job_wrapper.api.asgi.asgi_server import serve_asgi_app
+from racetrack_job_wrapper.api.metrics import reset_multiprocess_dir
 from racetrack_job_wrapper.api.asgi.asgi_reloader import ASGIReloader
 from racetrack_job_wrapper.entrypoint import JobEntrypoint
+from racetrack_job_wrapper.gc_tuning import tune_garbage_collector
 from racetrack_job_wrapper.profiler import MemoryProfiler
-from racetrack_job_wrapper.wrapper_api import create_api_app, create_health_app
+from racetrack_job_wrapper.warmup import warm_up_job
+from racetrack_job_wrapper.wrapper_api import (
+    ApiScaffold, attach_entrypoint, create_api_app, create_api_scaffold, create_health_app,
+)
 from racetrack_job_wrapper.health import HealthState
 from racetrack_job_wrapper.wrapper import read_job_manifest_dict
 from racetrack_job_wrapper.log.context_error import ContextError
@@ -24,6 +30,7 @@ def serve_job_class(entrypoint_class: Type[JobEntrypoint]):
     """
     configure_logs(log_level='debug')
 
+    reset_multiprocess_dir()
     MemoryProfiler.start()
 
     health_state = HealthState()
@@ -55,10 +62,12 @@ def serve_job_instance(entrypoint: JobEntrypoint):
 
     but if your job initialization takes some time, use `serve_job_class` instead.
     """
+    reset_multiprocess_dir()
     MemoryProfiler.start()
     health_state = HealthState(live=True, ready=True)
     manifest_dict = read_job_manifest_dict()
     app = create_api_app(entrypoint, health_state, manifest_dict)
+    tune_garbage_collector(manifest_dict.get('jobtype_extra') or {})
 
     def on_shutdown():
         MemoryProfiler.stop()
@@ -72,14 +81,25 @@ def _late_init(
     app_reloader: ASGIReloader,
 ):
     try:
-        logger.debug('Creating a Job instance...')
-        entrypoint = entrypoint_class()
-        logger.info('Job instance created')
-
-        manifest_dict = read_job_manifest_dict()
-        fastapi_app = create_api_app(entrypoint, health_state, manifest_dict)
-
-        app_reloader.mount(fastapi_app)
+        with health_state.startup_phase('total'):
+            manifest_dict = read_job_manifest_dict()
+            jobtype_extra = manifest_dict.get('jobtype_extra') or {}
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='app-scaffold') as executor:
+                scaffold_future = executor.submit(_create_api_scaffold, health_state, manifest_dict)
+                logger.debug('Creating a Job instance...')
+                with health_state.startup_phase('instantiate_entrypoint'):
+                    entrypoint = entrypoint_class()
+                logger.info('Job instance created')
+                scaffold = scaffold_future.result()
+
+            with health_state.startup_phase('attach_entrypoint'):
+                fastapi_app = attach_entrypoint(scaffold, entrypoint)
+            app_reloader.mount(fastapi_app)
+            with health_state.startup_phase('warmup'):
+                warm_up_job(entrypoint, fastapi_app, jobtype_extra)
+            with health_state.startup_phase('gc_tuning'):
+                tune_garbage_collector(jobtype_extra)
 
     except BaseException as e:
         error_details = short_exception_details(e)
@@ -88,3 +108,9 @@ def _late_init(
     else:
         health_state.set_ready()
         logger.info('Server is ready')
+
+
+def _create_api_scaffold(health_state: HealthState, manifest_dict: Dict[str, Any]) -> ApiScaffold:
+    """Build the part of the app independent of the entrypoint, concurrently with creating the job instance"""
+    with health_state.startup_phase('create_api_scaffold'):
+        return create_api_scaffold(health_state, manifest_dict)
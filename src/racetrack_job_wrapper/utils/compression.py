@@ -0,0 +1,98 @@
+import gzip
+import io
+import zlib
+from typing import BinaryIO, Optional
+
+SUPPORTED_ENCODINGS = {'gzip', 'deflate', 'zstd'}
+
+_READ_CHUNK_SIZE = 64 * 1024
+
+
+class DecompressedSizeExceeded(ValueError):
+    pass
+
+
+def _zstd_module():
+    """Return zstd implementation, either from standard library (Python 3.14+) or zstandard package"""
+    try:
+        from compression import zstd  # type: ignore
+        return zstd
+    except ModuleNotFoundError:
+        pass
+    try:
+        import zstandard  # type: ignore
+        return zstandard
+    except ModuleNotFoundError:
+        return None
+
+
+def is_zstd_available() -> bool:
+    return _zstd_module() is not None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress data with one of the supported Content-Encodings"""
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    if encoding == 'deflate':
+        return zlib.compress(data)
+    if encoding == 'zstd':
+        zstd = _zstd_module()
+        if zstd is None:
+            raise ValueError('zstd compression requires "zstandard" package to be installed')
+        return zstd.compress(data)
+    raise ValueError(f'unsupported content encoding: {encoding}')
+
+
+def decompress(data: bytes, encoding: str, max_size: Optional[int] = None) -> bytes:
+    """
+    Decompress data encoded with one of the supported Content-Encodings
+    :param data: compressed data
+    :param encoding: value of Content-Encoding header
+    :param max_size: maximum size of decompressed data in bytes, protecting from decompression bombs
+    """
+    encoding = encoding.strip().lower()
+    if encoding in {'gzip', 'deflate'}:
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        decompressor = zlib.decompressobj(wbits=wbits)
+        result = decompressor.decompress(data, max_size or 0)
+        if decompressor.unconsumed_tail:
+            raise DecompressedSizeExceeded(f'decompressed data exceeds maximum size of {max_size} bytes')
+        result += decompressor.flush()
+    elif encoding == 'zstd':
+        zstd = _zstd_module()
+        if zstd is None:
+            raise ValueError('zstd decompression requires "zstandard" package to be installed')
+        result = _read_bounded(_zstd_reader(zstd, data), max_size)
+    else:
+        raise ValueError(f'unsupported content encoding: {encoding}')
+
+    if max_size and len(result) > max_size:
+        raise DecompressedSizeExceeded(f'decompressed data exceeds maximum size of {max_size} bytes')
+    return result
+
+
+def _zstd_reader(zstd, data: bytes) -> BinaryIO:
+    """
+    Return a stream of decompressed zstd data, reading all the frames,
+    including the ones that don't declare their content size (produced by streaming encoders)
+    """
+    if zstd.__name__ == 'zstandard':
+        return zstd.ZstdDecompressor().stream_reader(data, read_across_frames=True)
+    return zstd.ZstdFile(io.BytesIO(data))
+
+
+def _read_bounded(reader: BinaryIO, max_size: Optional[int]) -> bytes:
+    """Read decompressed stream in chunks, failing as soon as it exceeds the maximum size"""
+    chunks = []
+    total_size = 0
+    with reader:
+        while True:
+            chunk = reader.read(_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            total_size += len(chunk)
+            if max_size and total_size > max_size:
+                raise DecompressedSizeExceeded(f'decompressed data exceeds maximum size of {max_size} bytes')
+            chunks.append(chunk)
+    return b''.join(chunks)
@@ -6,8 +6,6 @@ from typing import Dict, List, Type, TypeVar, Union, Any, get_origin, get_args
 import types
 from copy import deepcopy
 
-import yaml
-
 T = TypeVar("T")
 
 
@@ -77,6 +75,8 @@ def parse_yaml_datamodel(
     :param yaml_obj: YAML string
     :param clazz: dataclass type
     """
+    import yaml
+
     data = yaml.load(yaml_obj, Loader=yaml.FullLoader)
     if data is None:
         data = {}
@@ -98,6 +98,8 @@ def parse_yaml_file_datamodel(
 
 
 def datamodel_to_yaml_str(dataclazz) -> str:
+    import yaml
+
     data_dict = datamodel_to_dict(dataclazz)
     return yaml.dump(data_dict)
 
@@ -109,6 +111,8 @@ def convert_to_json(obj) -> str:
 
 
 def convert_to_yaml(obj) -> str:
+    import yaml
+
     obj = to_serializable(obj)
     obj = remove_none(obj)
     return yaml.dump(obj, sort_keys=False)
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from http import HTTPMethod
+from typing import Any, Dict
+
+import httpx
+from fastapi import FastAPI
+
+from racetrack_job_wrapper.entrypoint import JobEntrypoint, list_auxiliary_endpoints_v2
+from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.metrics import metric_warmup_duration
+
+logger = get_logger(__name__)
+
+
+def warm_up_job(entrypoint: JobEntrypoint, fastapi_app: FastAPI, jobtype_extra: Dict[str, Any]):
+    """
+    Warm up the job before it's marked as ready, so the first real requests don't pay for lazy initialization.
+    Call entrypoint's warmup method if it's defined.
+    Otherwise, if jobtype_extra.warmup_iterations is set,
+    send the examples returned by docs_input_examples to the job's endpoints that many times.
+    """
+    warmup_iterations = int(jobtype_extra.get('warmup_iterations') or 0)
+    if not hasattr(entrypoint, 'warmup') and warmup_iterations <= 0:
+        return
+
+    logger.info('Warming up the job...')
+    start_time = time.perf_counter()
+    try:
+        if hasattr(entrypoint, 'warmup'):
+            getattr(entrypoint, 'warmup')()
+        else:
+            asyncio.run(_replay_input_examples(entrypoint, fastapi_app, warmup_iterations))
+    except Exception as e:
+        logger.warning(f'Job warmup failed, proceeding without it: {e}')
+    finally:
+        duration = time.perf_counter() - start_time
+        metric_warmup_duration.set(duration)
+    logger.info(f'Job warmed up in {duration:.3f}s')
+
+
+async def _replay_input_examples(entrypoint: JobEntrypoint, fastapi_app: FastAPI, iterations: int):
+    """Send the input examples through the whole HTTP stack of the app, without opening a socket"""
+    input_examples: Dict[str, Dict[str, Any]] = {}
+    if hasattr(entrypoint, 'docs_input_examples'):
+        input_examples.update(getattr(entrypoint, 'docs_input_examples')() or {})
+    if '/perform' not in input_examples and hasattr(entrypoint, 'docs_input_example'):
+        input_examples['/perform'] = getattr(entrypoint, 'docs_input_example')()
+    get_endpoints = {endpoint.path for endpoint in list_auxiliary_endpoints_v2(entrypoint)
+                     if endpoint.method == HTTPMethod.GET}
+
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://warmup') as client:
+        for _ in range(iterations):
+            for endpoint_path, payload in input_examples.items():
+                url = f'/api/v1{endpoint_path}'
+                if endpoint_path in get_endpoints:
+                    response = await client.get(url, params=payload)
+                else:
+                    response = await client.post(url, json=payload)
+                if response.is_error:
+                    logger.warning(f'Warmup call to {endpoint_path} failed with status {response.status_code}: '
+                                   f'{response.text}')
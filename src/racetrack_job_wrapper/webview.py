@@ -6,7 +6,6 @@ import re
 
 from fastapi import APIRouter, FastAPI
 from fastapi.staticfiles import StaticFiles
-from a2wsgi import WSGIMiddleware
 
 from racetrack_job_wrapper.api.asgi.proxy import TrailingSlashForwarder, mount_at_base_path
 from racetrack_job_wrapper.log.logs import get_logger
@@ -30,6 +29,8 @@ def setup_webview_endpoints(
     # Determine whether webview app is WSGI or ASGI
     sig = signature(webview_app)
     if len(sig.parameters) == 2:
+        from a2wsgi import WSGIMiddleware
+
         webview_app = PathPrefixerWSGIMiddleware(webview_app, webview_base_url)
         webview_app = WSGIMiddleware(webview_app)
         logger.debug(f'Webview app recognized as a WSGI app')
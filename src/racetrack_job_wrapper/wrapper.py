@@ -2,7 +2,6 @@ import os
 from pathlib import Path
 from typing import Optional, Dict, Any
 
-import yaml
 from fastapi import FastAPI
 
 from racetrack_job_wrapper.wrapper_api import create_api_app
@@ -32,6 +31,8 @@ def create_entrypoint_app(
 
 
 def read_job_manifest_dict(manifest_path: Optional[str] = None) -> Dict[str, Any]:
+    import yaml
+
     with wrap_context('reading job manifest'):
         if manifest_path:
             job_manifest_yaml = Path(manifest_path).read_text()
@@ -1,6 +1,7 @@
 import functools
 from http import HTTPMethod
 import inspect
+import json
 import mimetypes
 import os
 import threading
@@ -12,12 +13,16 @@ from typing import Annotated, Any, Callable, Dict, List, Tuple, Union, Optional
 from contextvars import ContextVar
 
 from fastapi import Body, FastAPI, APIRouter, Query, Request, Response, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
+from starlette.middleware.gzip import GZipMiddleware
 
 from racetrack_job_wrapper.endpoint_config import EndpointConfig
-from racetrack_job_wrapper.profiler import MemoryProfiler
+from racetrack_job_wrapper.profiler import AllocationTracker, MemoryProfiler
+from racetrack_job_wrapper.cpu_profiler import ContinuousProfiler, CpuProfiler, render_flamegraph_svg, to_speedscope_format
+from racetrack_job_wrapper.request_profiler import PROFILE_ID_HEADER, PROFILE_TOKEN_HEADER, RequestProfiler
+from racetrack_job_wrapper.resource_accounting import ResourceAccounting
 from racetrack_job_wrapper.webview import setup_webview_endpoints
-from racetrack_job_wrapper.concurrency import AtomicInteger
+from racetrack_job_wrapper.concurrency import LockFreeReadGauge
 from racetrack_job_wrapper.docs import get_input_example, get_perform_docs
 from racetrack_job_wrapper.entrypoint import (
     JobEntrypoint,
@@ -28,20 +33,22 @@ from racetrack_job_wrapper.entrypoint import (
 )
 from racetrack_job_wrapper.health import setup_health_endpoints, HealthState
 from racetrack_job_wrapper.metrics import (
-    metric_request_duration,
-    metric_request_internal_errors,
+    EndpointMetrics,
     metric_requests_started,
-    metric_endpoint_requests_started,
     metric_requests_done,
     metric_last_call_timestamp,
+    metric_concurrency_limit,
     setup_entrypoint_metrics,
 )
 from racetrack_job_wrapper.response import to_json_serializable
 from racetrack_job_wrapper.log.logs import get_logger
+from racetrack_job_wrapper.api.asgi.decompression import RequestDecompressionMiddleware
+from racetrack_job_wrapper.api.asgi.loop_monitor import EventLoopMonitorMiddleware
 from racetrack_job_wrapper.api.asgi.fastapi import create_fastapi
 from racetrack_job_wrapper.api.asgi.proxy import mount_at_base_path
 from racetrack_job_wrapper.api.metrics import setup_metrics_endpoint
 from racetrack_job_wrapper.auth.methods import get_racetrack_authorizations_methods
+from racetrack_job_wrapper.utils.env import is_env_flag_enabled
 
 logger = get_logger(__name__)
 
@@ -51,8 +58,10 @@ class EndpointOptions:
     api: APIRouter
     entrypoint: JobEntrypoint
     jobtype_extra: Dict[str, Any]
-    active_requests_counter: AtomicInteger
-    concurrency_runner: Callable[[Callable[..., Any]], Any] = lambda f: f()
+    active_requests_counter: LockFreeReadGauge
+    concurrency_runner: Callable[[Callable[..., Any], EndpointMetrics], Any] = lambda f, endpoint_metrics: f()
+    request_profiler: Optional[RequestProfiler] = None
+    resource_accounting: Optional[ResourceAccounting] = None
 
 
 def create_health_app(health_state: HealthState) -> FastAPI:
@@ -83,11 +92,30 @@ def create_api_app(
     manifest_dict: Dict[str, Any] = {},
 ) -> FastAPI:
     """Create FastAPI app and register all endpoints without running a server"""
+    scaffold = create_api_scaffold(health_state, manifest_dict)
+    return attach_entrypoint(scaffold, entrypoint)
+
+
+@dataclass
+class ApiScaffold:
+    """Part of the API app that doesn't depend on the entrypoint, so it can be built while the entrypoint is loading"""
+    fastapi_app: FastAPI
+    tools_router: APIRouter
+    base_url: str
+    jobtype_extra: Dict[str, Any]
+    request_profiler: Optional[RequestProfiler]
+    resource_accounting: Optional[ResourceAccounting]
+
+
+def create_api_scaffold(
+    health_state: HealthState,
+    manifest_dict: Dict[str, Any] = {},
+) -> ApiScaffold:
+    """Create FastAPI app with middlewares, health, metrics and profiler endpoints, not knowing the entrypoint yet"""
     job_name = os.environ.get('JOB_NAME') or manifest_dict.get('name') or 'JOB_NAME'
     job_version = os.environ.get('JOB_VERSION') or manifest_dict.get('version') or 'JOB_VERSION'
     base_url = f'/pub/job/{job_name}/{job_version}'
     jobtype_extra: Dict[str, Any] = manifest_dict.get('jobtype_extra') or {}
-    home_page = jobtype_extra.get('home_page') or '/docs'
 
     fastapi_app = create_fastapi(
         title=f'Job - {job_name}',
@@ -100,29 +128,84 @@ def create_api_app(
         docs_url='/docs',
     )
 
+    fastapi_app.add_middleware(RequestDecompressionMiddleware)
+    response_compression_min_size = os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE')
+    if response_compression_min_size:
+        fastapi_app.add_middleware(GZipMiddleware, minimum_size=int(response_compression_min_size))
+    if is_env_flag_enabled('EVENT_LOOP_MONITOR'):
+        fastapi_app.add_middleware(EventLoopMonitorMiddleware)
+
     setup_health_endpoints(fastapi_app, health_state, job_name)
-    setup_entrypoint_metrics(entrypoint)
     setup_metrics_endpoint(fastapi_app)
+    if ContinuousProfiler.is_enabled():
+        ContinuousProfiler.start()
+    mimetypes.init()  # load the MIME types database used by static endpoints upfront
+
+    scaffold = ApiScaffold(
+        fastapi_app=fastapi_app,
+        tools_router=APIRouter(tags=['API']),
+        base_url=base_url,
+        jobtype_extra=jobtype_extra,
+        request_profiler=RequestProfiler.from_env() if RequestProfiler.is_enabled() else None,
+        resource_accounting=ResourceAccounting.from_env() if ResourceAccounting.is_enabled() else None,
+    )
+    _setup_tools_endpoints(scaffold)
+    return scaffold
+
+
+def attach_entrypoint(scaffold: ApiScaffold, entrypoint: JobEntrypoint) -> FastAPI:
+    """Register the endpoints of the entrypoint in the app scaffold and return the complete app"""
+    fastapi_app = scaffold.fastapi_app
+    setup_entrypoint_metrics(entrypoint)
 
     api_router = APIRouter(tags=['API'])
     options = EndpointOptions(
         api=api_router,
         entrypoint=entrypoint,
-        jobtype_extra=jobtype_extra,
-        active_requests_counter=AtomicInteger(0),
+        jobtype_extra=scaffold.jobtype_extra,
+        active_requests_counter=LockFreeReadGauge(0),
+        request_profiler=scaffold.request_profiler,
+        resource_accounting=scaffold.resource_accounting,
     )
     options.concurrency_runner = make_concurrency_runner(options)
-    _setup_api_endpoints(api_router, entrypoint, fastapi_app, base_url, options)
+    _setup_api_endpoints(api_router, entrypoint, fastapi_app, scaffold.base_url, options)
     _setup_request_context(entrypoint, fastapi_app)
     fastapi_app.include_router(api_router, prefix="/api/v1")
+    fastapi_app.include_router(scaffold.tools_router, prefix="/api/v1")
+
+    home_page = scaffold.jobtype_extra.get('home_page') or '/docs'
 
     @fastapi_app.get('/')
     def _root_endpoint():
-        return RedirectResponse(f"{base_url}{home_page}")
+        return RedirectResponse(f"{scaffold.base_url}{home_page}")
 
+    _prepare_openapi_schema(fastapi_app)
     return mount_at_base_path(fastapi_app, '/pub/job/{job_name}/{version}', '/pub/fatman/{job_name}/{version}')
 
 
+def _prepare_openapi_schema(fastapi_app: FastAPI):
+    """Generate OpenAPI schema at startup, so the first visit of the docs page doesn't wait for it"""
+    try:
+        fastapi_app.openapi()
+    except Exception as e:
+        logger.warning(f'failed to generate OpenAPI schema: {e}')
+
+
+def _setup_tools_endpoints(scaffold: ApiScaffold):
+    """Configure endpoints of the profilers, which don't depend on the entrypoint"""
+    api = scaffold.tools_router
+    if MemoryProfiler.is_enabled():
+        _setup_profiler_endpoints(api)
+    if AllocationTracker.is_enabled():
+        _setup_tracemalloc_endpoints(api)
+    if CpuProfiler.is_enabled():
+        _setup_cpu_profiler_endpoints(api)
+    if ContinuousProfiler.is_enabled():
+        _setup_continuous_profiler_endpoints(api)
+    if scaffold.request_profiler is not None:
+        _setup_request_profiler_endpoints(api, scaffold.request_profiler)
+
+
 def _setup_api_endpoints(
     api: APIRouter,
     entrypoint: JobEntrypoint,
@@ -138,14 +221,12 @@ def _setup_api_endpoints(
         _setup_auxiliary_endpoints_v2(options)
 
     _setup_static_endpoints(api, entrypoint)
-    if MemoryProfiler.is_enabled():
-        _setup_profiler_endpoints(api)
     setup_webview_endpoints(entrypoint, base_url, fastapi_app, api)
 
 
 def _setup_perform_endpoint(options: EndpointOptions):
     example_input = get_input_example(options.entrypoint, endpoint='/perform')
-    endpoint_path = '/perform'
+    endpoint_metrics = EndpointMetrics('/perform')
     summary = "Call main action"
     description = "Call main action"
     perform_docs = get_perform_docs(options.entrypoint)
@@ -162,7 +243,7 @@ def _setup_perform_endpoint(options: EndpointOptions):
         if not hasattr(options.entrypoint, 'perform'):
             raise ValueError("entrypoint doesn't have 'perform' method implemented")
         endpoint_method = options.entrypoint.perform
-        return _call_job_endpoint(endpoint_method, endpoint_path, payload, options)
+        return _call_job_endpoint(endpoint_method, endpoint_metrics, payload, options)
 
     @options.api.get('/parameters')
     def _get_parameters():
@@ -189,6 +270,7 @@ def _setup_auxiliary_endpoints(options: EndpointOptions):
             endpoint_docs = inspect.getdoc(_endpoint_method)
             if endpoint_docs:
                 description = f"Call auxiliary endpoint: {endpoint_docs}"
+            endpoint_metrics = EndpointMetrics(_endpoint_path)
 
             @options.api.post(
                 _endpoint_path,
@@ -197,7 +279,7 @@ def _setup_auxiliary_endpoints(options: EndpointOptions):
                 description=description,
             )
             def _auxiliary_endpoint(payload: Dict[str, Any] = Body(default=example_input)) -> Any:
-                return _call_job_endpoint(_endpoint_method, _endpoint_path, payload, options)
+                return _call_job_endpoint(_endpoint_method, endpoint_metrics, payload, options)
 
         _add_endpoint(endpoint_path, endpoint_method)
         logger.info(f'configured auxiliary endpoint: {endpoint_path}')
@@ -220,29 +302,15 @@ def _setup_auxiliary_endpoints_v2(options: EndpointOptions):
             if endpoint_docs:
                 description = f"Call auxiliary endpoint: {endpoint_docs}"
 
+            endpoint_metrics = EndpointMetrics(_endpoint_path)
+
             def forwarder(func):
                 @functools.wraps(func)
                 def forward(*args, **kwargs):
-                    metric_requests_started.inc()
-                    metric_endpoint_requests_started.labels(endpoint=endpoint_path).inc()
-                    start_time = time.time()
-                    try:
-                        def _endpoint_caller() -> Any:
-                            return func(*args, **kwargs)
-
-                        result = options.concurrency_runner(_endpoint_caller)
-                        return to_json_serializable(result)
-
-                    except TypeError as e:
-                        metric_request_internal_errors.labels(endpoint=endpoint_path).inc()
-                        raise ValueError(f'failed to call a function: {e}')
-                    except BaseException as e:
-                        metric_request_internal_errors.labels(endpoint=endpoint_path).inc()
-                        raise e
-                    finally:
-                        metric_request_duration.labels(endpoint=endpoint_path).observe(time.time() - start_time)
-                        metric_requests_done.inc()
-                        metric_last_call_timestamp.set(time.time())
+                    def _endpoint_caller() -> Any:
+                        return func(*args, **kwargs)
+
+                    return _instrumented_call(_endpoint_caller, endpoint_metrics, options)
                 
                 return forward
 
@@ -271,32 +339,55 @@ def _setup_auxiliary_endpoints_v2(options: EndpointOptions):
 
 def _call_job_endpoint(
     endpoint_method: Callable,
-    endpoint_path: str,
+    endpoint_metrics: EndpointMetrics,
     payload: Dict[str, Any],
     options: EndpointOptions,
 ) -> Any:
-    metric_requests_started.inc()
-    metric_endpoint_requests_started.labels(endpoint=endpoint_path).inc()
-    start_time = time.time()
-    try:
+    def _endpoint_caller() -> Any:
         assert payload is not None, 'payload is empty'
+        return endpoint_method(**payload)
 
-        def _endpoint_caller() -> Any:
-            return endpoint_method(**payload)
+    return _instrumented_call(_endpoint_caller, endpoint_metrics, options)
 
-        result = options.concurrency_runner(_endpoint_caller)
-        return to_json_serializable(result)
+
+def _instrumented_call(
+    endpoint_caller: Callable[[], Any],
+    endpoint_metrics: EndpointMetrics,
+    options: EndpointOptions,
+) -> Any:
+    metric_requests_started.inc()
+    endpoint_metrics.requests_started.inc()
+    if options.request_profiler is not None:
+        endpoint_caller = options.request_profiler.wrap_call(
+            endpoint_caller,
+            getattr(options.entrypoint, 'request_context').get(None),
+            getattr(options.entrypoint, 'request_extra').get(None),
+        )
+    if options.resource_accounting is not None:
+        endpoint_caller = options.resource_accounting.wrap_call(endpoint_caller, endpoint_metrics)
+    start_time = time.perf_counter()
+    try:
+        result = options.concurrency_runner(endpoint_caller, endpoint_metrics)
+        return _serialize_result(result, endpoint_metrics)
 
     except TypeError as e:
-        metric_request_internal_errors.labels(endpoint=endpoint_path).inc()
+        endpoint_metrics.internal_errors.inc()
         raise ValueError(f'failed to call a function: {e}')
     except BaseException as e:
-        metric_request_internal_errors.labels(endpoint=endpoint_path).inc()
+        endpoint_metrics.internal_errors.inc()
         raise e
     finally:
-        metric_request_duration.labels(endpoint=endpoint_path).observe(time.time() - start_time)
+        endpoint_metrics.request_duration.observe(time.perf_counter() - start_time)
         metric_requests_done.inc()
-        metric_last_call_timestamp.set(time.time())
+        metric_last_call_timestamp.set_to_current_time()
+
+
+def _serialize_result(result: Any, endpoint_metrics: EndpointMetrics) -> Any:
+    start_time = time.perf_counter()
+    try:
+        return to_json_serializable(result)
+    finally:
+        endpoint_metrics.serialization_duration.observe(time.perf_counter() - start_time)
 
 
 def _setup_static_endpoints(api: APIRouter, entrypoint: JobEntrypoint):
@@ -322,22 +413,168 @@ def _setup_profiler_endpoints(api: APIRouter):
     @api.get('/profiler/memray/report')
     def _download_memray_report():
         """Download memray report"""
-        report_data: bytes = MemoryProfiler.get_report_bytes()
-        headers = {'Content-Disposition': f'inline; filename="{MemoryProfiler.REPORT_FILENAME}"'}
-        return Response(report_data, headers=headers, media_type='application/octet-stream')
+        return FileResponse(MemoryProfiler.get_report_path(), media_type='application/octet-stream',
+                            filename=MemoryProfiler.REPORT_FILENAME, content_disposition_type='inline')
 
     @api.get('/profiler/memray/flamegraph')
     def _download_memray_flamegraph():
-        """Download memray report"""
-        file_data: bytes = MemoryProfiler.get_flamegraph_html()
-        headers = {'Content-Disposition': f'inline; filename="{MemoryProfiler.FLAMEGRAPH_FILENAME}"'}
-        return Response(file_data, headers=headers, media_type='text/html')
+        """Download memray flamegraph. If it's not generated yet, start generating it and return its status"""
+        path = MemoryProfiler.request_output('flamegraph')
+        if path is None:
+            return JSONResponse(MemoryProfiler.get_generation_status()['flamegraph'], status_code=202)
+        return FileResponse(path, media_type='text/html',
+                            filename=MemoryProfiler.FLAMEGRAPH_FILENAME, content_disposition_type='inline')
 
     @api.get('/profiler/memray/stats')
     def _get_memray_stats():
-        """Get memray report stats"""
-        data: str = MemoryProfiler.get_stats_output()
-        return Response(data, media_type='text/plain')
+        """Get memray report stats. If they're not generated yet, start generating them and return their status"""
+        path = MemoryProfiler.request_output('stats')
+        if path is None:
+            return JSONResponse(MemoryProfiler.get_generation_status()['stats'], status_code=202)
+        return FileResponse(path, media_type='text/plain')
+
+    @api.get('/profiler/memray/status')
+    def _get_memray_generation_status():
+        """Get status of generating memray flamegraph and stats reports"""
+        return MemoryProfiler.get_generation_status()
+
+    @api.get('/profiler/memray/snapshots')
+    def _list_memray_snapshots():
+        """List memray snapshots, taken periodically if MEMRAY_SNAPSHOT_INTERVAL is set"""
+        return MemoryProfiler.list_snapshots()
+
+    @api.get('/profiler/memray/snapshots/diff')
+    def _diff_memray_snapshots(before: str, after: str, top: int = 20):
+        """Compare two memray snapshots and return the allocation sites that grew the most"""
+        return MemoryProfiler.diff_snapshots(before, after, top)
+
+    @api.get('/profiler/memray/snapshots/{name}')
+    def _download_memray_snapshot(name: str):
+        """Download memray snapshot"""
+        return FileResponse(MemoryProfiler.get_snapshot_path(name), media_type='application/octet-stream',
+                            filename=name, content_disposition_type='inline')
+
+
+def _setup_tracemalloc_endpoints(api: APIRouter):
+    """Configure tracemalloc allocation tracker endpoints, which can be turned on and off at runtime"""
+    @api.post('/profiler/tracemalloc/start')
+    def _start_tracemalloc(frames: Optional[int] = Query(None, description='number of frames kept per allocation')):
+        """Start tracing memory allocations with tracemalloc"""
+        AllocationTracker.start(frames)
+        return AllocationTracker.get_status()
+
+    @api.post('/profiler/tracemalloc/stop')
+    def _stop_tracemalloc():
+        """Stop tracing memory allocations"""
+        AllocationTracker.stop()
+
+    @api.get('/profiler/tracemalloc/status')
+    def _get_tracemalloc_status():
+        """Get status of the allocation tracker and its own memory overhead"""
+        return AllocationTracker.get_status()
+
+    @api.get('/profiler/tracemalloc/top')
+    def _get_tracemalloc_top(
+        limit: int = 20,
+        group_by: str = Query('lineno', pattern='^(lineno|filename|traceback)$'),
+    ):
+        """Get the allocation sites holding the most memory"""
+        return AllocationTracker.get_top_allocations(limit, group_by)
+
+    @api.post('/profiler/tracemalloc/snapshots')
+    def _take_tracemalloc_snapshot():
+        """Take a snapshot of the traced allocations to compare with later"""
+        return {'snapshot': AllocationTracker.take_snapshot()}
+
+    @api.get('/profiler/tracemalloc/snapshots/diff')
+    def _diff_tracemalloc_snapshots(
+        before: str,
+        after: Optional[str] = Query(None, description='later snapshot, current allocations if not given'),
+        limit: int = 20,
+        group_by: str = Query('lineno', pattern='^(lineno|filename|traceback)$'),
+    ):
+        """Compare snapshots and return the allocation sites that grew the most"""
+        return AllocationTracker.compare_snapshots(before, after, limit, group_by)
+
+
+def _setup_cpu_profiler_endpoints(api: APIRouter):
+    """Configure CPU profiler endpoints to turn it on and off"""
+    @api.post('/profiler/cpu/start')
+    def _start_cpu_profiler():
+        """Start CPU sampling profiler"""
+        CpuProfiler.start()
+
+    @api.post('/profiler/cpu/stop')
+    def _stop_cpu_profiler():
+        """Stop CPU sampling profiler"""
+        CpuProfiler.stop()
+
+    @api.get('/profiler/cpu/report')
+    def _download_cpu_report(format: str = Query('speedscope', description='"speedscope" or "collapsed"')):
+        """Download CPU profile in speedscope or collapsed stack format"""
+        if format == 'collapsed':
+            headers = {'Content-Disposition': f'inline; filename="{CpuProfiler.COLLAPSED_FILENAME}"'}
+            return Response(CpuProfiler.get_collapsed_output(), headers=headers, media_type='text/plain')
+        if format == 'speedscope':
+            headers = {'Content-Disposition': f'inline; filename="{CpuProfiler.SPEEDSCOPE_FILENAME}"'}
+            return Response(json.dumps(CpuProfiler.get_speedscope_output()), headers=headers,
+                            media_type='application/json')
+        raise HTTPException(400, f'unknown CPU profile format: {format}')
+
+    @api.get('/profiler/cpu/flamegraph')
+    def _download_cpu_flamegraph():
+        """Download CPU flame graph"""
+        headers = {'Content-Disposition': f'inline; filename="{CpuProfiler.FLAMEGRAPH_FILENAME}"'}
+        return Response(CpuProfiler.get_flamegraph_svg(), headers=headers, media_type='image/svg+xml')
+
+
+def _setup_continuous_profiler_endpoints(api: APIRouter):
+    """Configure endpoints to dump the samples kept by the continuous profiler"""
+    def get_window_stacks(since: Optional[float], until: Optional[float], last: Optional[float]):
+        if last is not None:
+            since = time.time() - last
+        return ContinuousProfiler.get_stacks(since, until)
+
+    window_descriptions = {
+        'since': 'beginning of the time window as UNIX timestamp',
+        'until': 'end of the time window as UNIX timestamp',
+        'last': 'length of the time window ending now, in seconds',
+    }
+
+    @api.get('/profiler/continuous/flamegraph')
+    def _download_continuous_flamegraph(
+        since: Optional[float] = Query(None, description=window_descriptions['since']),
+        until: Optional[float] = Query(None, description=window_descriptions['until']),
+        last: Optional[float] = Query(None, description=window_descriptions['last']),
+    ):
+        """Download CPU flame graph of the given time window"""
+        svg = render_flamegraph_svg(get_window_stacks(since, until, last))
+        return Response(svg, media_type='image/svg+xml')
+
+    @api.get('/profiler/continuous/report')
+    def _download_continuous_report(
+        since: Optional[float] = Query(None, description=window_descriptions['since']),
+        until: Optional[float] = Query(None, description=window_descriptions['until']),
+        last: Optional[float] = Query(None, description=window_descriptions['last']),
+    ):
+        """Download CPU profile of the given time window in speedscope format"""
+        profile = to_speedscope_format(get_window_stacks(since, until, last), name='Continuous CPU profile')
+        return Response(json.dumps(profile), media_type='application/json')
+
+
+def _setup_request_profiler_endpoints(api: APIRouter, request_profiler: RequestProfiler):
+    """Configure endpoint to download profiles of the single requests"""
+    @api.get('/profiler/requests/{profile_id}')
+    def _download_request_profile(profile_id: str, request: Request):
+        """Download profile of a request, saved under the ID returned in X-Racetrack-Profile-Id header"""
+        if not request_profiler.is_authorized(request):
+            raise HTTPException(401, f'invalid {PROFILE_TOKEN_HEADER} header')
+        try:
+            path = request_profiler.get_profile_path(profile_id)
+        except ValueError as e:
+            raise HTTPException(404, str(e))
+        media_type = 'application/json' if path.suffix == '.json' else 'application/octet-stream'
+        return FileResponse(path, media_type=media_type, filename=path.name)
 
 
 def _setup_static_endpoint(
@@ -405,10 +642,13 @@ def _setup_request_context(entrypoint: JobEntrypoint, fastapi_app: FastAPI):
     @fastapi_app.middleware('http')
     async def request_context_middleware(request: Request, call_next) -> Response:
         request_context_token = request_context.set(request)
-        request_extra_token = request_extra.set({})
+        extra: Dict[str, Any] = {}
+        request_extra_token = request_extra.set(extra)
         response = await call_next(request)
         request_context.reset(request_context_token)
         request_extra.reset(request_extra_token)
+        if PROFILE_ID_HEADER in extra:
+            response.headers[PROFILE_ID_HEADER] = extra[PROFILE_ID_HEADER]
         return response
 
 
@@ -420,24 +660,44 @@ def jobtype_extra_int(jobtype_extra: Dict[str, Any], field_name: str) -> Optiona
     return int(str_val)
 
 
-def make_concurrency_runner(options: EndpointOptions) -> Callable[[Callable[..., Any]], Any]:
+def make_concurrency_runner(options: EndpointOptions) -> Callable[[Callable[..., Any], EndpointMetrics], Any]:
     max_concurrency: Optional[int] = jobtype_extra_int(options.jobtype_extra, 'max_concurrency')
+    metric_concurrency_limit.set(max_concurrency or 0)
     if not max_concurrency:
-        return lambda f: f()
+        return _execute_endpoint
     max_concurrency_queue: Optional[int] = jobtype_extra_int(options.jobtype_extra, 'max_concurrency_queue')
     concurrency_semaphore = threading.BoundedSemaphore(value=max_concurrency)
 
-    def concurrency_wrapper(f: Callable[..., Any]) -> Any:
-        queue_size: int = options.active_requests_counter.value - max_concurrency
-        if max_concurrency_queue is not None and queue_size >= max_concurrency_queue:
+    def concurrency_wrapper(f: Callable[..., Any], endpoint_metrics: EndpointMetrics) -> Any:
+        if max_concurrency_queue is not None and \
+                options.active_requests_counter.value - max_concurrency >= max_concurrency_queue:
             # Too Many Requests
             raise HTTPException(429, f'too many requests waiting in a queue. Job is set to process {max_concurrency}'
                                      f' requests concurrently with a queue of max size {max_concurrency_queue}')
         try:
             options.active_requests_counter.inc()
-            with concurrency_semaphore:
-                return f()
+            endpoint_metrics.queued.inc()
+            queue_start_time = time.perf_counter()
+            try:
+                concurrency_semaphore.acquire()
+            finally:
+                endpoint_metrics.queue_wait_duration.observe(time.perf_counter() - queue_start_time)
+                endpoint_metrics.queued.dec()
+            try:
+                return _execute_endpoint(f, endpoint_metrics)
+            finally:
+                concurrency_semaphore.release()
         finally:
             options.active_requests_counter.dec()
 
     return concurrency_wrapper
+
+
+def _execute_endpoint(f: Callable[..., Any], endpoint_metrics: EndpointMetrics) -> Any:
+    endpoint_metrics.in_flight.inc()
+    start_time = time.perf_counter()
+    try:
+        return f()
+    finally:
+        endpoint_metrics.execution_duration.observe(time.perf_counter() - start_time)
+        endpoint_metrics.in_flight.dec()
@@ -0,0 +1,46 @@
+"""
+Compare the counters used on a request's hot path, updated by many threads at the same time.
+Every iteration reads, increments and decrements the counter, like the concurrency runner does.
+Run with: cd tests && python benchmark/bench_concurrency.py
+"""
+import threading
+import time
+
+from racetrack_job_wrapper.concurrency import AtomicInteger, LockFreeReadGauge
+
+THREADS = 64
+ITERATIONS = 20000
+
+
+def measure(counter) -> float:
+    barrier = threading.Barrier(THREADS + 1)
+
+    def work():
+        barrier.wait()
+        for _ in range(ITERATIONS):
+            counter.value
+            counter.inc()
+            counter.dec()
+
+    threads = [threading.Thread(target=work) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert counter.value == 0
+    return elapsed / (THREADS * ITERATIONS)
+
+
+def main():
+    for name, counter in [
+        ('AtomicInteger', AtomicInteger()),
+        ('LockFreeReadGauge', LockFreeReadGauge()),
+    ]:
+        print(f'{name}: {measure(counter) * 1e9:.0f} ns per iteration ({THREADS} threads)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Measure the cost of metrics instrumentation per request, without the HTTP layer.
+"labels lookup" reproduces the former way of looking up labelled metrics on every request,
+"pre-bound" is the current instrumentation with the metrics bound when the endpoint is registered.
+Run with: cd tests && python benchmark/bench_instrumentation.py
+"""
+import time
+from typing import Any, Callable
+
+from fastapi import APIRouter
+
+from racetrack_job_wrapper.concurrency import LockFreeReadGauge
+from racetrack_job_wrapper.metrics import (
+    EndpointMetrics,
+    metric_endpoint_requests_started,
+    metric_last_call_timestamp,
+    metric_request_duration,
+    metric_request_execution_duration,
+    metric_request_internal_errors,
+    metric_requests_done,
+    metric_requests_in_flight,
+    metric_requests_started,
+    metric_response_serialization_duration,
+)
+from racetrack_job_wrapper.response import to_json_serializable
+from racetrack_job_wrapper.wrapper_api import EndpointOptions, _instrumented_call, make_concurrency_runner
+
+ITERATIONS = 200000
+
+
+def labels_lookup_call(endpoint_caller: Callable[[], Any], endpoint_path: str) -> Any:
+    metric_requests_started.inc()
+    metric_endpoint_requests_started.labels(endpoint=endpoint_path).inc()
+    start_time = time.time()
+    try:
+        metric_requests_in_flight.labels(endpoint=endpoint_path).inc()
+        execution_start_time = time.time()
+        try:
+            result = endpoint_caller()
+        finally:
+            metric_request_execution_duration.labels(endpoint=endpoint_path).observe(time.time() - execution_start_time)
+            metric_requests_in_flight.labels(endpoint=endpoint_path).dec()
+        serialization_start_time = time.time()
+        try:
+            return to_json_serializable(result)
+        finally:
+            metric_response_serialization_duration.labels(endpoint=endpoint_path).observe(time.time() - serialization_start_time)
+    except BaseException as e:
+        metric_request_internal_errors.labels(endpoint=endpoint_path).inc()
+        raise e
+    finally:
+        metric_request_duration.labels(endpoint=endpoint_path).observe(time.time() - start_time)
+        metric_requests_done.inc()
+        metric_last_call_timestamp.set(time.time())
+
+
+def measure(call: Callable[[], Any]) -> float:
+    for _ in range(1000):  # warmup
+        call()
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        call()
+    return (time.perf_counter() - start) / ITERATIONS
+
+
+def main():
+    options = EndpointOptions(api=APIRouter(), entrypoint=object(), jobtype_extra={},
+                              active_requests_counter=LockFreeReadGauge())
+    options.concurrency_runner = make_concurrency_runner(options)
+    endpoint_metrics = EndpointMetrics('/perform')
+
+    def endpoint_caller() -> Any:
+        return 42
+
+    baseline = measure(endpoint_caller)
+    before = measure(lambda: labels_lookup_call(endpoint_caller, '/perform'))
+    after = measure(lambda: _instrumented_call(endpoint_caller, endpoint_metrics, options))
+    print(f'labels lookup: {(before - baseline) * 1e9:.0f} ns per request')
+    print(f'pre-bound: {(after - baseline) * 1e9:.0f} ns per request')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Measure the wrapper's overhead per hop of a job chain, using in-process Local Pub (no sockets involved).
+Run with: cd tests && python benchmark/bench_local_pub.py
+"""
+import logging
+import time
+
+import httpx
+
+from racetrack_job_wrapper.loader import instantiate_class_entrypoint
+from racetrack_job_wrapper.local_pub import LocalPub, LOCAL_PUB_URL, SyncASGITransport
+from racetrack_job_wrapper.log.logs import configure_logs
+
+ITERATIONS = 2000
+
+
+def measure(client: httpx.Client, path: str) -> float:
+    for _ in range(100):  # warmup
+        client.post(path, json={'numbers': [40, 2]})
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        response = client.post(path, json={'numbers': [40, 2]})
+        assert response.status_code == 200, response.text
+    return (time.perf_counter() - start) / ITERATIONS
+
+
+def main():
+    configure_logs(log_level='error')
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    pub = LocalPub()
+    pub.add_job_entrypoint('adder', '1.0.0', instantiate_class_entrypoint('sample/adder_model.py', 'AdderModel'))
+    pub.add_job_entrypoint('chain', '1.0.0', instantiate_class_entrypoint('sample/chain_model.py', 'ChainModel'))
+
+    with pub.activate(), httpx.Client(transport=SyncASGITransport(pub), base_url=LOCAL_PUB_URL) as client:
+        single = measure(client, '/job/adder/latest/api/v1/perform')
+        chained = measure(client, '/job/chain/latest/api/v1/perform')
+
+    print(f'single job call: {single * 1e6:.0f} us')
+    print(f'chain of 2 jobs: {chained * 1e6:.0f} us')
+    print(f'overhead per hop: {(chained - single) * 1e6:.0f} us')
+
+
+if __name__ == '__main__':
+    main()
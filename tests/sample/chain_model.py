@@ -0,0 +1,10 @@
+from typing import List
+
+from racetrack_job_wrapper.call import call_job
+
+
+class ChainModel:
+    def perform(self, numbers: List[float]) -> float:
+        """Round result from another model"""
+        partial = call_job(self, 'adder', '/api/v1/perform', {'numbers': numbers})
+        return round(partial)
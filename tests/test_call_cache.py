@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+from racetrack_job_wrapper.call_cache import CallCache, make_cache_key, cache_ttl_from_headers
+
+
+def test_cache_reuses_identical_calls():
+    cache = CallCache()
+    calls = []
+
+    def fetch() -> httpx.Response:
+        calls.append(1)
+        return httpx.Response(200, content=b'42')
+
+    key = make_cache_key('adder', 'latest', '/api/v1/perform', 'POST', {'numbers': [40, 2]})
+    assert cache.get_or_fetch('adder', key, 60, fetch) == b'42'
+    assert cache.get_or_fetch('adder', key, 60, fetch) == b'42'
+    assert len(calls) == 1
+
+    other_key = make_cache_key('adder', 'latest', '/api/v1/perform', 'POST', {'numbers': [1, 2]})
+    cache.get_or_fetch('adder', other_key, 60, fetch)
+    assert len(calls) == 2
+
+
+def test_cache_key_ignores_dict_order():
+    key1 = make_cache_key('adder', '1.0.0', '/api/v1/perform', 'post', {'a': 1, 'b': 2})
+    key2 = make_cache_key('adder', '1.0.0', '/api/v1/perform', 'POST', {'b': 2, 'a': 1})
+    assert key1 == key2
+
+
+def test_cache_expires_and_evicts_least_recently_used():
+    cache = CallCache(max_entries=2)
+    cache.get_or_fetch('job', 'a', 0.05, lambda: httpx.Response(200, content=b'1'))
+    time.sleep(0.1)
+    assert cache.get_or_fetch('job', 'a', 60, lambda: httpx.Response(200, content=b'2')) == b'2'
+
+    cache.get_or_fetch('job', 'b', 60, lambda: httpx.Response(200, content=b'3'))
+    cache.get_or_fetch('job', 'a', 60, lambda: httpx.Response(200, content=b'-'))  # touch "a"
+    cache.get_or_fetch('job', 'c', 60, lambda: httpx.Response(200, content=b'4'))
+    assert cache.get_or_fetch('job', 'a', 60, lambda: httpx.Response(200, content=b'-')) == b'2'
+    assert cache.get_or_fetch('job', 'b', 60, lambda: httpx.Response(200, content=b'5')) == b'5'
+
+
+def test_cache_control_is_honored():
+    assert cache_ttl_from_headers(httpx.Headers({}), 60) == 60
+    assert cache_ttl_from_headers(httpx.Headers({'Cache-Control': 'max-age=5'}), 60) == 5
+    assert cache_ttl_from_headers(httpx.Headers({'Cache-Control': 'public, max-age=600'}), 60) == 60
+    assert cache_ttl_from_headers(httpx.Headers({'Cache-Control': 'no-store'}), 60) == 0
+
+    cache = CallCache()
+    cache.get_or_fetch('job', 'a', 60, lambda: httpx.Response(200, content=b'1', headers={'Cache-Control': 'no-cache'}))
+    assert cache.get_or_fetch('job', 'a', 60, lambda: httpx.Response(200, content=b'2')) == b'2'
+
+
+def test_concurrent_calls_are_coalesced():
+    cache = CallCache()
+    calls = []
+    results = []
+
+    def fetch() -> httpx.Response:
+        calls.append(1)
+        time.sleep(0.2)
+        return httpx.Response(200, content=b'42')
+
+    def call():
+        results.append(cache.get_or_fetch('job', 'key', 60, fetch))
+
+    threads = [threading.Thread(target=call) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [b'42'] * 10
+
+
+def test_coalesced_calls_wait_no_longer_than_their_timeout():
+    cache = CallCache()
+    leader_released = threading.Event()
+    leader_started = threading.Event()
+
+    def hanging_fetch() -> httpx.Response:
+        leader_started.set()
+        leader_released.wait(5)
+        return httpx.Response(200, content=b'late')
+
+    leader = threading.Thread(target=cache.get_or_fetch, args=('job', 'key', 60, hanging_fetch))
+    leader.start()
+    try:
+        leader_started.wait(5)
+        start_time = time.monotonic()
+        content = cache.get_or_fetch('job', 'key', 60, lambda: httpx.Response(200, content=b'direct'), timeout=0.2)
+        assert content == b'direct', 'follower should call the job directly after its timeout'
+        assert time.monotonic() - start_time < 2
+    finally:
+        leader_released.set()
+        leader.join()
+
+
+def test_coalesced_calls_raise_their_own_exceptions():
+    cache = CallCache()
+    errors = []
+
+    def failing_fetch() -> httpx.Response:
+        time.sleep(0.2)
+        raise ValueError('job is down')
+
+    def call():
+        try:
+            cache.get_or_fetch('job', 'key', 60, failing_fetch)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 5
+    leader_errors = [e for e in errors if isinstance(e, ValueError)]
+    assert len(leader_errors) == 1
+    for error in errors:
+        if error is not leader_errors[0]:
+            assert isinstance(error, RuntimeError) and error.__cause__ is leader_errors[0]
+    assert len({id(error) for error in errors}) == 5
+
+
+def test_async_coalesced_calls_wait_no_longer_than_their_timeout():
+    cache = CallCache()
+
+    async def hanging_fetch() -> httpx.Response:
+        await asyncio.sleep(2)
+        return httpx.Response(200, content=b'late')
+
+    async def direct_fetch() -> httpx.Response:
+        return httpx.Response(200, content=b'direct')
+
+    async def run():
+        leader = asyncio.create_task(cache.get_or_fetch_async('job', 'key', 60, hanging_fetch))
+        await asyncio.sleep(0.05)
+        content = await cache.get_or_fetch_async('job', 'key', 60, direct_fetch, timeout=0.1)
+        leader.cancel()
+        return content
+
+    assert asyncio.run(run()) == b'direct'
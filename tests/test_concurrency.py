@@ -0,0 +1,26 @@
+import threading
+
+from racetrack_job_wrapper.concurrency import LockFreeReadGauge
+
+
+def _run_threads(target, count: int = 16):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_lock_free_read_gauge():
+    gauge = LockFreeReadGauge()
+
+    def work():
+        for _ in range(1000):
+            gauge.inc()
+            gauge.dec()
+        gauge.inc(2)
+
+    _run_threads(work)
+    assert gauge.value == 32
+    gauge.value = 3
+    assert gauge.value == 3
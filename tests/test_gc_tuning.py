@@ -0,0 +1,24 @@
+import gc
+
+from racetrack_job_wrapper.gc_tuning import tune_garbage_collector
+
+
+def test_gc_freeze_and_thresholds():
+    original_thresholds = gc.get_threshold()
+    try:
+        tune_garbage_collector({'gc_freeze': 'true', 'gc_thresholds': '50000,20,30'})
+        assert gc.get_freeze_count() > 0
+        assert gc.get_threshold() == (50000, 20, 30)
+
+        tune_garbage_collector({'gc_thresholds': [1000]})
+        assert gc.get_threshold()[0] == 1000
+    finally:
+        gc.unfreeze()
+        gc.set_threshold(*original_thresholds)
+
+
+def test_gc_untouched_by_default():
+    original_thresholds = gc.get_threshold()
+    tune_garbage_collector({})
+    assert gc.get_freeze_count() == 0
+    assert gc.get_threshold() == original_thresholds
@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+from typing import Set
+
+# Optional dependencies that shouldn't be loaded until they're needed
+LAZY_MODULES = {'memray', 'yaml', 'numpy', 'a2wsgi'}
+
+
+def _get_imported_modules(module: str) -> Set[str]:
+    """Import a module in a fresh interpreter and return names of all modules loaded along with it"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True, env=os.environ.copy())
+    imported_modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        name = line.split('|')[-1]
+        imported_modules.add(name.strip())
+    return imported_modules
+
+
+def test_wrapper_imports_optional_dependencies_lazily():
+    imported_modules = _get_imported_modules('racetrack_job_wrapper.wrapper_api')
+
+    assert 'racetrack_job_wrapper.wrapper_api' in imported_modules
+    eagerly_loaded = LAZY_MODULES & imported_modules
+    assert not eagerly_loaded, f'optional dependencies should be imported lazily: {eagerly_loaded}'
@@ -0,0 +1,72 @@
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from racetrack_job_wrapper.api.asgi.decompression import RequestDecompressionMiddleware
+from racetrack_job_wrapper.call import call_job
+from racetrack_job_wrapper.loader import instantiate_class_entrypoint
+from racetrack_job_wrapper.local_pub import LocalPub
+from racetrack_job_wrapper.utils.compression import DecompressedSizeExceeded, compress, decompress, is_zstd_available
+from racetrack_job_wrapper.wrapper import create_entrypoint_app
+
+
+def test_compressed_request_body_is_decompressed():
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    body = gzip.compress(json.dumps({'numbers': [40, 2]}).encode())
+    response = client.post('/api/v1/perform', content=body,
+                           headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    assert response.status_code == 200, response.text
+    assert response.json() == 42
+
+    response = client.post('/api/v1/perform', content=body,
+                           headers={'Content-Type': 'application/json', 'Content-Encoding': 'br'})
+    assert response.status_code == 415
+
+
+def test_decompression_bomb_is_rejected():
+    async def app(scope, receive, send):
+        raise AssertionError('request should not reach the app')
+
+    client = TestClient(RequestDecompressionMiddleware(app, max_size=1024))
+    response = client.post('/', content=gzip.compress(b'0' * 1024 * 1024), headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 413
+
+
+@pytest.mark.skipif(not is_zstd_available(), reason='zstd is not available')
+def test_zstd_decompression_is_bounded():
+    data = b'0' * 1024 * 1024
+    assert decompress(compress(data, 'zstd') + compress(b'1', 'zstd'), 'zstd') == data + b'1'
+    with pytest.raises(DecompressedSizeExceeded):
+        decompress(compress(data, 'zstd'), 'zstd', max_size=1024)
+
+
+def test_outgoing_calls_are_compressed(monkeypatch):
+    pub = LocalPub()
+    pub.add_job_entrypoint('adder', '1.0.0', instantiate_class_entrypoint('sample/adder_model.py', 'AdderModel'))
+    saved_before = REGISTRY.get_sample_value('job_call_compression_saved_bytes_total', {'encoding': 'gzip'}) or 0
+
+    monkeypatch.setenv('JOB_CALL_COMPRESSION', 'gzip')
+    monkeypatch.setenv('JOB_CALL_COMPRESSION_THRESHOLD', '100')
+    with pub.activate():
+        assert call_job(None, 'adder', payload={'numbers': [1] * 1000}) == 1000
+
+    assert REGISTRY.get_sample_value('job_call_compression_saved_bytes_total', {'encoding': 'gzip'}) > saved_before
+
+
+def test_invalid_call_compression_falls_back_to_uncompressed(monkeypatch, caplog):
+    pub = LocalPub()
+    pub.add_job_entrypoint('adder', '1.0.0', instantiate_class_entrypoint('sample/adder_model.py', 'AdderModel'))
+
+    monkeypatch.setenv('JOB_CALL_COMPRESSION', 'gzp')
+    monkeypatch.setenv('JOB_CALL_COMPRESSION_THRESHOLD', '100')
+    monkeypatch.setattr('racetrack_job_wrapper.call._invalid_compression_warned', False)
+    with pub.activate():
+        assert call_job(None, 'adder', payload={'numbers': [1] * 1000}) == 1000
+        assert call_job(None, 'adder', payload={'numbers': [1] * 1000}) == 1000
+
+    assert caplog.text.count('unsupported JOB_CALL_COMPRESSION: gzp') == 1
@@ -0,0 +1,77 @@
+import collections
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from racetrack_job_wrapper.cpu_profiler import ContinuousProfiler, RollingStackSampler
+from racetrack_job_wrapper.wrapper import create_entrypoint_app
+
+
+def _busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_cpu_profiler_endpoints(monkeypatch):
+    monkeypatch.setenv('CPU_PROFILER', 'true')
+    monkeypatch.setenv('CPU_PROFILER_INTERVAL', '0.005')
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    assert client.post('/api/v1/profiler/cpu/start').status_code == 200
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy_loop, args=(stop,), name='busy-thread')
+    thread.start()
+    time.sleep(0.3)
+    stop.set()
+    thread.join()
+    assert client.post('/api/v1/profiler/cpu/stop').status_code == 200
+
+    response = client.get('/api/v1/profiler/cpu/report', params={'format': 'collapsed'})
+    assert response.status_code == 200
+    busy_lines = [line for line in response.text.splitlines() if line.startswith('busy-thread;')]
+    assert busy_lines and all('_busy_loop (test_cpu_profiler.py:' in line for line in busy_lines)
+
+    profile = client.get('/api/v1/profiler/cpu/report').json()
+    assert 'busy-thread' in [p['name'] for p in profile['profiles']]
+
+    response = client.get('/api/v1/profiler/cpu/flamegraph')
+    assert response.headers['content-type'] == 'image/svg+xml'
+    assert response.text.startswith('<svg') and '_busy_loop' in response.text
+
+
+def test_continuous_profiler_keeps_recent_samples(monkeypatch):
+    monkeypatch.setenv('CONTINUOUS_PROFILER', 'true')
+    monkeypatch.setenv('CONTINUOUS_PROFILER_FREQUENCY', '100')
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+    try:
+        stop = threading.Event()
+        thread = threading.Thread(target=_busy_loop, args=(stop,), name='busy-thread')
+        thread.start()
+        time.sleep(0.3)
+        stop.set()
+        thread.join()
+
+        response = client.get('/api/v1/profiler/continuous/flamegraph', params={'last': 60})
+        assert response.status_code == 200
+        assert '_busy_loop' in response.text
+        profile = client.get('/api/v1/profiler/continuous/report', params={'last': 60}).json()
+        assert 'busy-thread' in [p['name'] for p in profile['profiles']]
+        assert not client.get('/api/v1/profiler/continuous/report', params={'until': 0}).json()['profiles']
+
+        metrics = client.get('/metrics').text
+        assert 'continuous_profiler_cpu_seconds_total' in metrics
+    finally:
+        ContinuousProfiler.stop()
+
+
+def test_rolling_sampler_drops_oldest_slots():
+    sampler = RollingStackSampler(interval=1, slot_duration=10, slots=2)
+    for timestamp, stack in [(100, ('a',)), (115, ('b',)), (125, ('c',))]:
+        sampler._slots.append((timestamp, collections.Counter([stack])))
+
+    assert sampler.get_stacks() == {('b',): 1, ('c',): 1}
+    assert sampler.get_stacks(since=126) == {('c',): 1}
+    assert sampler.get_stacks(until=120) == {('b',): 1}
@@ -0,0 +1,252 @@
+import concurrent.futures
+import os
+import signal
+import subprocess
+import sys
+import time
+from multiprocessing import Process
+from typing import Dict, List
+
+import backoff
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from racetrack_job_wrapper.forkserver import (
+    RecycleReason,
+    WorkerRecycleMiddleware,
+    WorkerRegistry,
+    WorkerState,
+    WorkerSupervisor,
+)
+from racetrack_job_wrapper.main import run_configured_entrypoint
+from racetrack_job_wrapper.utils.request import Requests, RequestError
+from wrap.test_health import free_tcp_port
+
+
+def test_worker_registry_is_shared_with_forked_processes():
+    registry = WorkerRegistry(2)
+    pid = os.fork()
+    if pid == 0:
+        registry.set(1, os.getpid(), WorkerState.READY, 100.0)
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert registry.get(1).pid == pid
+    assert registry.get(1).state == WorkerState.READY
+    assert [worker['pid'] for worker in registry.describe()] == [pid]
+
+
+def test_forkserver_replaces_dead_workers(monkeypatch):
+    monkeypatch.setenv('WORKER_PROCESSES', '2')
+    port = free_tcp_port()
+    server_process = Process(target=run_configured_entrypoint, args=(port, 'sample/adder_model.py'))
+    try:
+        server_process.start()
+        workers = wait_for_ready_workers(port, 2)
+
+        response = Requests.post(f'http://127.0.0.1:{port}/api/v1/perform', json={'numbers': [40, 2]})
+        assert response.json() == 42
+
+        os.kill(workers[0]['pid'], signal.SIGKILL)
+        replaced_workers = wait_for_ready_workers(port, 2, excluded_pid=workers[0]['pid'])
+        assert workers[1]['pid'] in {worker['pid'] for worker in replaced_workers}
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    for worker in replaced_workers:
+        assert not _is_process_alive(worker['pid']), 'workers should be stopped along with the template process'
+
+
+@pytest.mark.parametrize('becomes_ready', [False, True], ids=['stuck_on_startup', 'stuck_after_ready'])
+def test_supervisor_replaces_unresponsive_workers(becomes_ready: bool):
+    registry = WorkerRegistry(2)
+
+    def run_worker(slot: int):
+        if becomes_ready:
+            registry.set_state(slot, WorkerState.READY)
+        time.sleep(60)  # never sending heartbeats
+
+    supervisor = WorkerSupervisor(1, registry, run_worker, startup_timeout=1.5, heartbeat_timeout=1.5)
+    supervisor_process = Process(target=supervisor.run)
+    try:
+        supervisor_process.start()
+        first_pid = _wait_for_worker_pids(registry, excluded_pid=0)[0]
+        replacement_pids = _wait_for_worker_pids(registry, excluded_pid=first_pid)
+        assert not _is_process_alive(first_pid)
+    finally:
+        supervisor_process.terminate()
+        supervisor_process.join()
+
+    for pid in replacement_pids:
+        assert not _is_process_alive(pid)
+
+
+@backoff.on_exception(backoff.constant, AssertionError, interval=0.1, max_time=10, jitter=None)
+def _wait_for_worker_pids(registry: WorkerRegistry, excluded_pid: int) -> List[int]:
+    pids = [worker['pid'] for worker in registry.describe() if worker['state'] in {'starting', 'ready'}]
+    assert pids and 0 not in pids and excluded_pid not in pids
+    return pids
+
+
+def test_forkserver_in_multiprocess_metrics_mode(tmp_path):
+    port = free_tcp_port()
+    script = f"""
+from racetrack_job_wrapper.server import run_configured_entrypoint
+run_configured_entrypoint({port}, 'sample/adder_model.py')
+"""
+    env = {**os.environ, 'WORKER_PROCESSES': '2', 'PROMETHEUS_MULTIPROC_DIR': str(tmp_path)}
+    server_process = subprocess.Popen([sys.executable, '-c', script], env=env)
+    try:
+        wait_for_ready_workers(port, 2)
+        for _ in range(4):
+            response = Requests.post(f'http://127.0.0.1:{port}/api/v1/perform', json={'numbers': [40, 2]})
+            assert response.json() == 42
+
+        metric_lines = Requests.get(f'http://127.0.0.1:{port}/metrics').text.splitlines()
+        assert 'requests_done_total 4.0' in metric_lines, 'metrics of all workers should be aggregated'
+    finally:
+        server_process.terminate()
+        server_process.wait(timeout=20)
+
+
+def test_forkserver_worker_responds_to_probes_during_warmup(tmp_path):
+    port = free_tcp_port()
+    manifest_path = tmp_path / 'job.yaml'
+    manifest_path.write_text('jobtype_extra:\n  warmup_iterations: 2\n')
+    script = f"""
+from racetrack_job_wrapper.server import run_configured_entrypoint
+run_configured_entrypoint({port}, 'sample/waiter_model.py', manifest_path='{manifest_path}')
+"""
+    env = {**os.environ, 'WORKER_PROCESSES': '1'}
+    server_process = subprocess.Popen([sys.executable, '-c', script], env=env)
+    try:
+        health = _wait_for_warming_up_worker(port)
+        assert health['workers'][0]['state'] == 'starting'
+        assert Requests.get(f'http://127.0.0.1:{port}/live').status_code == 200
+        assert Requests.get(f'http://127.0.0.1:{port}/ready').status_code == 500
+
+        wait_for_ready_workers(port, 1)
+        response = Requests.post(f'http://127.0.0.1:{port}/api/v1/perform', json={'timeout': 0})
+        assert response.json() == 0
+    finally:
+        server_process.terminate()
+        server_process.wait(timeout=20)
+
+
+@backoff.on_exception(backoff.constant, (RequestError, AssertionError), interval=0.1, max_time=10, jitter=None)
+def _wait_for_warming_up_worker(port: int) -> Dict:
+    response = Requests.get(f'http://127.0.0.1:{port}/health')
+    health = response.json()
+    assert 'worker_pid' in health, 'health should be reported by the worker'
+    assert health['startup_timings'].get('attach_entrypoint') is not None, 'worker should be warming up'
+    assert response.status_code == 500 and not health['ready']
+    return health
+
+
+def test_recycle_middleware_counts_requests_except_probes():
+    app = FastAPI()
+    app.get('/api/v1/perform')(lambda: 42)
+    app.get('/ready')(lambda: 'ready')
+    reasons: List[RecycleReason] = []
+    client = TestClient(WorkerRecycleMiddleware(app, reasons.append, max_requests=3))
+
+    for _ in range(3):
+        client.get('/api/v1/perform')
+        client.get('/ready')
+    assert reasons == [RecycleReason.MAX_REQUESTS]
+
+    client.get('/api/v1/perform')
+    assert reasons == [RecycleReason.MAX_REQUESTS], 'worker should be recycled once'
+
+
+def test_recycle_middleware_detects_memory_growth():
+    app = FastAPI()
+    app.get('/api/v1/perform')(lambda: 42)
+    reasons: List[RecycleReason] = []
+    middleware = WorkerRecycleMiddleware(app, reasons.append, max_rss_growth=32 * 1024 * 1024, rss_check_interval=0)
+    client = TestClient(middleware)
+
+    client.get('/api/v1/perform')
+    assert reasons == []
+
+    ballast = b'x' * 64 * 1024 * 1024
+    middleware.check_limits()  # periodic check of an idle worker
+    assert reasons == [RecycleReason.MEMORY_GROWTH]
+    del ballast
+
+
+def test_forkserver_recycles_workers_after_max_requests(monkeypatch):
+    monkeypatch.setenv('WORKER_PROCESSES', '1')
+    monkeypatch.setenv('WORKER_MAX_REQUESTS', '2')
+    port = free_tcp_port()
+    server_process = Process(target=run_configured_entrypoint, args=(port, 'sample/adder_model.py'))
+    try:
+        server_process.start()
+        workers = wait_for_ready_workers(port, 1)
+
+        for _ in range(2):
+            response = Requests.post(f'http://127.0.0.1:{port}/api/v1/perform', json={'numbers': [40, 2]})
+            assert response.json() == 42
+
+        replaced_workers = wait_for_ready_workers(port, 1, excluded_pid=workers[0]['pid'])
+        response = Requests.post(f'http://127.0.0.1:{port}/api/v1/perform', json={'numbers': [40, 2]})
+        assert response.json() == 42
+
+        # recycled worker is counted once it finishes draining, which may happen after its replacement is ready
+        wait_for_metric_line(port, 'worker_recycles_total{reason="max_requests"} 1.0')
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    for worker in replaced_workers:
+        assert not _is_process_alive(worker['pid'])
+
+
+def test_recycled_worker_finishes_long_requests(monkeypatch):
+    monkeypatch.setenv('WORKER_PROCESSES', '1')
+    monkeypatch.setenv('WORKER_MAX_REQUESTS', '1')
+    monkeypatch.setenv('WORKER_DRAIN_TIMEOUT', '10')
+    port = free_tcp_port()
+    server_process = Process(target=run_configured_entrypoint, args=(port, 'sample/waiter_model.py'))
+    try:
+        server_process.start()
+        workers = wait_for_ready_workers(port, 1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            long_request = executor.submit(
+                Requests.post, f'http://127.0.0.1:{port}/api/v1/perform', json={'timeout': 5}, timeout=20)
+            time.sleep(0.5)
+            response = Requests.post(f'http://127.0.0.1:{port}/api/v1/perform', json={'timeout': 0})
+            assert response.json() == 0
+            assert long_request.result().json() == 5, 'request in progress should outlive the default 3s shutdown'
+
+        wait_for_ready_workers(port, 1, excluded_pid=workers[0]['pid'])
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+
+@backoff.on_exception(backoff.fibo, (RequestError, AssertionError, KeyError), max_time=10, jitter=None)
+def wait_for_ready_workers(port: int, count: int, excluded_pid: int = 0) -> List[Dict]:
+    response = Requests.get(f'http://127.0.0.1:{port}/health')
+    response.raise_for_status()
+    workers = response.json()['workers']
+    ready_pids = {worker['pid'] for worker in workers if worker['state'] == 'ready'}
+    assert len(ready_pids) == count and excluded_pid not in ready_pids
+    return workers
+
+
+@backoff.on_exception(backoff.constant, AssertionError, interval=0.2, max_time=10, jitter=None)
+def wait_for_metric_line(port: int, expected_line: str):
+    metric_lines = Requests.get(f'http://127.0.0.1:{port}/metrics').text.splitlines()
+    assert expected_line in metric_lines
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
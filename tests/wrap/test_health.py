@@ -87,6 +87,11 @@ def test_bootstrap_server():
 
         check_health_pass(port)
 
+        startup_timings = Requests.get(f'http://127.0.0.1:{port}/health').json()['startup_timings']
+        for phase in ['create_api_scaffold', 'instantiate_entrypoint', 'attach_entrypoint', 'total']:
+            assert phase in startup_timings
+        assert startup_timings['total'] >= startup_timings['attach_entrypoint']
+
         response = Requests.get(f'http://127.0.0.1:{port}/live')
         response.raise_for_status()
         assert response.status_code == 200
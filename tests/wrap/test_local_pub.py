@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+
+from racetrack_job_wrapper import local_pub
+from racetrack_job_wrapper.call import call_job, call_job_coroutine, async_job_call
+from racetrack_job_wrapper.loader import instantiate_class_entrypoint
+from racetrack_job_wrapper.local_pub import LocalPub, LOCAL_PUB_URL, SyncASGITransport
+
+
+def test_chained_jobs_in_process():
+    pub = LocalPub()
+    pub.add_job_entrypoint('adder', '1.0.0', instantiate_class_entrypoint('sample/adder_model.py', 'AdderModel'))
+    pub.add_job_entrypoint('chain', '0.0.1', instantiate_class_entrypoint('sample/chain_model.py', 'ChainModel'))
+
+    transport = SyncASGITransport(pub)
+    with pub.activate(), httpx.Client(transport=transport, base_url=LOCAL_PUB_URL) as client:
+        response = client.post('/job/chain/latest/api/v1/perform', json={'numbers': [40, 2.2]})
+        assert response.status_code == 200, response.text
+        assert response.json() == 42
+
+        response = client.post('/job/missing/latest/api/v1/perform', json={})
+        assert response.status_code == 404
+    assert not transport._thread.is_alive(), 'closing the client should stop the event loop thread'
+
+
+def test_call_functions_through_local_pub():
+    pub = LocalPub()
+    pub.add_job_entrypoint('adder', '1.0.0', instantiate_class_entrypoint('sample/adder_model.py', 'AdderModel'))
+    pub.add_job_entrypoint('adder', '1.1.0', instantiate_class_entrypoint('sample/adder_model.py', 'AdderModel'))
+
+    with pub.activate():
+        assert call_job(None, 'adder', payload={'numbers': [1, 2]}) == 3
+        assert call_job(None, 'adder', payload={'numbers': [1, 2]}, version='1.x') == 3
+        assert asyncio.run(call_job_coroutine(None, 'adder', payload={'numbers': [2, 2]})) == 4
+        assert async_job_call(None, 'adder', payload={'numbers': [3, 2]}) == 5
+
+
+def test_unpolled_async_tasks_are_dropped(monkeypatch):
+    monkeypatch.setattr(local_pub, 'MAX_ASYNC_TASKS', 2)
+    pub = LocalPub()
+    pub.add_job_entrypoint('adder', '1.0.0', instantiate_class_entrypoint('sample/adder_model.py', 'AdderModel'))
+
+    with httpx.Client(transport=SyncASGITransport(pub), base_url=LOCAL_PUB_URL) as client:
+        task_ids = [
+            client.post('/async/new/job/adder/latest/api/v1/perform', json={'numbers': [index, 1]}).json()['task_id']
+            for index in range(3)
+        ]
+        assert len(pub._tasks) == 2
+        assert client.get(f'/async/task/{task_ids[0]}/poll').status_code == 404
+        response = client.get(f'/async/task/{task_ids[2]}/poll')
+        assert response.status_code == 200
+        assert response.json() == 3
+        assert len(pub._tasks) == 1
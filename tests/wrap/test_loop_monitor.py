@@ -0,0 +1,33 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from racetrack_job_wrapper.api.asgi.loop_monitor import EventLoopMonitorMiddleware
+
+
+def test_blocked_event_loop_is_reported(caplog):
+    app = FastAPI()
+
+    @app.get('/blocking')
+    async def _blocking_endpoint():
+        time.sleep(0.5)  # blocks the event loop
+        return 'done'
+
+    app.add_middleware(EventLoopMonitorMiddleware, interval=0.05, threshold=0.2)
+
+    with TestClient(app) as client:
+        response = client.get('/blocking', headers={'X-Request-Tracing-Id': 'blocker-123'})
+        assert response.status_code == 200
+        time.sleep(0.1)
+
+    assert 'Event loop has been blocked' in caplog.text
+    assert '_blocking_endpoint' in caplog.text, 'stack of the blocking code should be logged'
+    blocked_records = [record for record in caplog.records if 'Event loop has been blocked' in record.getMessage()]
+    assert getattr(blocked_records[0], 'tracing_id', None) == 'blocker-123'
+
+
+def test_explicit_zero_threshold_is_kept(monkeypatch):
+    monkeypatch.setenv('EVENT_LOOP_LAG_THRESHOLD', '3')
+    assert EventLoopMonitorMiddleware(FastAPI(), threshold=0).threshold == 0
+    assert EventLoopMonitorMiddleware(FastAPI()).threshold == 3
@@ -0,0 +1,169 @@
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+from racetrack_job_wrapper.profiler import AllocationTracker, MemoryProfiler, ReportGeneration
+from racetrack_job_wrapper.wrapper import create_entrypoint_app
+
+
+def test_memray_reports_are_generated_in_background(monkeypatch, tmp_path):
+    monkeypatch.setenv('MEMRAY_PROFILER', 'true')
+    monkeypatch.setattr(MemoryProfiler, 'REPORT_FILE_PATH', tmp_path / 'report.bin')
+    monkeypatch.setitem(MemoryProfiler.generations, 'stats', ReportGeneration(tmp_path / 'stats.txt'))
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    client.post('/api/v1/profiler/memray/start')
+    client.post('/api/v1/perform', json={'numbers': [40, 2]})
+    client.post('/api/v1/profiler/memray/stop')
+
+    response = client.get('/api/v1/profiler/memray/report')
+    assert response.status_code == 200
+    assert b'memray' in response.content[:32]
+
+    response = client.get('/api/v1/profiler/memray/stats')
+    assert response.status_code == 202
+    assert response.json()['state'] == 'running'
+
+    for _ in range(300):
+        if client.get('/api/v1/profiler/memray/status').json()['stats']['state'] != 'running':
+            break
+        time.sleep(0.1)
+    assert client.get('/api/v1/profiler/memray/status').json()['stats']['state'] == 'done'
+
+    response = client.get('/api/v1/profiler/memray/stats')
+    assert response.status_code == 200
+    assert 'Total allocations' in response.text
+    modified_at = (tmp_path / 'stats.txt').stat().st_mtime_ns
+    assert client.get('/api/v1/profiler/memray/stats').status_code == 200
+    assert (tmp_path / 'stats.txt').stat().st_mtime_ns == modified_at, 'cached report should be reused'
+
+
+_leaked = []
+
+
+def _leak_memory():
+    _leaked.append([1] * 1_000_000)
+
+
+def test_memray_snapshots_diff(monkeypatch, tmp_path):
+    monkeypatch.setenv('MEMRAY_PROFILER', 'true')
+    monkeypatch.setenv('MEMRAY_SNAPSHOT_INTERVAL', '0.5')
+    monkeypatch.setattr(MemoryProfiler, 'REPORT_FILE_PATH', tmp_path / 'report.bin')
+    monkeypatch.setattr(MemoryProfiler, 'SNAPSHOTS_DIR', tmp_path / 'snapshots')
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    def wait_for_snapshots(count: int):
+        for _ in range(50):
+            if len(client.get('/api/v1/profiler/memray/snapshots').json()) >= count:
+                return
+            time.sleep(0.1)
+
+    client.post('/api/v1/profiler/memray/start')
+    _leak_memory()  # steady leak in every window
+    wait_for_snapshots(1)
+    _leak_memory()
+    wait_for_snapshots(2)
+    client.post('/api/v1/profiler/memray/stop')
+
+    snapshots = client.get('/api/v1/profiler/memray/snapshots').json()
+    assert len(snapshots) >= 2
+    response = client.get('/api/v1/profiler/memray/snapshots/diff', params={
+        'before': snapshots[0]['name'],
+        'after': snapshots[1]['name'],
+    })
+    assert response.status_code == 200, response.text
+    top_site = response.json()[0]
+    assert top_site['location'].startswith('_leak_memory:')
+    assert top_site['before_bytes'] >= 8_000_000
+    assert top_site['after_bytes'] >= 16_000_000
+    assert top_site['growth_bytes'] >= 8_000_000
+
+    response = client.get('/api/v1/profiler/memray/snapshots/diff', params={
+        'before': snapshots[1]['name'],
+        'after': snapshots[0]['name'],
+    })
+    assert response.status_code == 400
+
+
+def _allocate_cache() -> bytearray:
+    return bytearray(10_000_000)
+
+
+def test_memray_snapshots_diff_matches_frees_across_windows(monkeypatch, tmp_path):
+    import memray
+
+    snapshots_dir = tmp_path / 'snapshots'
+    snapshots_dir.mkdir()
+    monkeypatch.setattr(MemoryProfiler, 'SNAPSHOTS_DIR', snapshots_dir)
+    names = [f'memray-snapshot-20260101-00000{index}.bin' for index in range(3)]
+
+    with memray.Tracker(snapshots_dir / names[0], trace_python_allocators=True):
+        cache = _allocate_cache()
+    for name in names[1:]:
+        with memray.Tracker(snapshots_dir / name, trace_python_allocators=True):
+            cache = _allocate_cache()  # previous cache, allocated in the previous window, is freed here
+            _leak_memory()
+    for index, name in enumerate(names):
+        os.utime(snapshots_dir / name, (1_000_000 + index, 1_000_000 + index))
+
+    diffs = {diff['location'].split(':')[0]: diff for diff in MemoryProfiler.diff_snapshots(names[0], names[2])}
+    assert diffs['_leak_memory']['growth_bytes'] >= 16_000_000
+    cache_diff = diffs.get('_allocate_cache', {'before_bytes': 0, 'after_bytes': 0, 'growth_bytes': 0})
+    assert cache_diff['growth_bytes'] <= 0, 'cache replaced after a rotation should not look like a leak'
+    assert cache_diff['after_bytes'] < 11_000_000, 'only the latest cache should be retained'
+    del cache
+
+
+def test_tracemalloc_allocation_tracking(monkeypatch):
+    monkeypatch.setenv('TRACEMALLOC_PROFILER', 'true')
+    monkeypatch.setattr(AllocationTracker, 'snapshots', AllocationTracker.snapshots.__class__())
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    assert client.get('/api/v1/profiler/tracemalloc/top').status_code == 400, 'tracker is not started yet'
+    try:
+        response = client.post('/api/v1/profiler/tracemalloc/start', params={'frames': 5})
+        assert response.status_code == 200
+        assert response.json()['tracing'] is True
+        assert response.json()['frames'] == 5
+
+        before = client.post('/api/v1/profiler/tracemalloc/snapshots').json()['snapshot']
+        _leak_memory()
+        after = client.post('/api/v1/profiler/tracemalloc/snapshots').json()['snapshot']
+
+        top_sites = client.get('/api/v1/profiler/tracemalloc/top', params={'limit': 5}).json()
+        assert 0 < len(top_sites) <= 5
+        assert any('test_memory_profiler.py' in site['location'] for site in top_sites)
+
+        response = client.get('/api/v1/profiler/tracemalloc/snapshots/diff', params={'before': before, 'after': after})
+        assert response.status_code == 200
+        biggest = response.json()[0]
+        assert 'test_memory_profiler.py' in biggest['location']
+        assert biggest['size_diff_bytes'] >= 8_000_000
+
+        response = client.get('/api/v1/profiler/tracemalloc/snapshots/diff',
+                              params={'before': before, 'after': after, 'group_by': 'traceback'})
+        assert len(response.json()[0]['traceback']) > 1
+    finally:
+        client.post('/api/v1/profiler/tracemalloc/stop')
+        _leaked.clear()
+    assert client.get('/api/v1/profiler/tracemalloc/status').json()['tracing'] is False
+
+
+def test_tracemalloc_tracker_stops_over_budget(monkeypatch):
+    monkeypatch.setenv('TRACEMALLOC_MAX_OVERHEAD', '1Ki')
+    monkeypatch.setattr(AllocationTracker, 'OVERHEAD_CHECK_INTERVAL', 0.01)
+    try:
+        AllocationTracker.start()
+        _leak_memory()
+        for _ in range(100):
+            if not AllocationTracker.get_status()['tracing']:
+                break
+            time.sleep(0.05)
+        assert AllocationTracker.get_status()['tracing'] is False
+    finally:
+        AllocationTracker.stop()
+        _leaked.clear()
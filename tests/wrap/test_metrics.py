@@ -1,9 +1,24 @@
+import gc
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import List
+
+import backoff
+from fastapi import Request
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 
+from racetrack_job_wrapper.api.asgi.fastapi import create_fastapi
 from racetrack_job_wrapper.health import HealthState
 from racetrack_job_wrapper.loader import instantiate_class_entrypoint
-from racetrack_job_wrapper.metrics import metric_requests_started
-from racetrack_job_wrapper.wrapper import create_api_app
+from racetrack_job_wrapper.metrics import JobMetricsCollector, metric_requests_started
+from racetrack_job_wrapper.profiler import AllocationTracker
+from racetrack_job_wrapper.wrapper import create_api_app, create_entrypoint_app
 
 
 def test_metrics_endpoint():
@@ -17,11 +32,7 @@ def test_metrics_endpoint():
     response = client.post('/api/v1/perform', json={})
     assert response.status_code == 200
 
-    response = client.get('/metrics')
-    assert response.status_code == 200
-
-    data: str = response.text
-    metric_lines = data.splitlines()
+    metric_lines = _wait_for_metric_line(client, 'job_wasted_seconds 1.2')
     assert f'requests_started_total {requests_total_before+1}' in metric_lines
 
     assert '# HELP job_wasted_seconds Seconds you have wasted here' in metric_lines
@@ -32,3 +43,193 @@ def test_metrics_endpoint():
     assert 'job_zero_value 0.0' in metric_lines, 'zero value metric should be present'
 
     assert 'job_null_value' not in metric_lines, 'null value metric is absent'
+
+
+def test_metrics_formats_and_cache():
+    model = instantiate_class_entrypoint('sample/metrics_job.py', None)
+    api_app = create_api_app(model, HealthState(live=True, ready=True))
+    client = TestClient(api_app)
+    _wait_for_metric_line(client, 'job_wasted_seconds 1.2')
+
+    response = client.get('/metrics', headers={'Accept': 'application/openmetrics-text; version=1.0.0'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/openmetrics-text')
+    assert response.text.rstrip().endswith('# EOF')
+
+    response = client.get('/metrics', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'job_wasted_seconds 1.2' in response.text.splitlines()
+    first_output = response.text
+
+    client.post('/api/v1/perform', json={})
+    response = client.get('/metrics', headers={'Accept-Encoding': 'gzip'})
+    assert response.text == first_output, 'metrics should be served from cache'
+
+
+def test_custom_metrics_are_served_from_snapshot():
+    calls = []
+
+    def slow_metrics():
+        calls.append(1)
+        if len(calls) > 1:
+            time.sleep(1)
+        return [
+            {'name': 'job_items', 'labels': {'kind': 'a'}, 'value': 1},
+            {'name': 'job_items', 'labels': {'kind': 'b'}, 'value': 2},
+        ]
+
+    collector = JobMetricsCollector(slow_metrics, refresh_interval=0.05, timeout=0.2)
+    collector.start()
+    try:
+        time.sleep(0.1)
+        families = list(collector.collect())
+        assert [family.name for family in families] == ['job_items', 'job_metrics_snapshot_age_seconds']
+        assert [sample.value for sample in families[0].samples] == [1, 2]
+
+        time.sleep(0.5)  # refresh is hanging now
+        start_time = time.monotonic()
+        families = list(collector.collect())
+        assert time.monotonic() - start_time < 0.1, 'scrape should not wait for the metrics method'
+        assert [sample.value for sample in families[0].samples] == [1, 2]
+        assert families[1].samples[0].value >= 0.2
+    finally:
+        collector.stop()
+
+
+def test_scrape_does_not_wait_for_first_custom_metrics():
+    collection_released = threading.Event()
+
+    def hanging_metrics():
+        collection_released.wait(5)
+        return [{'name': 'job_items', 'value': 1}]
+
+    collector = JobMetricsCollector(hanging_metrics, refresh_interval=0.05, timeout=0.2)
+    collector.start()
+    try:
+        time.sleep(0.3)
+        start_time = time.monotonic()
+        families = list(collector.collect())
+        assert time.monotonic() - start_time < 0.1, 'scrape should not wait for the first collection'
+        assert [family.name for family in families] == ['job_metrics_snapshot_age_seconds']
+        assert families[0].samples[0].value >= 0.3
+    finally:
+        collection_released.set()
+        collector.stop()
+
+
+@backoff.on_exception(backoff.constant, AssertionError, interval=0.2, max_time=5, jitter=None)
+def _wait_for_metric_line(client: TestClient, expected_line: str) -> List[str]:
+    """Wait until the custom metrics are collected in the background and the cached output expires"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    metric_lines = response.text.splitlines()
+    assert expected_line in metric_lines
+    return metric_lines
+
+
+def test_concurrency_metrics():
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={
+        'jobtype_extra': {'max_concurrency': 2},
+    })
+    client = TestClient(api_app)
+
+    response = client.post('/api/v1/perform', json={'numbers': [40, 2]})
+    assert response.status_code == 200
+
+    metric_lines = client.get('/metrics').text.splitlines()
+    assert 'concurrency_limit 2.0' in metric_lines
+    assert 'requests_in_flight{endpoint="/perform"} 0.0' in metric_lines
+    assert 'requests_queued{endpoint="/perform"} 0.0' in metric_lines
+    for metric in ['request_queue_wait_duration', 'request_execution_duration', 'response_serialization_duration']:
+        assert any(line.startswith(f'{metric}_count{{endpoint="/perform"}}') for line in metric_lines)
+
+
+def test_payload_size_metrics(monkeypatch, caplog):
+    monkeypatch.setenv('PAYLOAD_SIZE_LOG_THRESHOLD', '1Ki')
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    response = client.post('/pub/job/adder/latest/api/v1/perform', json={'numbers': [1] * 1000})
+    assert response.status_code == 200
+    assert 'Large payload' in caplog.text
+
+    metric_lines = client.get('/metrics').text.splitlines()
+    assert any(line.startswith('commons_request_size_bytes_count{endpoint="/perform"}') for line in metric_lines)
+    assert any(line.startswith('commons_response_size_bytes_count{endpoint="/perform"}') for line in metric_lines)
+
+
+def test_payload_size_metrics_count_streamed_bodies(monkeypatch, caplog):
+    monkeypatch.setenv('PAYLOAD_SIZE_LOG_THRESHOLD', '1Ki')
+    app = create_fastapi(title='Streaming', description='')
+
+    @app.post('/streamed/{name}')
+    async def _stream_back(request: Request):
+        body = await request.body()
+        return StreamingResponse(iter([body, body]), media_type='application/octet-stream')
+
+    client = TestClient(app)
+    response = client.post('/streamed/x', content=iter([b'a' * 1000, b'b' * 1000]))  # chunked, no Content-Length
+    assert response.status_code == 200
+    assert len(response.content) == 4000
+
+    labels = {'endpoint': '/streamed/{name}'}
+    assert REGISTRY.get_sample_value('commons_request_size_bytes_sum', labels) == 2000
+    assert REGISTRY.get_sample_value('commons_response_size_bytes_sum', labels) == 4000
+    assert 'Large payload: POST /streamed/x 200, request size: 2000 bytes, response size: 4000 bytes' in caplog.text
+
+
+def test_runtime_metrics():
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+    gc.collect()
+
+    metric_lines = client.get('/metrics').text.splitlines()
+    metric_names = {line.split('{')[0].split(' ')[0] for line in metric_lines if not line.startswith('#')}
+    assert 'commons_memory_rss_bytes' in metric_names
+    assert 'commons_threads' in metric_names
+    assert 'commons_threadpool_max_threads' in metric_names
+    assert 'commons_gc_collections_total' in metric_names
+    assert 'commons_gc_frozen_objects' in metric_names
+    assert any(line.startswith('commons_gc_pause_duration_count{generation="2"}') for line in metric_lines)
+
+
+def test_gc_callback_does_not_deadlock_in_multiprocess_mode(tmp_path):
+    # garbage collection triggered while prometheus_client allocates a metric child holds its non-reentrant lock
+    script = """
+import gc
+from prometheus_client import Histogram
+from racetrack_job_wrapper.api.runtime_metrics import install_gc_callback
+install_gc_callback()
+gc.set_threshold(1)
+histogram = Histogram('gc_deadlock_check', 'Metric allocating children during garbage collections', ['name'])
+for index in range(500):
+    histogram.labels(name=str(index)).observe(1)
+"""
+    env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(tmp_path)}
+    subprocess.run([sys.executable, '-c', script], env=env, check=True, timeout=30)
+
+
+def test_endpoint_resource_accounting(monkeypatch):
+    monkeypatch.setenv('ENDPOINT_RESOURCE_ACCOUNTING', 'true')
+    monkeypatch.setenv('ENDPOINT_ALLOCATION_SAMPLE_RATE', '1')
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    response = client.post('/api/v1/perform', json={'numbers': [1] * 100_000})
+    assert response.status_code == 200
+    assert not tracemalloc.is_tracing(), 'allocations should be traced only during the sampled call'
+
+    metric_lines = client.get('/metrics').text.splitlines()
+    assert any(line.startswith('endpoint_cpu_time_count{endpoint="/perform"}') for line in metric_lines)
+    allocated_sum = next(line for line in metric_lines
+                         if line.startswith('endpoint_allocated_bytes_sum{endpoint="/perform"}'))
+    assert float(allocated_sum.split(' ')[1]) > 0
+
+    try:
+        AllocationTracker.start(frames=5)
+        response = client.post('/api/v1/perform', json={'numbers': [1] * 100_000})
+        assert response.status_code == 200
+        assert tracemalloc.is_tracing(), 'resource accounting should not stop the allocation tracker'
+        assert tracemalloc.get_traceback_limit() == 5
+    finally:
+        AllocationTracker.stop()
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+SCRIPT = textwrap.dedent('''
+    import multiprocessing
+    import os
+    import time
+
+    from fastapi.testclient import TestClient
+
+    from racetrack_job_wrapper.api.metrics import reset_multiprocess_dir
+    from racetrack_job_wrapper.health import HealthState
+    from racetrack_job_wrapper.loader import instantiate_class_entrypoint
+    from racetrack_job_wrapper.metrics import metric_requests_started, metric_last_call_timestamp
+    from racetrack_job_wrapper.wrapper import create_api_app
+
+    def worker(calls: int):
+        metric_requests_started.inc(calls)
+        metric_last_call_timestamp.set(1000 + calls)
+
+    if __name__ == '__main__':
+        reset_multiprocess_dir()
+        context = multiprocessing.get_context('fork')
+        for calls in [2, 3]:
+            process = context.Process(target=worker, args=(calls,))
+            process.start()
+            process.join()
+
+        model = instantiate_class_entrypoint('sample/metrics_job.py', None)
+        client = TestClient(create_api_app(model, HealthState(live=True, ready=True)))
+        for _ in range(50):  # custom metrics are collected in the background
+            metric_lines = client.get('/metrics').text.splitlines()
+            if 'job_wasted_seconds 1.2' in metric_lines:
+                break
+            time.sleep(0.1)
+        assert 'requests_started_total 5.0' in metric_lines, metric_lines
+        assert 'last_call_timestamp 1003.0' in metric_lines, metric_lines
+        assert 'job_wasted_seconds 1.2' in metric_lines, 'metrics of the job entrypoint are missing'
+        print('OK')
+''')
+
+
+def test_metrics_aggregated_from_multiple_processes(tmp_path: Path):
+    script_path = tmp_path / 'multiprocess_metrics.py'
+    script_path.write_text(SCRIPT)
+    multiproc_dir = tmp_path / 'prometheus'
+    (multiproc_dir).mkdir()
+    (multiproc_dir / 'counter_999999.db').write_bytes(b'stale file of a previous run')
+
+    env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(multiproc_dir)}
+    result = subprocess.run([sys.executable, str(script_path)], env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'OK' in result.stdout
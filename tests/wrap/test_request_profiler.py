@@ -0,0 +1,96 @@
+import pytest
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from racetrack_job_wrapper.request_profiler import RequestProfiler
+from racetrack_job_wrapper.wrapper import create_entrypoint_app
+from racetrack_job_wrapper.wrapper_api import _setup_request_profiler_endpoints
+
+
+def test_request_profiles(monkeypatch, tmp_path):
+    monkeypatch.setenv('REQUEST_PROFILER', 'true')
+    monkeypatch.setenv('REQUEST_PROFILER_DIR', str(tmp_path))
+    monkeypatch.setenv('REQUEST_PROFILER_TOKEN', 'secret')
+    monkeypatch.setenv('REQUEST_PROFILER_RATE_LIMIT', '2')
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    response = client.post('/api/v1/perform', json={'numbers': [40, 2]})
+    assert 'X-Racetrack-Profile-Id' not in response.headers
+
+    response = client.post('/api/v1/perform', json={'numbers': [40, 2]},
+                           headers={'X-Racetrack-Profile': 'cpu', 'X-Racetrack-Profile-Token': 'wrong'})
+    assert response.json() == 42
+    assert 'X-Racetrack-Profile-Id' not in response.headers, 'invalid token should be rejected'
+
+    profile_headers = {'X-Racetrack-Profile': 'cpu', 'X-Racetrack-Profile-Token': 'secret'}
+    response = client.post('/api/v1/perform', json={'numbers': [40, 2]}, headers=profile_headers)
+    assert response.json() == 42
+    profile_id = response.headers['X-Racetrack-Profile-Id']
+    assert client.get(f'/api/v1/profiler/requests/{profile_id}').status_code == 401, 'download requires the token'
+    token_headers = {'X-Racetrack-Profile-Token': 'secret'}
+    profile = client.get(f'/api/v1/profiler/requests/{profile_id}', headers=token_headers).json()
+    assert profile['$schema'] == 'https://www.speedscope.app/file-format-schema.json'
+
+    response = client.post('/api/v1/perform', json={'numbers': [40, 2]},
+                           headers={**profile_headers, 'X-Racetrack-Profile': 'memory'})
+    assert response.json() == 42
+    profile_id = response.headers['X-Racetrack-Profile-Id']
+    response = client.get(f'/api/v1/profiler/requests/{profile_id}', headers=token_headers)
+    assert response.status_code == 200
+    assert b'memray' in response.content[:32]
+
+    response = client.post('/api/v1/perform', json={'numbers': [40, 2]}, headers=profile_headers)
+    assert 'X-Racetrack-Profile-Id' not in response.headers, 'rate limit should be exceeded'
+
+
+def test_request_profile_download_rejects_path_traversal(tmp_path):
+    profiles_dir = tmp_path / 'profiles'
+    profiles_dir.mkdir()
+    (tmp_path / 'secret.txt').write_text('secret')
+    router = APIRouter()
+    _setup_request_profiler_endpoints(router, RequestProfiler(profiles_dir, token='secret'))
+    download_profile = router.routes[0].endpoint
+    # HTTP clients normalize dot segments of the URL, so the handler is called with the raw ID
+    request = Request({'type': 'http', 'headers': [(b'x-racetrack-profile-token', b'secret')]})
+    for profile_id in ['../secret.txt', '../secret', '..%2Fsecret.txt', '/etc/passwd', '*']:
+        with pytest.raises(HTTPException) as excinfo:
+            download_profile(profile_id=profile_id, request=request)
+        assert excinfo.value.status_code == 404
+
+
+def test_request_profiler_rejects_everything_without_token(monkeypatch, tmp_path):
+    monkeypatch.setenv('REQUEST_PROFILER', 'true')
+    monkeypatch.setenv('REQUEST_PROFILER_DIR', str(tmp_path))
+    monkeypatch.delenv('REQUEST_PROFILER_TOKEN', raising=False)
+    api_app = create_entrypoint_app('sample/adder_model.py', class_name='AdderModel', manifest_dict={})
+    client = TestClient(api_app)
+
+    response = client.post('/api/v1/perform', json={'numbers': [40, 2]},
+                           headers={'X-Racetrack-Profile': 'cpu', 'X-Racetrack-Profile-Token': ''})
+    assert response.json() == 42
+    assert 'X-Racetrack-Profile-Id' not in response.headers
+    assert client.get(f'/api/v1/profiler/requests/{"0" * 32}').status_code == 401
+
+
+def test_request_profiler_rejects_non_ascii_tokens(tmp_path):
+    request_profiler = RequestProfiler(tmp_path, token='secret')
+    request = Request({'type': 'http', 'headers': [(b'x-racetrack-profile-token', 'é'.encode('latin-1'))]})
+    assert request_profiler.is_authorized(request) is False
+
+    router = APIRouter()
+    _setup_request_profiler_endpoints(router, request_profiler)
+    with pytest.raises(HTTPException) as excinfo:
+        router.routes[0].endpoint(profile_id='0' * 32, request=request)
+    assert excinfo.value.status_code == 401
+
+    profile_request = Request({'type': 'http', 'headers': [
+        (b'x-racetrack-profile', b'cpu'),
+        (b'x-racetrack-profile-token', 'é'.encode('latin-1')),
+    ]})
+    endpoint_caller = lambda: 42
+    assert request_profiler.wrap_call(endpoint_caller, profile_request, {}) is endpoint_caller
+
+    non_ascii_profiler = RequestProfiler(tmp_path, token='sécret')
+    request = Request({'type': 'http', 'headers': [(b'x-racetrack-profile-token', 'sécret'.encode())]})
+    assert non_ascii_profiler.is_authorized(request) is True
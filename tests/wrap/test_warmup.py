@@ -0,0 +1,64 @@
+from http import HTTPMethod
+from typing import List
+
+from prometheus_client import REGISTRY
+
+from racetrack_job_wrapper.endpoint_config import EndpointConfig
+from racetrack_job_wrapper.health import HealthState
+from racetrack_job_wrapper.warmup import warm_up_job
+from racetrack_job_wrapper.wrapper_api import create_api_app
+
+
+class ExamplesJob:
+    def __init__(self):
+        self.calls: List[str] = []
+
+    def perform(self, x: int) -> int:
+        self.calls.append(f'perform {x}')
+        return x
+
+    def docs_input_example(self):
+        return {'x': 1}
+
+    def docs_input_examples(self):
+        return {'/square': {'y': 3}}
+
+    def auxiliary_endpoints_v2(self):
+        return [EndpointConfig(path='/square', method=HTTPMethod.GET, handler=self.square)]
+
+    def square(self, y: int) -> int:
+        self.calls.append(f'square {y}')
+        return y * y
+
+
+class WarmupHookJob(ExamplesJob):
+    def warmup(self):
+        self.calls.append('warmup')
+
+
+def test_warmup_replays_input_examples():
+    job = ExamplesJob()
+    api_app = create_api_app(job, HealthState(live=True), {'jobtype_extra': {'warmup_iterations': 2}})
+
+    warm_up_job(job, api_app, {'warmup_iterations': 2})
+
+    assert sorted(job.calls) == ['perform 1', 'perform 1', 'square 3', 'square 3']
+    assert REGISTRY.get_sample_value('warmup_duration') > 0
+
+
+def test_warmup_hook_takes_precedence():
+    job = WarmupHookJob()
+    api_app = create_api_app(job, HealthState(live=True), {})
+
+    warm_up_job(job, api_app, {'warmup_iterations': 2})
+
+    assert job.calls == ['warmup']
+
+
+def test_warmup_disabled_by_default():
+    job = ExamplesJob()
+    api_app = create_api_app(job, HealthState(live=True), {})
+
+    warm_up_job(job, api_app, {})
+
+    assert job.calls == []